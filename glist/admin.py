@@ -1,10 +1,65 @@
 from django.contrib import admin
+from django.urls import reverse
+from django.utils.html import format_html
 
-from .models import Brand, GiftList, Guest, Product, Purchase
+from .exports import csv_response
+from .invitations import send_in_background
+from .models import Brand, GiftList, GiftListSummary, Guest, Product, Purchase
+
+
+@admin.register(GiftList)
+class GiftListAdmin(admin.ModelAdmin):
+    actions = ['export_purchased', 'export_remaining', 'send_invitations']
+    list_display = ['wedding_name', 'wedding_date', 'active', 'items', 'units',
+                    'units_purchased', 'raised']
+    list_select_related = ['summary']
+
+    # totals come from the summary row, see `glist.summary`
+    def total(self, obj, name):
+        try:
+            return getattr(obj.summary, name)
+        except GiftListSummary.DoesNotExist:
+            return None
+
+    def items(self, obj):
+        return self.total(obj, 'items')
+
+    def units(self, obj):
+        return self.total(obj, 'units')
+
+    def units_purchased(self, obj):
+        return self.total(obj, 'units_purchased')
+
+    def raised(self, obj):
+        return self.total(obj, 'raised')
+
+    def export_purchased(self, request, queryset):
+        return csv_response('purchased', queryset)
+    export_purchased.short_description = 'Export purchased items as CSV'
+
+    def export_remaining(self, request, queryset):
+        return csv_response('remaining', queryset)
+    export_remaining.short_description = 'Export remaining items as CSV'
+
+    def send_invitations(self, request, queryset):
+        ids = list(queryset.values_list('pk', flat=True))
+        send_in_background(ids)
+        # failures are only logged, their guests are left not invited
+        uninvited = '%s?invited_at__isempty=1&wedding__in=%s' % (
+            reverse('admin:glist_guest_changelist'), ','.join(map(str, ids)))
+        self.message_user(request, format_html(
+            'Mailing the announcement in the background to the guests of {} list(s) who '
+            'haven\'t been invited yet. Guests whose mail fails are left '
+            '<a href="{}">not invited</a>, the action retries them.', len(ids), uninvited))
+    send_invitations.short_description = 'Mail the announcement to their guests'
+
+
+@admin.register(Guest)
+class GuestAdmin(admin.ModelAdmin):
+    list_display = ['recipient', 'email', 'wedding', 'invited_at']
+    list_filter = [('invited_at', admin.EmptyFieldListFilter)]
 
 
 admin.site.register(Brand)
-admin.site.register(GiftList)
-admin.site.register(Guest)
 admin.site.register(Product)
 admin.site.register(Purchase)
@@ -1,13 +1,32 @@
+from decimal import Decimal, InvalidOperation
 from functools import wraps
+from itertools import chain
 import json
 
-from django.core.serializers import serialize
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Exists, IntegerField, OuterRef, Q, Value, When
 from django.db.models.expressions import F
 from django.forms.models import model_to_dict
-from django.http import (Http404, HttpResponseBadRequest,
-                         HttpResponseNotAllowed, JsonResponse)
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseNotAllowed, JsonResponse,
+                         StreamingHttpResponse)
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
-from .models import (Brand, Currency, Product, GiftList, GiftListItem, Purchase)
+from . import facets, search, stock, summary
+from .models import (Brand, Currency, Product, GiftList, GiftListItem, GiftListSummary,
+                     Purchase)
+from .signals import removing_items_in_bulk
+from .versions import get_version, get_versions, list_version_name
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+STREAM_CHUNK_ROWS = 100
+# what the database takes for an integer column
+MAX_INT = 2 ** 63 - 1
+# and for the PositiveSmallIntegerField quantities
+MAX_QTY = 32767
 
 
 def allowed(*methods):
@@ -39,15 +58,216 @@ def authenticated(endpoint):
     return wrapped
 
 
+def int_param(value) -> int:
+    """
+    A query parameter as an int, ValueError if it isn't one or if it would
+        overflow an integer column
+    """
+    value = int(value)
+    if not -MAX_INT - 1 <= value <= MAX_INT:
+        raise ValueError('%d is out of range' % value)
+    return value
+
+
+def is_id(value) -> bool:
+    """
+    Whether a decoded JSON value can be looked up as an id
+    """
+    return type(value) == int and 0 < value <= MAX_INT
+
+
+def field_names(kls):
+    """
+    Names of the model's concrete fields, as passed to `.values()`
+    Foreign keys come out under the field name, holding the related pk
+    """
+    return [f.name for f in kls._meta.concrete_fields]
+
+
+def stream_json(rows):
+    """
+    Encodes an iterable of dicts as a JSON array, a chunk of rows at a time,
+        so that the whole document is never held in memory
+    """
+    encode = DjangoJSONEncoder().encode
+    sep = '['
+    chunk = []
+    for row in rows:
+        chunk.append(sep + encode(row))
+        sep = ','
+        if len(chunk) == STREAM_CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append('[]' if sep == '[' else ']')
+    yield ''.join(chunk)
+
+
+def json_stream_response(rows):
+    return StreamingHttpResponse(stream_json(rows), content_type='application/json')
+
+
+def read_out(response):
+    """
+    The response, or if streamed an HttpResponse of its content read in full
+    """
+    if not response.streaming:
+        return response
+    content = b''.join(response.streaming_content)
+    streamed, response = response, HttpResponse(content, status=response.status_code)
+    for header, value in streamed.items():
+        response[header] = value
+    return response
+
+
+def catalog_etag(request, kls=Product):
+    name = kls._meta.model_name
+    if kls is not Product:
+        return '%s-%d' % (name, get_version(name))
+    # available units change with reservations and purchases
+    return '%s-%d-%d' % ((name,) + tuple(get_versions(name, 'stock')))
+
+
+def gift_list_etag(request, gift_list_id=None):
+    """
+    Changes along with the list, its guests or the catalog it is joined to
+    Without `gift_list_id` it refers to the current user's own list
+    """
+    if gift_list_id is None:
+        gift_list_id = GiftList.objects.filter(user=request.user).values_list('pk', flat=True).first()
+        if gift_list_id is None:
+            return None
+    versions = get_versions('product', 'brand', list_version_name(gift_list_id))
+    return 'list-%d-%d-%s' % (gift_list_id, request.user.pk, '-'.join(map(str, versions)))
+
+
 @allowed('GET')
+@cache_control(no_cache=True)
+@condition(etag_func=catalog_etag)
 def object_list(request, kls):
-    objs = kls.objects.all()
-    output = serialize('json', objs, indent=2)
-    return JsonResponse(output, safe=False)
+    objs = kls.objects.values(*field_names(kls)).iterator()
+    return json_stream_response(objs)
+
 
+def product_values(products):
+    return products.values(*field_names(Product), available=F('qty') - F('qty_reserved'))
 
+
+@allowed('GET')
+@cache_control(no_cache=True)
+@condition(etag_func=catalog_etag)
 def product_list(request):
-    return object_list(request, Product)
+    """
+    Product catalog, keyset-paginated on `id`
+    `after` takes the cursor (last `id` received) and `limit` the page size.
+    Can be filtered by `brand`, `currency` (both repeatable),
+        `min_price`, `max_price` and `in_stock` (1/0, by available units)
+    The cursor for the next page, if any, is returned in `X-Next-Cursor`
+    """
+    params = request.GET
+    try:
+        after = int_param(params.get('after', 0))
+        limit = int_param(params.get('limit', PAGE_SIZE))
+        brands = [int_param(b) for b in params.getlist('brand')]
+        min_price = Decimal(params['min_price']) if 'min_price' in params else None
+        max_price = Decimal(params['max_price']) if 'max_price' in params else None
+    except (ValueError, InvalidOperation):
+        return HttpResponseBadRequest()
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        return HttpResponseBadRequest()
+
+    objs = product_values(Product.objects.filter(pk__gt=after).order_by('pk'))
+    if brands:
+        objs = objs.filter(brand_id__in=brands)
+    currencies = [c.upper() for c in params.getlist('currency')]
+    if currencies:
+        objs = objs.filter(currency_id__in=currencies)
+    if min_price is not None:
+        objs = objs.filter(price__gte=min_price)
+    if max_price is not None:
+        objs = objs.filter(price__lte=max_price)
+    if params.get('in_stock') in ('1', 'true'):
+        objs = objs.filter(available__gt=0)
+    elif params.get('in_stock') in ('0', 'false'):
+        objs = objs.filter(available__lte=0)
+
+    # One extra row tells whether there is a next page
+    page = list(objs[:limit + 1])
+    response = json_stream_response(page[:limit])
+    if len(page) > limit:
+        response['X-Next-Cursor'] = page[limit - 1]['id']
+    return response
+
+
+def product_brand_etag(request):
+    # for results that also depend on brand names
+    return 'product-%d-%d-brand-%d' % tuple(get_versions('product', 'stock', 'brand'))
+
+
+@allowed('GET')
+@cache_control(no_cache=True)
+@condition(etag_func=product_brand_etag)
+def product_search(request):
+    """
+    Products whose name or brand match every word in `q`, best matches first
+    Paginated with `page` (from 1) and `limit`; the next page, if any,
+        is returned in `X-Next-Page`
+    """
+    try:
+        page = int(request.GET.get('page', 1))
+        limit = int(request.GET.get('limit', PAGE_SIZE))
+    except ValueError:
+        return HttpResponseBadRequest()
+    # the offset of the page, and the extra id past it, must fit the database
+    if not 0 < limit <= MAX_PAGE_SIZE or not 1 <= page < MAX_INT // limit:
+        return HttpResponseBadRequest()
+    # One extra id tells whether there is a next page
+    ids = search.search_ids(request.GET.get('q', ''), (page - 1) * limit, limit + 1)
+    rows = {row['id']: row for row in product_values(Product.objects.filter(pk__in=ids[:limit]))}
+    response = json_stream_response([rows[pk] for pk in ids[:limit] if pk in rows])
+    if len(ids) > limit:
+        response['X-Next-Page'] = page + 1
+    return response
+
+
+@allowed('GET')
+@cache_control(no_cache=True)
+@condition(etag_func=product_brand_etag)
+def product_browse(request):
+    """
+    Products narrowed by `brand`, `currency` and price `band` (all repeatable,
+        see facets.PRICE_BANDS), with the counts of every facet
+    Keyset-paginated on `id` like `product_list`, the cursor for the next
+        page being returned in `next`
+    """
+    params = request.GET
+    try:
+        after = int_param(params.get('after', 0))
+        limit = int_param(params.get('limit', PAGE_SIZE))
+        brands = [int_param(b) for b in params.getlist('brand')]
+        bands = [int_param(b) for b in params.getlist('band')]
+    except ValueError:
+        return HttpResponseBadRequest()
+    if not 0 < limit <= MAX_PAGE_SIZE or not all(0 <= b < len(facets.PRICE_BANDS) for b in bands):
+        return HttpResponseBadRequest()
+    currencies = [c.upper() for c in params.getlist('currency')]
+
+    objs = Product.objects.filter(pk__gt=after).order_by('pk')
+    if brands:
+        objs = objs.filter(brand_id__in=brands)
+    if currencies:
+        objs = objs.filter(currency_id__in=currencies)
+    if bands:
+        in_bands = Q()
+        for band in bands:
+            lower, upper = facets.band_range(band)
+            in_bands |= Q(price__gte=lower, price__lt=upper) if upper else Q(price__gte=lower)
+        objs = objs.filter(in_bands)
+    page = list(product_values(objs)[:limit + 1])
+    return JsonResponse({
+        'products': page[:limit],
+        'facets': facets.facet_counts(brands, currencies, bands),
+        'next': page[limit - 1]['id'] if len(page) > limit else None,
+    })
 
 
 def brand_list(request):
@@ -60,11 +280,73 @@ def currency_list(request):
 
 @allowed('GET')
 @authenticated
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=gift_list_etag)
 def gift_list(request):
     gl = GiftList.objects.get(user=request.user)
-    items = GiftListItem.objects.filter(gift_list=gl)
-    output = serialize('json', items, indent=2)
-    return JsonResponse(output, safe=False)
+    items = GiftListItem.objects.filter(gift_list=gl).values(*field_names(GiftListItem))
+    return json_stream_response(items.iterator())
+
+
+def gift_list_rows(items):
+    """
+    Joins GiftList items to their product, brand and currency,
+        adding the effective price and the quantity left to purchase
+    """
+    rows = items.order_by('pk').values(
+        'id', 'product', 'qty', 'qty_purchased', 'price',
+        name=F('product__name'),
+        brand_name=F('product__brand__name'),
+        currency=F('product__currency_id'),
+        product_price=F('product__price'),
+        remaining=F('qty') - F('qty_purchased'))
+    for row in rows.iterator():
+        # same as GiftListItem.get_price()
+        price, product_price = row.pop('price'), row.pop('product_price')
+        row['effective_price'] = price or product_price
+        yield row
+
+
+@allowed('GET')
+@authenticated
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=gift_list_etag)
+def gift_list_view(request, gift_list_id):
+    """
+    Everything a couple or guest page needs to show a GiftList, in one query
+    The list is visible to its owner and, once active, to its guests, 404
+        for anyone else
+    """
+    readers = Q(user=request.user) | Q(active=True, guest__user=request.user)
+    visible = GiftList.objects.filter(readers, pk=OuterRef('gift_list_id'))
+    rows = gift_list_rows(GiftListItem.objects.filter(Exists(visible), gift_list_id=gift_list_id))
+    first = next(rows, None)
+    if first is None:
+        # no items, or not visible: only then does it take a second query
+        if not GiftList.objects.filter(readers, pk=gift_list_id).exists():
+            raise Http404()
+        return json_stream_response([])
+    return json_stream_response(chain([first], rows))
+
+
+@allowed('GET')
+@authenticated
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=gift_list_etag)
+def gift_list_summary(request, gift_list_id):
+    """
+    Progress of a GiftList: items, units wanted and purchased, money raised
+    Visible to the same users as its items
+    """
+    visible = GiftList.objects.filter(Q(user=request.user) | Q(active=True, guest__user=request.user),
+                                      pk=gift_list_id)
+    if not visible.exists():
+        raise Http404()
+    rows = GiftListSummary.objects.filter(gift_list_id=gift_list_id).values(*summary.FIELDS)
+    if not rows:
+        summary.reconcile([gift_list_id])
+        rows = rows.all()
+    return JsonResponse(rows[0])
 
 
 @allowed('POST')
@@ -73,6 +355,7 @@ def gift_add(request):
     """
     Takes a product ID and adds it as a gift item to the user's GiftList
     If the item already exists, increases its count
+    Each unit added reserves one unit of the product's stock
     """
     data = json.loads(request.body)
     if type(data.get('product_id', 'error')) != int:
@@ -80,16 +363,29 @@ def gift_add(request):
     product_id = data['product_id']
     gl = GiftList.objects.get(user=request.user)
     product = Product.objects.get(pk=product_id)
-    # Check if its there already
-    try:
-        item = GiftListItem.objects.get(gift_list=gl, product=product)
-    except GiftListItem.DoesNotExist:
-        item = GiftListItem(gift_list=gl, product=product,
-                            price=product.price, added_by=request.user)
-    else:
-        item.qty += 1
-    item.added_by = request.user
-    item.save()
+    with transaction.atomic():
+        try:
+            stock.reserve(product.pk)
+        except stock.OutOfStock:
+            return JsonResponse({'errors': ['Product is out of stock']}, status=409)
+        # Check if its there already
+        created = False
+        try:
+            item = GiftListItem.objects.select_for_update().get(gift_list=gl, product=product)
+        except GiftListItem.DoesNotExist:
+            try:
+                # (gift_list, product) is unique, a concurrent add may create it first
+                with transaction.atomic():
+                    item = GiftListItem.objects.create(gift_list=gl, product=product,
+                                                       price=product.price, added_by=request.user)
+                created = True
+            except IntegrityError:
+                item = GiftListItem.objects.select_for_update().get(gift_list=gl, product=product)
+        if not created:
+            item.qty += 1
+            item.added_by = request.user
+            item.save()
+        summary.adjust(gl.pk, items=int(created), units=1)
     output = model_to_dict(item)
     return JsonResponse(output)
 
@@ -100,48 +396,204 @@ def gift_remove(request, item_id):
     """
     Removes 1 Item count from the current user's GiftList
     If it's the only account of that item, removes the item entirely
+    Releases the stock reservation of the unit, and refuses to go below
+    the units already purchased
     """
     gl = GiftList.objects.get(user=request.user)
-    item = GiftListItem.objects.get(gift_list=gl, pk=item_id)
-    output = model_to_dict(item)
-    if item.qty == 1:
-        item.delete()
-    else:
-        item.qty -= 1
-        item.save()
+    with transaction.atomic():
+        try:
+            # locked so a purchase can't land between the check and the update
+            item = GiftListItem.objects.select_for_update().get(gift_list=gl, pk=item_id)
+        except GiftListItem.DoesNotExist:
+            return JsonResponse({'errors': ['Item %d is not in the list' % item_id]}, status=404)
+        if item.qty <= item.qty_purchased:
+            return JsonResponse({'errors': ['Product %d has %d units purchased'
+                                            % (item.product_id, item.qty_purchased)]}, status=409)
+        output = model_to_dict(item)
+        if item.qty == 1:
+            # nothing purchased: its reservation is released on delete (see signals)
+            item.delete()
+            summary.adjust(gl.pk, items=-1, units=-1)
+        else:
+            stock.release(item.product_id)
+            item.qty -= 1
+            item.save(update_fields=['qty'])
+            summary.adjust(gl.pk, units=-1)
     output['qty'] -= 1
     return JsonResponse(output)
 
 
+GIFT_OPS = ('add', 'remove', 'set')
+
+
+def parse_gift_ops(ops):
+    """
+    Validates the shape of batch operations on a GiftList
+    Returns (op, key, id, qty) tuples, or None if any operation is malformed
+    """
+    if type(ops) != list or not ops:
+        return None
+    parsed = []
+    for op in ops:
+        if type(op) != dict or op.get('op') not in GIFT_OPS:
+            return None
+        key = 'item_id' if 'item_id' in op and op['op'] != 'add' else 'product_id'
+        qty = op.get('qty', 1)
+        if not is_id(op.get(key)) or type(qty) != int:
+            return None
+        if not (0 if op['op'] == 'set' else 1) <= qty <= MAX_QTY:
+            return None
+        parsed.append((op['op'], key, op[key], qty))
+    return parsed
+
+
+def apply_gift_ops(user, gl, ops) -> tuple:
+    """
+    Applies parsed add/remove/set operations to the items of `gl`
+        in one transaction, with the same number of queries however many
+    Returns the status to answer with and the errors if any, in which case
+        nothing was changed: 404 when an operation names an item not in
+        the list, 409 otherwise
+    """
+    item_ids = {value for op, key, value, qty in ops if key == 'item_id'}
+    product_ids = {value for op, key, value, qty in ops if key == 'product_id'}
+    with transaction.atomic():
+        items = list(GiftListItem.objects.select_for_update().filter(
+            Q(pk__in=item_ids) | Q(product_id__in=product_ids), gift_list=gl))
+        by_id = {i.pk: i for i in items}
+        by_product = {i.product_id: i for i in items}
+        old_qty = {i.pk: i.qty for i in items}
+        products = Product.objects.select_for_update().in_bulk(
+            product_ids | {i.product_id for i in items})
+
+        errors, missing = [], False
+        for op, key, value, qty in ops:
+            item = by_id.get(value) if key == 'item_id' else by_product.get(value)
+            if item is None:
+                if key == 'item_id' or op == 'remove':
+                    errors.append('%s %d is not in the list'
+                                  % ('Item' if key == 'item_id' else 'Product', value))
+                    missing = True
+                    continue
+                if value not in products:
+                    errors.append('Product %d does not exist' % value)
+                    continue
+                item = GiftListItem(gift_list=gl, product=products[value], qty=0,
+                                    price=products[value].price, added_by=user)
+                by_product[value] = item
+            if op == 'add':
+                item.qty += qty
+            elif op == 'remove':
+                if qty > item.qty:
+                    errors.append('Product %d has only %d units listed' % (item.product_id, item.qty))
+                    continue
+                item.qty -= qty
+            else:
+                item.qty = qty
+            item.added_by = user
+
+        reserved = {}
+        for item in by_product.values():
+            if item.qty > MAX_QTY:
+                errors.append('Product %d can have %d units at most' % (item.product_id, MAX_QTY))
+                continue
+            if item.qty < item.qty_purchased:
+                errors.append('Product %d has %d units purchased' % (item.product_id, item.qty_purchased))
+            # only units not purchased yet hold a reservation
+            delta = max(item.qty - item.qty_purchased, 0) - max(old_qty.get(item.pk, 0) - item.qty_purchased, 0)
+            reserved[item.product_id] = delta
+            if delta > 0 and products[item.product_id].available() < delta:
+                errors.append('Product %d is out of stock' % item.product_id)
+        if errors:
+            return 404 if missing else 409, errors
+
+        added = [i for i in by_product.values() if i.pk is None and i.qty]
+        units = sum(i.qty - old_qty.get(i.pk, 0) for i in by_product.values())
+        GiftListItem.objects.bulk_create(added)
+        GiftListItem.objects.bulk_update([i for i in by_product.values()
+                                          if i.pk is not None and i.qty and i.qty != old_qty[i.pk]],
+                                         ['qty', 'added_by'])
+        removed = [i.pk for i in by_product.values() if i.pk is not None and not i.qty]
+        if removed:
+            # their reservations are released with the others and the list
+            # version is bumped once, by adjust_bulk
+            with removing_items_in_bulk():
+                GiftListItem.objects.filter(pk__in=removed).delete()
+        stock.adjust_reservations(reserved)
+        summary.adjust_bulk(gl.pk, items=len(added) - len(removed), units=units)
+    return 200, []
+
+
+@allowed('POST')
+@authenticated
+def gift_batch(request):
+    """
+    Applies several changes to the user's GiftList at once
+    Takes {"ops": [{"op": "add", "product_id": <id>, "qty": <n>},
+                   {"op": "remove", "item_id"|"product_id": <id>, "qty": <n>},
+                   {"op": "set", "item_id"|"product_id": <id>, "qty": <n>}, ...]}
+        `qty` defaults to 1 and setting it to 0 removes the item
+    Either all operations are applied or none is; returns the updated items,
+        or the errors with 404 if an operation names an item not in the
+        list, 409 otherwise
+    """
+    data = json.loads(request.body)
+    ops = parse_gift_ops(data.get('ops'))
+    if ops is None:
+        return HttpResponseBadRequest()
+    gl = GiftList.objects.get(user=request.user)
+    status, errors = apply_gift_ops(request.user, gl, ops)
+    if errors:
+        return JsonResponse({'errors': errors}, status=status)
+    return json_stream_response(gift_list_rows(GiftListItem.objects.filter(gift_list=gl)))
+
+
+@allowed('PUT')
+@authenticated
+def gift_update(request, item_id):
+    """
+    Sets the quantity of an item in the current user's GiftList, 0 removes it
+    """
+    data = json.loads(request.body)
+    if type(data.get('qty', 'error')) != int or not 0 <= data['qty'] <= MAX_QTY:
+        return HttpResponseBadRequest()
+    gl = GiftList.objects.get(user=request.user)
+    status, errors = apply_gift_ops(request.user, gl, [('set', 'item_id', item_id, data['qty'])])
+    if errors:
+        return JsonResponse({'errors': errors}, status=status)
+    rows = list(gift_list_rows(GiftListItem.objects.filter(gift_list=gl, pk=item_id)))
+    return JsonResponse(rows[0] if rows else {'id': item_id, 'qty': 0}, encoder=DjangoJSONEncoder)
+
+
 def gift(request):
     if request.method == 'GET':
         return gift_list(request)
     elif request.method == 'POST':
         return gift_add(request)
     else:
-        return HttpResponseNotAllowed()
+        return HttpResponseNotAllowed(['GET', 'POST'])
 
 
 def gift_item(request, item_id):
     if request.method == 'DELETE':
         return gift_remove(request, item_id)
-    # elif request.method == 'PUT':
-    #   to be implemented
+    elif request.method == 'PUT':
+        return gift_update(request, item_id)
     # elif request.method == 'GET':
     #   to be implemented
     else:
-        return HttpResponseNotAllowed()
+        return HttpResponseNotAllowed(['DELETE', 'PUT'])
 
 
 @allowed('GET')
 @authenticated
 def purchase_list(request, gift_list_id):
-    guest = request.user.invitations.get(wedding_id=gift_list_id)
+    guest = request.user.invitations.select_related('wedding').get(wedding_id=gift_list_id)
     gl = guest.wedding
     if not gl.active:
-        return Http404()
-    items = serialize('json', Purchase.objects.filter(customer=guest))
-    return JsonResponse(items, safe=False)
+        raise Http404()
+    items = Purchase.objects.filter(customer=guest).values(*field_names(Purchase))
+    return json_stream_response(items.iterator())
 
 
 @allowed('POST')
@@ -149,27 +601,89 @@ def purchase_list(request, gift_list_id):
 def purchase_add(request, gift_list_id):
     """
     Buy 1 count of Gift from the GiftList <gift_list_id>
+    The item is claimed with a single conditional UPDATE, so concurrent
+        guests can never buy more than its `qty`
     """
-    guest = request.user.invitations.get(wedding_id=gift_list_id)
+    guest = request.user.invitations.select_related('wedding').get(wedding_id=gift_list_id)
     gl = guest.wedding
     if not gl.active:
-        return Http404()
+        raise Http404()
     data = json.loads(request.body)
     if type(data.get('item_id', 'error')) != int:
         return HttpResponseBadRequest()
     item_id = data['item_id']
-    try:
-        item = GiftListItem.objects.get(pk=item_id, qty__gt=F('qty_purchased'))
-    except GiftListItem.DoesNotExist:
-        return JsonResponse({'errors': ['Item could not be purchased']}, status_code=404)
-    else:
+    with transaction.atomic():
+        claimed = GiftListItem.objects.filter(
+            pk=item_id, gift_list=gl, qty_purchased__lt=F('qty')
+        ).update(qty_purchased=F('qty_purchased') + 1)
+        if not claimed:
+            return JsonResponse({'errors': ['Item could not be purchased']}, status=404)
+        item = GiftListItem.objects.select_related('product').get(pk=item_id)
         purchase = Purchase(customer=guest, item=item, qty=1, total=item.get_price())
         purchase.save()
-        # Increase the amount of acquired related gift item
-        item.qty_purchased += 1
-        item.save()
-        output = model_to_dict(purchase)
-        return JsonResponse(output)
+        stock.commit(item.product_id)
+        summary.adjust(gl.pk, units_purchased=1, raised=purchase.total)
+    output = model_to_dict(purchase)
+    return JsonResponse(output)
+
+
+@allowed('POST')
+@authenticated
+def checkout(request, gift_list_id):
+    """
+    Buys several items from the GiftList <gift_list_id> in one go
+    Takes {"items": [{"item_id": <id>, "qty": <count>}, ...]}
+    Either every line is purchased or, if any of them can't be, none is
+    """
+    guest = request.user.invitations.select_related('wedding').get(wedding_id=gift_list_id)
+    gl = guest.wedding
+    if not gl.active:
+        raise Http404()
+    data = json.loads(request.body)
+    lines = data.get('items')
+    if type(lines) != list or not lines:
+        return HttpResponseBadRequest()
+    wanted = {}
+    for line in lines:
+        if type(line) != dict or not is_id(line.get('item_id')) or type(line.get('qty', 1)) != int:
+            return HttpResponseBadRequest()
+        if not 1 <= line.get('qty', 1) <= MAX_QTY:
+            return HttpResponseBadRequest()
+        wanted[line['item_id']] = wanted.get(line['item_id'], 0) + line.get('qty', 1)
+        if wanted[line['item_id']] > MAX_QTY:
+            return HttpResponseBadRequest()
+
+    with transaction.atomic():
+        # the lines are claimed with one conditional UPDATE, as in purchase_add,
+        # so concurrent checkouts can never buy more than an item's `qty`
+        adding = Case(*[When(pk=pk, then=Value(qty)) for pk, qty in wanted.items()],
+                      output_field=IntegerField())
+        claimable = GiftListItem.objects.filter(pk__in=wanted, gift_list=gl,
+                                                qty_purchased__lte=F('qty') - adding)
+        if claimable.update(qty_purchased=F('qty_purchased') + adding) < len(wanted):
+            transaction.set_rollback(True)
+            purchases = None
+        else:
+            items = GiftListItem.objects.select_related('product').in_bulk(wanted)
+            purchases = []
+            units = {}
+            for item_id, qty in wanted.items():
+                item = items[item_id]
+                units[item.product_id] = units.get(item.product_id, 0) + qty
+                purchases.append(Purchase(customer=guest, item=item, qty=qty,
+                                          total=item.get_price() * qty))
+            Purchase.objects.bulk_create(purchases)
+            stock.commit_many(units)
+            summary.adjust_bulk(gl.pk, units_purchased=sum(wanted.values()),
+                                raised=sum(p.total for p in purchases))
+    if purchases is None:
+        # rolled back, the lines that fall short say why
+        available = set(claimable.values_list('pk', flat=True))
+        errors = ['Item %d could not be purchased' % item_id for item_id in wanted
+                  if item_id not in available]
+        return JsonResponse({'errors': errors}, status=409)
+    output = [dict(item=p.item_id, qty=p.qty, total=p.total) for p in purchases]
+    return JsonResponse({'purchases': output, 'total': sum(p.total for p in purchases)})
 
 
 def purchase(request, *args, **kwargs):
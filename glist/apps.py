@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class GlistConfig(AppConfig):
     name = 'glist'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,63 @@
+"""
+Async versions of the read-heavy API endpoints, for `wshop.asgi`
+
+The ORM is synchronous, so each view runs the matching `glist.api` view
+on a bounded thread pool (GLIST_ASYNC_DB_WORKERS threads, so as many
+database connections at most) while the event loop serves other
+requests. Streamed responses are read out in that same thread, as
+Django 3.1 would otherwise iterate them, and query, in the event loop.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import api
+from .profiling import current_profile
+
+executor = ThreadPoolExecutor(max_workers=getattr(settings, 'GLIST_ASYNC_DB_WORKERS', 8),
+                              thread_name_prefix='db')
+
+
+def buffered(view):
+    """
+    Wraps a view so that a streamed response comes back read in full
+    """
+    def run(request, *args, **kwargs):
+        close_old_connections()
+        try:
+            return api.read_out(view(request, *args, **kwargs))
+        finally:
+            close_old_connections()
+    return run
+
+
+def in_executor(view):
+    """
+    Turns a synchronous view into a coroutine run on the thread pool
+    """
+    run = buffered(view)
+
+    @wraps(view)
+    async def wrapped(request, *args, **kwargs):
+        if current_profile.get() is not None:
+            # in the thread that profiles it, see `glist.middleware`
+            return await sync_to_async(run, thread_sensitive=True)(request, *args, **kwargs)
+        loop = asyncio.get_event_loop()
+        # in the request's context, as `glist.metrics` counts its queries there
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(executor, partial(context.run, run, request, *args, **kwargs))
+    return wrapped
+
+
+currency_list = in_executor(api.currency_list)
+brand_list = in_executor(api.brand_list)
+product_list = in_executor(api.product_list)
+product_search = in_executor(api.product_search)
+gift_list_view = in_executor(api.gift_list_view)
+gift_list_summary = in_executor(api.gift_list_summary)
+purchase_list = in_executor(api.purchase_list)
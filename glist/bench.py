@@ -0,0 +1,544 @@
+"""
+Benchmark scenarios, run with the `benchmark` management command
+
+Each scenario runs against a throwaway test database and returns
+a dict of named measurements. Measurements ending in `_per_s` or `_rps`
+are better higher, the others lower; `regressions` compares a run with
+a saved baseline.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+import http.client
+import json
+import socket
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.test import Client, modify_settings, override_settings
+from django.db import connection
+from django.utils import timezone
+
+from .datagen import ROWS_PER_LIST, generate
+from .models import Brand, Currency, GiftList, GiftListItem, Guest, Product, Purchase
+
+SCENARIOS = {}
+HIGHER_IS_BETTER = ('_per_s', '_rps')
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+@contextmanager
+def scratch_database():
+    """
+    Runs the block against a freshly migrated test database
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@contextmanager
+def timer():
+    """
+    Yields a dict whose `elapsed` is set, in seconds, once the block is done
+    """
+    out = {}
+    start = time.perf_counter()
+    try:
+        yield out
+    finally:
+        out['elapsed'] = time.perf_counter() - start
+
+
+@contextmanager
+def peak_memory():
+    """
+    Yields a dict whose `peak` is set, in bytes, once the block is done
+    """
+    out = {}
+    tracemalloc.start()
+    try:
+        yield out
+    finally:
+        out['peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+
+def build_gift_list(purchases: int, items: int = 500, guests: int = 200) -> int:
+    """
+    Creates a gift list with `items` products, `guests` guests and
+        `purchases` purchases spread over them, returns its id
+    """
+    User = get_user_model()
+    couple = User.objects.create_user('bench-couple')
+    gl = GiftList.objects.create(wedding_date=date.today(), wedding_name='Benchmark',
+                                 spouse_x_name='X', spouse_y_name='Y', user=couple)
+    Currency.objects.get_or_create(code='GBP')
+    Brand.objects.bulk_create([Brand(name='Bench brand %d' % i) for i in range(50)])
+    brands = list(Brand.objects.filter(name__startswith='Bench brand'))
+    Product.objects.bulk_create([
+        Product(name='Bench product %d with a rather longer name than usual' % i,
+                price=Decimal(i % 300 + 10), qty=purchases, brand=brands[i % len(brands)])
+        for i in range(items)])
+    products = list(Product.objects.filter(name__startswith='Bench product'))
+    GiftListItem.objects.bulk_create([
+        GiftListItem(gift_list=gl, product=p, qty=purchases, added_by=couple) for p in products])
+    User.objects.bulk_create([User(username='bench-guest-%d' % i) for i in range(guests)])
+    users = list(User.objects.filter(username__startswith='bench-guest'))
+    Guest.objects.bulk_create([
+        Guest(email='%s@example.com' % u.username, recipient='Guest %d' % u.pk,
+              wedding=gl, user=u) for u in users])
+    list_items = list(GiftListItem.objects.filter(gift_list=gl).select_related('product'))
+    customers = list(Guest.objects.filter(wedding=gl))
+    Purchase.objects.bulk_create([
+        Purchase(item=list_items[i % len(list_items)], customer=customers[i % len(customers)],
+                 total=list_items[i % len(list_items)].product.price)
+        for i in range(purchases)], batch_size=1000)
+    # spread the purchases over a few months
+    now = timezone.now()
+    for day in range(90):
+        Purchase.objects.filter(item__gift_list=gl, pk__gt=day * purchases // 90,
+                                pk__lte=(day + 1) * purchases // 90
+                                ).update(date_paid=now - timedelta(days=day))
+    return gl.pk
+
+
+def feed_rows(count: int, brands: int = 500, start: int = 1):
+    """
+    Synthetic supplier feed rows, in the `load_products` format
+    """
+    for i in range(start, start + count):
+        yield {
+            'id': i,
+            'name': 'Product %d' % i,
+            'brand': 'Brand %d' % (i % brands),
+            'price': '%d.%02d%s' % (i % 900 + 5, i % 100, 'EUR' if i % 7 == 0 else 'GBP'),
+            'in_stock_quantity': i % 40,
+        }
+
+
+@contextmanager
+def feed_file(count: int, start: int = 1):
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as feed:
+        json.dump(list(feed_rows(count, start=start)), feed)
+        feed.flush()
+        yield feed.name
+
+
+@scenario('load_products')
+def load_products(size: int):
+    """
+    Rows/second loading a fresh feed, row by row and in bulk
+    """
+    results = {}
+    with feed_file(size) as filename:
+        for mode, options in (('per_row', {}), ('bulk', {'bulk': True})):
+            with scratch_database(), timer() as t:
+                call_command('load_products', filename, verbosity=0, **options)
+            results['%s_rows_per_s' % mode] = size / t['elapsed']
+    return results
+
+
+@scenario('load_products_workers')
+def load_products_workers(size: int, files: int = 8):
+    """
+    Rows/second loading a feed split in several files, with 1, 2 and 4 parsers
+    """
+    results = {}
+    per_file = size // files
+    with ExitStack() as stack:
+        filenames = [stack.enter_context(feed_file(per_file, start=i * per_file + 1))
+                     for i in range(files)]
+        for workers in (1, 2, 4):
+            options = {'workers': workers, 'bulk': True, 'stream': True}
+            with scratch_database(), timer() as t:
+                call_command('load_products', *filenames, verbosity=0, **options)
+            results['workers_%d_rows_per_s' % workers] = per_file * files / t['elapsed']
+    return results
+
+
+@scenario('report')
+def report(size: int):
+    """
+    Render time and peak memory of the PDF report of a list with `size`
+        purchases, with the original and the fast renderer
+    """
+    from .reports import render_report
+    results = {}
+    with scratch_database():
+        gift_list_id = build_gift_list(size)
+        for mode, fast in (('legacy', False), ('fast', True)):
+            with timer() as t:
+                render_report(gift_list_id, fast=fast)
+            results['%s_render_s' % mode] = t['elapsed']
+            # tracemalloc slows rendering down a lot, so measured apart
+            with peak_memory() as mem:
+                render_report(gift_list_id, fast=fast)
+            results['%s_peak_mb' % mode] = mem['peak'] / 1024 / 1024
+    return results
+
+
+@scenario('search')
+def search(size: int, queries: int = 50):
+    """
+    Milliseconds per product search on a catalog of `size` products
+    """
+    from .search import search_ids
+    words = ['tea', 'lamp', 'mixer', 'grill', 'parasol', 'oak', 'set', 'blue']
+    with scratch_database():
+        Currency.objects.get_or_create(code='GBP')
+        Brand.objects.bulk_create([Brand(name='Maker%d' % i) for i in range(500)])
+        brands = list(Brand.objects.values_list('pk', flat=True))
+        for start in range(0, size, 10000):
+            Product.objects.bulk_create([
+                Product(name='%s %s no %d' % (words[i % 8].title(), words[i % 7], i),
+                        price=10, brand_id=brands[i % len(brands)])
+                for i in range(start, min(start + 10000, size))])
+        results = {}
+        for name, query in (('word', 'lamp'), ('prefix', 'par'), ('words', 'tea blue'),
+                            ('brand', 'maker12 lamp')):
+            with timer() as t:
+                for _ in range(queries):
+                    search_ids(query, 0, 100)
+            results['%s_ms' % name] = t['elapsed'] * 1000 / queries
+    return results
+
+
+@contextmanager
+def wsgi_server():
+    """
+    Serves `wshop.wsgi` as `runserver` does, yields its port
+    """
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+    from django.core.wsgi import get_wsgi_application
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=False)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@contextmanager
+def asgi_server():
+    """
+    Serves `wshop.asgi` with uvicorn, yields its port
+    """
+    import uvicorn
+    from django.core.asgi import get_asgi_application
+    from .sse import router
+
+    class Server(uvicorn.Server):
+        def install_signal_handlers(self):
+            # not the main thread
+            pass
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    config = uvicorn.Config(router(get_asgi_application()), loop='asyncio', lifespan='off',
+                            log_level='warning', access_log=False)
+    server = Server(config)
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield sock.getsockname()[1]
+    finally:
+        server.should_exit = True
+        thread.join()
+        sock.close()
+
+
+def load(port: int, path: str, headers: dict, concurrency: int, requests: int) -> dict:
+    """
+    Requests/second and 99th percentile latency, in milliseconds, of
+        `requests` GETs of `path` sent by `concurrency` clients at once
+    """
+    def get(_):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        start = time.perf_counter()
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        assert response.status == 200, response.status
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(concurrency) as clients, timer() as t:
+        latencies = sorted(clients.map(get, range(requests)))
+    return {'rps': requests / t['elapsed'],
+            'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000}
+
+
+@scenario('wsgi_vs_asgi')
+def wsgi_vs_asgi(size: int, requests: int = 500, levels=(1, 4, 16, 64)):
+    """
+    Requests/second and p99 latency of a catalog page and of a gift list
+        with `size` purchases, served by the sync views over WSGI and the
+        async ones over ASGI, at rising concurrency
+    Servers and clients share this process, so only the comparison counts
+    """
+    results = {}
+    with scratch_database():
+        gift_list_id = build_gift_list(size, items=100)
+        client = Client()
+        client.force_login(get_user_model().objects.get(username='bench-couple'))
+        headers = {'Cookie': client.cookies.output(header='', sep=';').strip()}
+        endpoints = (('catalog', 'product/?limit=50'),
+                     ('list', 'list/%d/items/' % gift_list_id))
+        for deployment, server, prefix in (('wsgi', wsgi_server, '/api/'),
+                                           ('asgi', asgi_server, '/api/async/')):
+            with server() as port:
+                for name, path in endpoints:
+                    for concurrency in levels:
+                        out = load(port, prefix + path, headers, concurrency, requests)
+                        for metric, value in out.items():
+                            results['%s_%s_c%d_%s' % (deployment, name, concurrency, metric)] = value
+    return results
+
+
+@scenario('metrics_overhead')
+def metrics_overhead(size: int, requests: int = 2000):
+    """
+    Milliseconds per request of a gift list with `size` purchases, with and
+        without `glist.middleware.metrics_middleware`
+    """
+    results = {}
+    with scratch_database():
+        gift_list_id = build_gift_list(size, items=100)
+        user = get_user_model().objects.get(username='bench-couple')
+        url = '/api/list/%d/summary/' % gift_list_id
+        for mode, change in (('off', {'remove': 'glist.middleware.metrics_middleware'}),
+                             ('on', {})):
+            with modify_settings(MIDDLEWARE=change):
+                client = Client(HTTP_HOST='localhost')
+                client.force_login(user)
+                with timer() as t:
+                    for _ in range(requests):
+                        client.get(url)
+            results['metrics_%s_ms' % mode] = t['elapsed'] * 1000 / requests
+    results['overhead_us'] = (results['metrics_on_ms'] - results['metrics_off_ms']) * 1000
+    return results
+
+
+@scenario('generate')
+def generate_data(size: int):
+    """
+    Rows/second generating about `size` rows of synthetic data
+    """
+    with scratch_database(), timer() as t:
+        rows = sum(generate(max(1, size // ROWS_PER_LIST)).values())
+    return {'rows_per_s': rows / t['elapsed']}
+
+
+def generated_site(size: int) -> dict:
+    """
+    Generates about `size` rows, returns what the scenarios request:
+        a couple's list with an item, a guest of it and a product
+    """
+    # two lists at least, for a catalog larger than a list's items
+    generate(max(2, size // ROWS_PER_LIST))
+    gl = GiftList.objects.filter(active=True).order_by('pk').first()
+    item = gl.items.order_by('pk').first()
+    # plenty to buy and to add, every run
+    GiftListItem.objects.filter(pk=item.pk).update(qty=30000)
+    product = Product.objects.exclude(giftlistitem__gift_list=gl).order_by('pk').first()
+    Product.objects.filter(pk=product.pk).update(qty=30000)
+    return {'list': gl.pk, 'couple': gl.user, 'guest': Guest.objects.filter(wedding=gl).first().user,
+            'item': item.pk, 'product': product.pk}
+
+
+def endpoint_requests(site: dict) -> list:
+    """
+    (name, user, requests) for the views and API endpoints, where requests
+        are (method, url, body) sent in a row
+    """
+    gl, item = site['list'], site['item']
+    couple, guest = site['couple'], site['guest']
+    def get(url):
+        return [('GET', url, None)]
+    return [
+        ('index', None, get('/')),
+        ('couple', couple, get('/couple/')),
+        ('guest', guest, get('/guest/%d/' % gl)),
+        ('report', couple, get('/report/')),
+        ('export', couple, get('/export/purchased/')),
+        ('api_currency', None, get('/api/currency/')),
+        ('api_brand', None, get('/api/brand/')),
+        ('api_product', None, get('/api/product/?limit=50')),
+        ('api_product_search', None, get('/api/product/search/?q=oak+lamp')),
+        ('api_product_browse', None, get('/api/product/browse/?currency=GBP')),
+        ('api_gift', couple, get('/api/list/')),
+        ('api_gift_view', guest, get('/api/list/%d/items/' % gl)),
+        ('api_gift_summary', guest, get('/api/list/%d/summary/' % gl)),
+        ('api_purchase_list', guest, get('/api/list/%d/purchase/' % gl)),
+        ('api_gift_add_remove', couple, [
+            ('POST', '/api/list/', '{"product_id": %d}' % site['product']),
+            ('DELETE', '/api/list/{item}/', None)]),
+        ('api_purchase', guest, [('POST', '/api/list/%d/purchase/' % gl, '{"item_id": %d}' % item)]),
+        ('api_checkout', guest, [('POST', '/api/list/%d/checkout/' % gl,
+                                  '{"items": [{"item_id": %d, "qty": 2}]}' % item)]),
+    ]
+
+
+class QueryCounter(object):
+    """
+    Database execute wrapper counting queries, whether or not they are
+        logged: the query log keeps the last 9000 only, which earlier
+        scenarios of a run may have used up
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def send(client: Client, requests: list):
+    """
+    Sends the requests in a row, reading streamed responses out
+        `{item}` in a url is the id of the item the previous response is about
+    """
+    previous = None
+    for method, url, body in requests:
+        if previous is not None:
+            url = url.replace('{item}', str(previous.json()['id']))
+        resp = client.generic(method, url, body or '', HTTP_HOST='localhost')
+        if resp.streaming:
+            b''.join(resp.streaming_content)
+        assert resp.status_code == 200, (url, resp.status_code)
+        previous = resp
+
+
+@scenario('endpoints')
+def endpoints(size: int, repeat: int = 20):
+    """
+    Median milliseconds and queries per request of every view and API
+        endpoint, through the test client, on about `size` rows
+    """
+    results = {}
+    with scratch_database():
+        site = generated_site(size)
+        for name, user, requests in endpoint_requests(site):
+            client = Client()
+            if user is not None:
+                client.force_login(user)
+            times = []
+            for _ in range(repeat):
+                queries = QueryCounter()
+                with connection.execute_wrapper(queries), timer() as t:
+                    send(client, requests)
+                times.append(t['elapsed'])
+            results['%s_ms' % name] = sorted(times)[len(times) // 2] * 1000
+            results['%s_queries' % name] = queries.count
+    return results
+
+
+@scenario('http')
+def http_load(size: int, requests: int = 300, concurrency: int = 8):
+    """
+    Requests/second and p99 latency of the read endpoints over HTTP, from
+        `concurrency` client threads, on about `size` rows
+    """
+    results = {}
+    with scratch_database():
+        site = generated_site(size)
+        sessions = {}
+        for role in ('couple', 'guest'):
+            client = Client()
+            client.force_login(site[role])
+            sessions[site[role]] = {'Cookie': client.cookies.output(header='', sep=';').strip()}
+        with wsgi_server() as port:
+            for name, user, reqs in endpoint_requests(site):
+                if len(reqs) > 1 or reqs[0][0] != 'GET':
+                    continue
+                out = load(port, reqs[0][1], sessions.get(user, {}), concurrency, requests)
+                for metric, value in out.items():
+                    results['%s_%s' % (name, metric)] = value
+    return results
+
+
+def regressions(baseline: dict, results: dict, tolerance: float) -> list:
+    """
+    Measurements of `results` worse than in `baseline` by more than the
+        `tolerance` fraction, or for query counts by any amount
+    """
+    out = []
+    for metric, value in sorted(results.items()):
+        base = baseline.get(metric)
+        if base is None:
+            continue
+        if metric.endswith('_queries'):
+            worse = value > base
+        elif base <= 0:
+            # a difference of noise, can't be compared in proportion
+            continue
+        elif metric.endswith(HIGHER_IS_BETTER):
+            worse = value < base * (1 - tolerance)
+        else:
+            worse = value > base * (1 + tolerance)
+        if worse:
+            out.append('%s: %.2f, baseline %.2f' % (metric, value, base))
+    return out
+
+
+class LatencyBackend(locmem.EmailBackend):
+    """
+    locmem backend taking as long as a nearby SMTP server would: a round
+        trip per message and a few per connection
+    """
+    ROUND_TRIP = 0.002  # seconds
+
+    def open(self):
+        time.sleep(self.ROUND_TRIP * 3)
+        return super().open()
+
+    def send_messages(self, messages):
+        time.sleep(self.ROUND_TRIP * len(messages))
+        return super().send_messages(messages)
+
+
+@scenario('invitations')
+def invitations(size: int):
+    """
+    Messages/second mailing the `size` guests of a list, with 1 and with
+        4 workers, over a simulated SMTP server
+    """
+    from .invitations import send_invitations
+    results = {}
+    with scratch_database(), override_settings(EMAIL_BACKEND='glist.bench.LatencyBackend'):
+        gift_list = GiftList.objects.get(pk=build_gift_list(0, items=1, guests=size))
+        for workers in (1, 4):
+            with timer() as t:
+                sent, _ = send_invitations(gift_list, workers=workers, resend=True)
+            results['workers_%d_messages_per_s' % workers] = sent / t['elapsed']
+            mail.outbox = []
+    return results
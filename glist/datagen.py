@@ -0,0 +1,164 @@
+"""
+Synthetic data at realistic ratios, for benchmarks
+
+`generate(lists)` adds `lists` gift lists with their couples, guests,
+items and purchases, and a catalog sized to match (see RATIOS). Rows go
+in as plain tuples with explicit primary keys through `executemany`:
+building model instances for `bulk_create` would take most of the time.
+The same seed gives the same data. Summaries and facet counts are
+rebuilt once the rows are in.
+"""
+from datetime import date, timedelta
+import random
+
+from django.contrib.auth import get_user_model
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import facets, summary
+from .models import Brand, Currency, GiftList, GiftListItem, Guest, Product, Purchase
+from .versions import bump_version
+
+# per gift list
+RATIOS = {
+    'products': 40,
+    'guests': 80,
+    'items': 50,
+    'purchases': 60,
+}
+PRODUCTS_PER_BRAND = 100
+# rows each list brings, brands aside: itself, its couple, guests with their
+# users, items, purchases and its share of the catalog
+ROWS_PER_LIST = 2 + 2 * RATIOS['guests'] + RATIOS['items'] + RATIOS['purchases'] + RATIOS['products']
+CURRENCIES = ('GBP', 'EUR', 'USD')
+BATCH = 5000
+
+ADJECTIVES = ('Oak', 'Copper', 'Linen', 'Stoneware', 'Glass', 'Walnut', 'Enamel', 'Marble',
+              'Bamboo', 'Cast iron', 'Porcelain', 'Wool')
+NOUNS = ('tea set', 'lamp', 'stand mixer', 'grill', 'parasol', 'blanket', 'vase', 'toaster',
+         'wine glasses', 'serving bowl', 'kettle', 'cutlery set', 'duvet', 'mirror')
+
+
+def next_pk(model) -> int:
+    return (model.objects.aggregate(pk=Max('pk'))['pk'] or 0) + 1
+
+
+def insert(model, columns: tuple, rows: list):
+    """
+    Inserts `rows`, tuples of database values for `columns` (attnames),
+        filling the other columns with their defaults, or now for
+        auto_now(_add) dates
+    """
+    now = timezone.now()
+    given, rest = [], []
+    for field in model._meta.concrete_fields:
+        if field.attname in columns:
+            given.append(field)
+        elif getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+            rest.append((field, field.get_db_prep_save(now, connection)))
+        else:
+            rest.append((field, field.get_db_prep_save(field.get_default(), connection)))
+    given.sort(key=lambda field: columns.index(field.attname))
+    fixed = tuple(value for _, value in rest)
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(f.column) for f in given + [f for f, _ in rest]),
+        ', '.join(['%s'] * (len(given) + len(rest))))
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH):
+            cursor.executemany(sql, [row + fixed for row in rows[start:start + BATCH]])
+
+
+def generate(lists: int, seed: int = 0) -> dict:
+    """
+    Adds `lists` gift lists and everything that goes with them, returns
+        the number of rows added per model
+    """
+    rng = random.Random(seed)
+    User = get_user_model()
+    adapt_date = connection.ops.adapt_datefield_value
+    with transaction.atomic():
+        for code in CURRENCIES:
+            Currency.objects.get_or_create(code=code)
+
+        # each list picks its items among distinct products
+        n_products = max(lists * RATIOS['products'], RATIOS['items'])
+        n_brands = max(1, n_products // PRODUCTS_PER_BRAND)
+        brand_pk = next_pk(Brand)
+        insert(Brand, ('id', 'name'),
+               [(brand_pk + i, 'Maker %d' % (brand_pk + i)) for i in range(n_brands)])
+        product_pk = next_pk(Product)
+        prices = [str(rng.choice((5, 12, 25, 40, 60, 90, 150, 300, 700))) + '.99'
+                  for _ in range(n_products)]
+        reserved = [0] * n_products
+
+        user_pk, list_pk, guest_pk = next_pk(User), next_pk(GiftList), next_pk(Guest)
+        item_pk, purchase_pk = next_pk(GiftListItem), next_pk(Purchase)
+        users, gift_lists, guests, items, purchases = [], [], [], [], []
+        today = date.today()
+        for _ in range(lists):
+            couple_pk = user_pk
+            users.append((couple_pk, 'couple-%d' % couple_pk, '!'))
+            user_pk += 1
+            gift_lists.append((list_pk, couple_pk, rng.random() < 0.9,
+                               adapt_date(today + timedelta(days=rng.randint(-60, 300))),
+                               'Wedding %d' % list_pk, 'X', 'Y'))
+            list_guests = []
+            for _ in range(RATIOS['guests']):
+                users.append((user_pk, 'guest-%d' % user_pk, '!'))
+                guests.append((guest_pk, list_pk, user_pk, 'guest-%d@example.com' % user_pk,
+                               'Guest %d' % user_pk))
+                list_guests.append(guest_pk)
+                user_pk += 1
+                guest_pk += 1
+            # [pk, product index, qty, purchased]
+            list_items = [[item_pk + n, index, rng.randint(1, 6), 0]
+                          for n, index in enumerate(rng.sample(range(n_products), RATIOS['items']))]
+            item_pk += len(list_items)
+            for _ in range(RATIOS['purchases']):
+                item = rng.choice(list_items)
+                if item[3] < item[2]:
+                    item[3] += 1
+                    purchases.append((purchase_pk, item[0], rng.choice(list_guests),
+                                      prices[item[1]]))
+                    purchase_pk += 1
+            for pk, index, qty, purchased in list_items:
+                reserved[index] += qty - purchased
+                items.append((pk, list_pk, product_pk + index, qty, purchased, prices[index],
+                              couple_pk))
+            list_pk += 1
+
+        insert(Product, ('id', 'brand_id', 'currency_id', 'name', 'price', 'qty_reserved', 'qty'), [
+            (product_pk + i, brand_pk + i % n_brands,
+             CURRENCIES[0] if rng.random() < 0.8 else rng.choice(CURRENCIES),
+             '%s %s %d' % (rng.choice(ADJECTIVES), rng.choice(NOUNS), product_pk + i),
+             prices[i], reserved[i], reserved[i] + rng.randint(0, 20))
+            for i in range(n_products)])
+        insert(User, ('id', 'username', 'password'), users)
+        insert(GiftList, ('id', 'user_id', 'active', 'wedding_date', 'wedding_name',
+                          'spouse_x_name', 'spouse_y_name'), gift_lists)
+        insert(Guest, ('id', 'wedding_id', 'user_id', 'email', 'recipient'), guests)
+        insert(GiftListItem, ('id', 'gift_list_id', 'product_id', 'qty', 'qty_purchased', 'price',
+                              'added_by_id'), items)
+        insert(Purchase, ('id', 'item_id', 'customer_id', 'total'), purchases)
+        # spread the purchases over the last months
+        first, now = purchase_pk - len(purchases), timezone.now()
+        for day in range(90):
+            Purchase.objects.filter(pk__gte=first + day * len(purchases) // 90,
+                                    pk__lt=first + (day + 1) * len(purchases) // 90
+                                    ).update(date_paid=now - timedelta(days=day))
+        # explicit keys leave sequences behind on other databases
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [
+                    Brand, Product, User, GiftList, Guest, GiftListItem, Purchase]):
+                cursor.execute(sql)
+
+        summary.reconcile()
+        facets.rebuild()
+        # raw inserts don't send post_save
+        for name in ('brand', 'currency', 'product', 'stock'):
+            bump_version(name)
+    return dict(brands=n_brands, products=n_products, users=len(users), lists=lists,
+                guests=len(guests), items=len(items), purchases=len(purchases))
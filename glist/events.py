@@ -0,0 +1,153 @@
+"""
+Publish/subscribe of gift list changes, across processes
+
+A list changed when its version counter (see `glist.versions`) moved,
+and those live in the database: whichever process or server wrote the
+change, each process serving events sees it. One thread per process
+polls the counters of the lists its pages follow, every POLL_INTERVAL
+seconds and in a single query, and only while there are subscribers.
+Subscribers are asyncio queues fed from that thread.
+Events carry the rows of the items that changed, as `gift_list_rows`
+gives them, and the ids of those removed, found by comparing the list
+with the rows read at its previous version, so pages patch them in place.
+A subscriber that wasn't at that version, or whose queue overflowed, gets
+all the rows instead (`full`).
+"""
+import asyncio
+from collections import defaultdict
+from threading import Lock, Thread
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from .api import gift_list_rows
+from .models import GiftListItem, Version
+from .versions import get_version, list_version_name
+
+QUEUE_SIZE = 16
+POLL_INTERVAL = getattr(settings, 'GLIST_EVENTS_POLL_INTERVAL', 1.0)  # seconds
+
+
+class Subscription(asyncio.Queue):
+    """
+    Queue of events, created in the event loop it is read in, with the
+        version of the list its reader last saw
+    """
+
+    def __init__(self, version: int):
+        super().__init__(QUEUE_SIZE)
+        self.loop = asyncio.get_event_loop()
+        self.version = version
+
+    def put_event(self, event: dict):
+        if not self.full():
+            self.put_nowait(event)
+        else:
+            # events dropped: the next one must bring every row
+            self.version = None
+
+
+class Broker(object):
+    """
+    Channels are the names of version counters
+    """
+
+    def __init__(self):
+        self.channels = defaultdict(set)
+        self.snapshots = {}  # channel: (version, {item id: row})
+        self.lock = Lock()
+        self.watcher = None
+
+    def subscribe(self, channel: str, version: int) -> Subscription:
+        """
+        Events for the changes made to `channel` after `version`
+        """
+        queue = Subscription(version)
+        with self.lock:
+            self.channels[channel].add(queue)
+            if self.watcher is None:
+                self.watcher = Thread(target=self.watch, name='events', daemon=True)
+                self.watcher.start()
+        return queue
+
+    def unsubscribe(self, channel: str, queue: Subscription):
+        with self.lock:
+            self.channels[channel].discard(queue)
+            if not self.channels[channel]:
+                del self.channels[channel]
+                self.snapshots.pop(channel, None)
+
+    def watch(self):
+        """
+        Polls the counters of the followed channels until none is left
+        """
+        try:
+            while True:
+                with self.lock:
+                    if not self.channels:
+                        self.watcher = None
+                        return
+                    names = list(self.channels)
+                try:
+                    self.publish(dict(Version.objects.filter(name__in=names)
+                                      .values_list('name', 'value')))
+                except DatabaseError:
+                    # tried again at the next poll, subscribers left where they were
+                    pass
+                time.sleep(POLL_INTERVAL)
+        finally:
+            connection.close()
+
+    def publish(self, versions: dict):
+        """
+        Sends an event to the subscribers of `versions` (channel: value)
+            that haven't seen their value yet
+        """
+        for channel, version in versions.items():
+            with self.lock:
+                queues = [q for q in self.channels.get(channel, ()) if q.version != version]
+                previous, rows = self.snapshots.get(channel, (None, None))
+            if previous != version:
+                old, rows = rows, {row['id']: row for row in
+                                   gift_list_rows(GiftListItem.objects.filter(
+                                       gift_list_id=channel_gift_list(channel)))}
+                if get_version(channel) != version:
+                    # changed meanwhile, the rows may not be those of `version`:
+                    # left to the next poll
+                    continue
+                with self.lock:
+                    if channel in self.channels:
+                        self.snapshots[channel] = (version, rows)
+            if not queues:
+                continue
+            full = dict(type='changed', channel=channel, id=version, full=True,
+                        items=list(rows.values()), removed=[])
+            diff = None
+            if previous is not None and previous != version:
+                diff = dict(type='changed', channel=channel, id=version, full=False,
+                            items=[row for pk, row in rows.items() if old.get(pk) != row],
+                            removed=[pk for pk in old if pk not in rows])
+            for queue in queues:
+                event = diff if diff is not None and queue.version == previous else full
+                queue.version = version
+                try:
+                    queue.loop.call_soon_threadsafe(queue.put_event, event)
+                except RuntimeError:
+                    # its loop is closed
+                    self.unsubscribe(channel, queue)
+
+    def subscribers(self, channel: str) -> int:
+        with self.lock:
+            return len(self.channels.get(channel, ()))
+
+
+broker = Broker()
+
+
+def list_channel(gift_list_id: int) -> str:
+    return list_version_name(gift_list_id)
+
+
+def channel_gift_list(channel: str) -> int:
+    return int(channel.rpartition(':')[2])
@@ -0,0 +1,77 @@
+"""
+CSV exports of purchased and remaining items
+
+They reuse the report querysets and are streamed a row at a time from
+`.iterator()`, so memory stays flat whatever the number of lists
+"""
+import csv
+
+from django.http import StreamingHttpResponse
+
+from .reports import purchased_rows, remaining_rows
+
+PURCHASED_HEADER = ['gift_list', 'product', 'name', 'brand', 'price', 'qty', 'amount',
+                    'guest', 'date']
+REMAINING_HEADER = ['gift_list', 'product', 'name', 'brand', 'qty']
+
+
+class Echo(object):
+    """
+    File-like object handing back what csv.writer writes to it
+    """
+
+    def write(self, value):
+        return value
+
+
+def purchased_csv_rows(purchases):
+    for p in purchases.iterator():
+        yield [
+            p['item__gift_list'], p['item__product'], p['item__product__name'],
+            p['item__product__brand__name'], p['item__price'] or p['item__product__price'],
+            p['cnt'], '%.2f' % p['amount'], p['customer__recipient'], p['day'].isoformat(),
+        ]
+
+
+def remaining_csv_rows(remaining):
+    for r in remaining.iterator():
+        yield [r['gift_list'], r['product'], r['product__name'], r['product__brand__name'],
+               r['total']]
+
+
+def export_rows(kind: str, gift_lists=None):
+    """
+    Header and rows of the `kind` ('purchased' or 'remaining') export
+    `gift_lists` is a GiftList id, a GiftList queryset, or None for every active list
+    """
+    if kind == 'purchased':
+        header, rows, to_csv = PURCHASED_HEADER, purchased_rows, purchased_csv_rows
+        gift_list_field = 'item__gift_list'
+    elif kind == 'remaining':
+        header, rows, to_csv = REMAINING_HEADER, remaining_rows, remaining_csv_rows
+        gift_list_field = 'gift_list'
+    else:
+        raise ValueError('Unknown export %r' % kind)
+    if isinstance(gift_lists, int):
+        qs = rows(gift_lists)
+    else:
+        qs = rows()
+        if gift_lists is not None:
+            qs = qs.filter(**{gift_list_field + '__in': gift_lists})
+        # keeps each list's rows together
+        qs = qs.order_by(gift_list_field, *qs.query.order_by)
+    return header, to_csv(qs)
+
+
+def stream_csv(header: list, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def csv_response(kind: str, gift_lists=None) -> StreamingHttpResponse:
+    header, rows = export_rows(kind, gift_lists)
+    response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename=%s.csv' % kind
+    return response
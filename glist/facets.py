@@ -0,0 +1,95 @@
+"""
+Catalog facets: brand, currency and price band
+
+FacetCount holds the number of products of every (brand, currency, band)
+cell, so facet counts add up a few hundred cells instead of grouping the
+whole catalog. The product loaders adjust the cells of the rows they
+change; `rebuild` recomputes them all, see the `rebuild_facets` command.
+"""
+from bisect import bisect_right
+from collections import Counter
+from decimal import Decimal
+
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from .models import FacetCount, Product
+
+# lower bounds of the price bands, in the product's own currency
+PRICE_BANDS = (0, 25, 50, 100, 250, 500, 1000)
+
+
+def price_band(price) -> int:
+    return max(bisect_right(PRICE_BANDS, Decimal(price)) - 1, 0)
+
+
+def band_range(band: int) -> tuple:
+    """
+    (min, max) prices of a band, max being None for the last one
+    """
+    upper = PRICE_BANDS[band + 1] if band + 1 < len(PRICE_BANDS) else None
+    return PRICE_BANDS[band], upper
+
+
+def cell(product) -> tuple:
+    return product.brand_id, product.currency_id, price_band(product.price)
+
+
+def adjust(deltas: Counter):
+    """
+    Adds {(brand_id, currency_id, band): products} to the cells, creating
+        the missing ones
+    """
+    deltas = {key: n for key, n in deltas.items() if n}
+    if not deltas:
+        return
+    existing = {(c.brand_id, c.currency_id, c.band): c.pk for c in FacetCount.objects.filter(
+        brand_id__in={brand for brand, currency, band in deltas}).only('brand', 'currency', 'band')}
+    whens = [When(pk=existing[key], then=F('products') + n)
+             for key, n in deltas.items() if key in existing]
+    if whens:
+        FacetCount.objects.filter(pk__in=[existing[key] for key in deltas if key in existing]).update(
+            products=Greatest(Case(*whens, default=F('products')), Value(0)))
+    FacetCount.objects.bulk_create([
+        FacetCount(brand_id=brand, currency_id=currency, band=band, products=n)
+        for (brand, currency, band), n in deltas.items()
+        if (brand, currency, band) not in existing and n > 0])
+
+
+def band_case():
+    """
+    The price band of a product, as a database expression
+    """
+    return Case(*[When(price__gte=lower, then=Value(band))
+                  for band, lower in reversed(list(enumerate(PRICE_BANDS)))],
+                default=Value(0), output_field=IntegerField())
+
+
+def rebuild():
+    """
+    Recomputes every cell from the products
+    """
+    cells = Product.objects.annotate(band=band_case()).values(
+        'brand', 'currency', 'band').annotate(n=Count('pk')).order_by()
+    FacetCount.objects.all().delete()
+    FacetCount.objects.bulk_create([
+        FacetCount(brand_id=c['brand'], currency_id=c['currency'], band=c['band'], products=c['n'])
+        for c in cells.iterator()], batch_size=1000)
+
+
+def facet_counts(brands=(), currencies=(), bands=()) -> dict:
+    """
+    Counts per brand, currency and band of the products matching the
+        selection, each facet counted with the selection on the others
+    """
+    cells = FacetCount.objects.filter(products__gt=0)
+    selected = {'brand_id__in': brands, 'currency_id__in': currencies, 'band__in': bands}
+    out = {}
+    for facet, values in (('brand', ('brand', 'brand__name')), ('currency', ('currency',)),
+                          ('band', ('band',))):
+        filters = {k: v for k, v in selected.items() if v and not k.startswith(facet)}
+        rows = cells.filter(**filters).values(*values).annotate(count=Sum('products'))
+        out[facet] = list(rows.order_by(*values))
+    for row in out['band']:
+        row['min'], row['max'] = band_range(row['band'])
+    return out
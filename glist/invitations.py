@@ -0,0 +1,155 @@
+"""
+Mailing the gift list announcement to its guests
+
+The message is rendered once per list, with a marker where each guest's
+name goes. Guests are read a batch at a time and each batch is sent by a
+worker thread over a single mail connection, a message at a time so that
+one failure doesn't hide the others' fate, while the calling thread, the
+only one using the database, stamps `invited_at` on the guests whose mail
+went out. Guests already invited are skipped, so an interrupted run, or
+one with failures, picks up where it stopped.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+from threading import Lock
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import GiftList, Guest
+
+BATCH_SIZE = getattr(settings, 'GLIST_INVITE_BATCH_SIZE', 100)
+WORKERS = getattr(settings, 'GLIST_INVITE_WORKERS', 4)
+# messages per second over all workers, None for no limit
+RATE = getattr(settings, 'GLIST_INVITE_RATE', None)
+SITE_URL = getattr(settings, 'GLIST_SITE_URL', 'http://localhost:8000')
+RECIPIENT = '\x00recipient\x00'
+
+logger = logging.getLogger('default')
+
+# runs the admin action's mailings
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='invitations')
+
+
+class RateLimiter(object):
+    """
+    Spaces out batches so that messages go at `rate` per second at most
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next = time.monotonic()
+        self.lock = Lock()
+
+    def wait(self, messages: int):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next)
+            self.next = start + messages * self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def render_invitation(gift_list: GiftList) -> tuple:
+    """
+    Subject and body of the announcement, with RECIPIENT for the guest's name
+    """
+    context = {'gift_list': gift_list, 'recipient': RECIPIENT,
+               'url': SITE_URL + reverse('guest', args=[gift_list.pk])}
+    subject = render_to_string('glist/email/invitation_subject.txt', context)
+    body = render_to_string('glist/email/invitation.txt', context)
+    return ' '.join(subject.split()), body
+
+
+def send_batch(guests: list, subject: str, body: str, limiter=None) -> tuple:
+    """
+    Mails (pk, email, recipient) guests over one connection, returns the
+        pks of those mailed and the errors of the others
+    """
+    if limiter is not None:
+        limiter.wait(len(guests))
+    sent, errors = [], []
+    with get_connection() as mail:
+        for pk, email, recipient in guests:
+            message = EmailMessage(subject, body.replace(RECIPIENT, recipient), to=[email])
+            try:
+                if mail.send_messages([message]):
+                    sent.append(pk)
+                else:
+                    errors.append('%s: not sent' % email)
+            except Exception as e:
+                errors.append('%s: %s' % (email, e))
+    return sent, errors
+
+
+def send_invitations(gift_list: GiftList, workers: int = None, batch_size: int = None,
+                     rate: float = None, resend: bool = False, progress=None) -> tuple:
+    """
+    Mails the announcement to the guests of `gift_list` not invited yet,
+        or with `resend` to all of them
+    `progress` is called with the number of messages sent so far
+    Returns the number sent and the errors of the messages, or whole
+        batches, that failed; their guests are left to the next run
+    """
+    workers = workers or WORKERS
+    batch_size = batch_size or BATCH_SIZE
+    rate = rate or RATE
+    limiter = RateLimiter(rate) if rate else None
+    subject, body = render_invitation(gift_list)
+    guests = Guest.objects.filter(wedding=gift_list).order_by('pk')
+    if not resend:
+        guests = guests.filter(invited_at__isnull=True)
+    started = timezone.now()
+    sent, errors = 0, []
+
+    def record(done):
+        nonlocal sent
+        for future in done:
+            try:
+                pks, failed = future.result()
+            except Exception as e:
+                # the connection
+                errors.append(str(e))
+                continue
+            errors.extend(failed)
+            Guest.objects.filter(pk__in=pks).update(invited_at=started)
+            sent += len(pks)
+        if progress is not None:
+            progress(sent)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mail') as pool:
+        pending, last = set(), 0
+        while True:
+            # by primary key, so that stamping guests doesn't move the next batch
+            batch = list(guests.filter(pk__gt=last).values_list(
+                'pk', 'email', 'recipient')[:batch_size])
+            if not batch:
+                break
+            last = batch[-1][0]
+            pending.add(pool.submit(send_batch, batch, subject, body, limiter))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                record(done)
+        record(wait(pending)[0])
+    return sent, errors
+
+
+def send_in_background(gift_list_ids: list):
+    """
+    Mails the announcements of the given lists one after the other, off
+        the request
+    """
+    def run():
+        try:
+            for gift_list in GiftList.objects.filter(pk__in=gift_list_ids):
+                sent, errors = send_invitations(gift_list)
+                for error in errors:
+                    logger.error('Invitations of gift list %d: %s', gift_list.pk, error)
+        finally:
+            connection.close()
+    return executor.submit(run)
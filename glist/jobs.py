@@ -0,0 +1,107 @@
+"""
+Background rendering of PDF reports
+
+Jobs run on a bounded thread pool. A job is identified by the gift list
+and the version of its report, so identical requests made while a job is
+pending or after it finished are all answered by that same job.
+Jobs hold no PDF: a finished one is read from `report_cache`, and once
+evicted from there the next request for it renders it again.
+The registry of jobs is kept per process, but the gift list can be read
+back from a job id: a process that never saw the job (or dropped it)
+submits the report again, see `job_gift_list`.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import re
+from threading import Event, Lock
+
+from django.conf import settings
+from django.db import connection
+
+from .reports import render_report, report_cache, report_version
+
+MAX_JOBS = getattr(settings, 'GLIST_REPORT_MAX_JOBS', 100)
+# the gift list id followed by the versions of its report
+JOB_ID_RE = re.compile(r'([0-9]+)(-[0-9]+)+')
+
+executor = ThreadPoolExecutor(max_workers=getattr(settings, 'GLIST_REPORT_WORKERS', 2),
+                              thread_name_prefix='report')
+jobs = OrderedDict()
+jobs_lock = Lock()
+
+
+class ReportJob(object):
+
+    def __init__(self, gift_list_id: int, version: tuple):
+        self.gift_list_id = gift_list_id
+        self.version = version
+        self.id = '-'.join(map(str, (gift_list_id,) + tuple(version)))
+        self.status = 'queued'
+        self.progress = 0
+        self.error = None
+        self.finished = Event()
+
+    def run(self):
+        self.status = 'running'
+        try:
+            pdf = render_report(self.gift_list_id, progress=self.set_progress)
+        except Exception as e:
+            self.status, self.error = 'failed', str(e)
+        else:
+            if report_cache.set(self.gift_list_id, self.version, pdf):
+                self.status, self.progress = 'done', 100
+            else:
+                self.status, self.error = 'failed', 'Too large to keep, download it directly'
+        finally:
+            self.finished.set()
+            connection.close()
+
+    def set_progress(self, percent: int):
+        self.progress = percent
+
+    def pdf(self):
+        """
+        The rendered report, None unless done and still cached
+        """
+        if self.status != 'done':
+            return None
+        return report_cache.get(self.gift_list_id, self.version)
+
+    def as_dict(self) -> dict:
+        return dict(job=self.id, status=self.status, progress=self.progress, error=self.error)
+
+
+def submit_report(gift_list_id: int) -> ReportJob:
+    """
+    Returns the job rendering the current report of the GiftList,
+        queueing it unless one is already pending, or done and cached
+    """
+    version = report_version(gift_list_id)
+    job = ReportJob(gift_list_id, version)
+    with jobs_lock:
+        existing = jobs.get(job.id)
+        if existing is not None and (existing.status in ('queued', 'running')
+                                     or existing.pdf() is not None):
+            return existing
+        jobs[job.id] = job
+        while len(jobs) > MAX_JOBS:
+            jobs.popitem(last=False)
+    if report_cache.get(gift_list_id, version) is not None:
+        job.status, job.progress = 'done', 100
+        job.finished.set()
+    else:
+        executor.submit(job.run)
+    return job
+
+
+def get_job(job_id: str):
+    with jobs_lock:
+        return jobs.get(job_id)
+
+
+def job_gift_list(job_id: str):
+    """
+    The id of the GiftList a job id was given for, None if not a job id
+    """
+    match = JOB_ID_RE.fullmatch(job_id)
+    return int(match.group(1)) if match else None
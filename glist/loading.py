@@ -0,0 +1,269 @@
+"""
+Product feed loading, as used by the `load_products` command
+"""
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+import json
+import re
+
+from django.db import DatabaseError, transaction
+
+from . import facets
+from .models import Brand, Currency, Product
+from .versions import bump_version
+
+PRICE_RE = re.compile(r'[.0-9]+[A-Za-z]{3}')
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+READ_SIZE = 1 << 16
+# the most an element cut by the end of the buffer can miss before where
+# decoding it fails, as with a \uXXXX escape
+CUT_TAIL = 6
+UPDATE_FIELDS = ['name', 'price', 'qty', 'brand', 'currency']
+PACKED_FIELDS = ('id', 'name', 'brand', 'currency', 'price', 'qty')
+
+
+class RowError(ValueError):
+    pass
+
+
+def parse_row(row: dict) -> dict:
+    """
+    Validates a feed row and returns the Product attributes,
+        with the brand name and currency code still to be resolved
+    """
+    try:
+        data = dict(
+            brand=row['brand'],
+            qty=int(row.get('in_stock_quantity', 0)),
+            name=row['name'],
+        )
+        price = row['price']
+        if PRICE_RE.match(price):
+            data['currency'] = price[-3:].upper()
+            price = price[:-3]
+        data['price'] = Decimal(price)
+        if 'id' in row:
+            data['id'] = int(row['id'])
+    except (KeyError, TypeError, ValueError, InvalidOperation) as e:
+        raise RowError('Invalid row %r: %s' % (row, e))
+    return data
+
+
+def iter_json_array(fp, read_size: int = READ_SIZE):
+    """
+    Yields the elements of the top-level JSON array in `fp` one at a time,
+        reading `read_size` characters at a time so memory is bounded by
+        the largest element, not by the file
+    A malformed element raises ValueError as soon as it is read, not at
+        the end of the file
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = fp.read(read_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+        return not eof
+
+    def skip():
+        # skips whitespace, reading on when the buffer runs out
+        nonlocal pos
+        while True:
+            pos = WHITESPACE_RE.match(buf, pos).end()
+            if pos < len(buf) or not fill():
+                return
+
+    skip()
+    if buf[pos:pos + 1] != '[':
+        raise ValueError('Expected a JSON array')
+    pos += 1
+    expect_value, first = True, True
+    while True:
+        skip()
+        if pos == len(buf):
+            raise ValueError('Unexpected end of JSON array')
+        if buf[pos] == ']':
+            if expect_value and not first:
+                raise ValueError('Expected a value after , at %d' % pos)
+            pos += 1
+            skip()
+            if pos < len(buf):
+                raise ValueError('Extra data after the JSON array at %d' % pos)
+            return
+        if not expect_value:
+            if buf[pos] != ',':
+                raise ValueError('Expected , or ] at %d' % pos)
+            pos += 1
+            expect_value = True
+            continue
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            # failing short of the end of the buffer, more won't help, bar
+            # a string still open
+            cut = e.pos + CUT_TAIL >= len(buf) or e.msg.startswith('Unterminated string')
+            if not cut or not fill():
+                raise
+            continue
+        if (len(buf) - end < 3 and not eof and isinstance(obj, (int, float))
+                and not isinstance(obj, bool)):
+            # a number might continue past the buffer, as in 1. or 1e+:
+            # decoded again from the moved buffer, whether more came or not
+            fill()
+            continue
+        pos = end
+        expect_value, first = False, False
+        yield obj
+
+
+def parse_rows(rows: list) -> tuple:
+    """
+    Validates a slice of feed rows, returning (parsed rows, errors)
+    """
+    parsed, errors = [], []
+    for row in rows:
+        try:
+            parsed.append(parse_row(row))
+        except RowError as e:
+            errors.append(str(e))
+    return parsed, errors
+
+
+def pack(data: dict) -> tuple:
+    """
+    A `parse_row()` result as a tuple of PACKED_FIELDS, cheaper to pickle
+    """
+    return tuple(str(data[f]) if f == 'price' else data.get(f) for f in PACKED_FIELDS)
+
+
+def unpack(values: tuple) -> dict:
+    data = {f: v for f, v in zip(PACKED_FIELDS, values) if v is not None}
+    data['price'] = Decimal(data['price'])
+    return data
+
+
+def parse_file(queue, filename: str, stream: bool = False, batch_size: int = 1000):
+    """
+    Reads and validates a feed file, putting (batch of `pack()`ed rows,
+        errors) on `queue` a batch at a time, then None once done
+    Whatever it raises, as ValueError if the file isn't a JSON array, is put
+        on `queue` instead; with a bounded queue, the file is read no
+        faster than its batches are taken
+    Does not touch the database, so it can run in a worker process
+    """
+    try:
+        with open(filename) as json_file:
+            rows = iter_json_array(json_file) if stream else json.load(json_file)
+            for batch in chunked(rows, batch_size):
+                parsed, errors = parse_rows(batch)
+                queue.put(([pack(data) for data in parsed], errors))
+    except Exception as e:
+        queue.put(e)
+    else:
+        queue.put(None)
+
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class BulkLoader(object):
+    """
+    Writes feed rows in batches, one transaction each
+    Brands and currencies are kept in memory and the missing ones created
+        in bulk, products are upserted with bulk_create/bulk_update
+    A batch that fails is replayed row by row so that only the offending
+        rows are lost; their errors are kept in `errors`
+    Facet counts are adjusted in the same transaction as the rows
+    """
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self.brands = dict(Brand.objects.values_list('name', 'pk'))
+        self.currencies = set(Currency.objects.values_list('code', flat=True))
+        self.success = 0
+        self.errors = []
+
+    def load(self, rows, progress=None):
+        """
+        `progress`, if given, is called with the loader after every batch
+        """
+        for batch in chunked(rows, self.batch_size):
+            self.load_batch(batch)
+            if progress:
+                progress(self)
+
+    def load_batch(self, rows: list):
+        parsed = []
+        for row in rows:
+            try:
+                parsed.append(parse_row(row))
+            except RowError as e:
+                self.errors.append(str(e))
+        self.load_parsed(parsed)
+
+    def load_parsed(self, parsed: list):
+        """
+        Writes rows that went through `parse_row` already
+        """
+        if not parsed:
+            return
+        self._add_related(parsed)
+        try:
+            with transaction.atomic():
+                self._write(parsed)
+        except DatabaseError:
+            with transaction.atomic():
+                for data in parsed:
+                    try:
+                        with transaction.atomic():
+                            self._write([data])
+                    except DatabaseError as e:
+                        self.errors.append('Row %r: %s' % (data, e))
+        bump_version('product')
+
+    def _add_related(self, parsed: list):
+        brands = {d['brand'] for d in parsed} - self.brands.keys()
+        if brands:
+            Brand.objects.bulk_create([Brand(name=name) for name in brands],
+                                      ignore_conflicts=True)
+            self.brands.update(Brand.objects.filter(name__in=brands).values_list('name', 'pk'))
+            bump_version('brand')
+        currencies = {d['currency'] for d in parsed if 'currency' in d} - self.currencies
+        if currencies:
+            Currency.objects.bulk_create([Currency(code=code) for code in currencies],
+                                         ignore_conflicts=True)
+            self.currencies.update(currencies)
+            bump_version('currency')
+
+    def _write(self, parsed: list):
+        existing = Product.objects.in_bulk([d['id'] for d in parsed if 'id' in d])
+        new, changed = [], []
+        cells = Counter()
+        for data in parsed:
+            data = dict(data, brand_id=self.brands[data['brand']])
+            del data['brand']
+            if 'currency' in data:
+                data['currency_id'] = data.pop('currency')
+            product = existing.get(data.get('id'))
+            if product is None:
+                product = Product(**data)
+                new.append(product)
+            else:
+                cells[facets.cell(product)] -= 1
+                for k, v in data.items():
+                    setattr(product, k, v)
+                changed.append(product)
+            cells[facets.cell(product)] += 1
+        Product.objects.bulk_create(new)
+        Product.objects.bulk_update(changed, UPDATE_FIELDS)
+        facets.adjust(cells)
+        self.success += len(parsed)
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from glist.bench import SCENARIOS, regressions
+
+
+class Command(BaseCommand):
+    help = """
+    Runs benchmark scenarios against a throwaway test database
+
+    Available scenarios: %s
+
+    With --save-baseline the results are written to a JSON file, with
+    --compare a run fails when it is worse than such a file
+    """ % ', '.join(sorted(SCENARIOS))
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', type=str,
+                            help='Scenarios to run, all of them by default')
+        parser.add_argument('--size', type=int, default=10000,
+                            help='Number of rows each scenario works with')
+        parser.add_argument('--save-baseline', metavar='FILE',
+                            help='Write the results to FILE as JSON')
+        parser.add_argument('--compare', metavar='FILE',
+                            help='Fail if the results are worse than the baseline in FILE')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Fraction by which a result may be worse than its '
+                                 'baseline, query counts may not be worse at all')
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or sorted(SCENARIOS)
+        unknown = set(names) - SCENARIOS.keys()
+        if unknown:
+            raise CommandError('Unknown scenario(s): %s' % ', '.join(sorted(unknown)))
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            if baseline['size'] != options['size']:
+                raise CommandError('The baseline was taken with --size %d' % baseline['size'])
+        results = {}
+        for name in names:
+            for metric, value in SCENARIOS[name](options['size']).items():
+                results['%s.%s' % (name, metric)] = value
+                self.stdout.write('%s.%s: %.2f' % (name, metric, value))
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump({'size': options['size'], 'results': results}, f, indent=2, sort_keys=True)
+        if baseline is not None:
+            worse = regressions(baseline['results'], results, options['tolerance'])
+            if worse:
+                raise CommandError('Slower than the baseline:\n' + '\n'.join(worse))
+            self.stdout.write('No regressions against %s' % options['compare'])
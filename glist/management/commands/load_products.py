@@ -1,12 +1,26 @@
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 import json
 import logging
+from multiprocessing import Manager
+import queue
 import re
+import time
 
+import django
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from glist import facets
+from glist.loading import BulkLoader, iter_json_array, parse_file, unpack
 from glist.models import Product, Brand, Currency
 
 logger = logging.getLogger('default')
 
+PROGRESS_INTERVAL = 5  # seconds
+# batches a worker gets ahead of this process, for each file
+QUEUED_BATCHES = 2
+WORKER_POLL_INTERVAL = 1  # seconds
+
 
 class Command(BaseCommand):
     help = """
@@ -14,12 +28,28 @@ class Command(BaseCommand):
         
     You must declare the full relative or absolute paths, how many you may want to.
     Existing products will be updated/overwritten
+    With --bulk, rows are written in batches of --batch-size, one transaction each
+    With --stream, files are also read one row at a time instead of whole
+    With --workers, files are read and validated in parallel processes, one
+        file each, while this one writes their batches in the order of the files;
+        batches are handed over one at a time, so --stream still bounds memory
     """
 
     def add_arguments(self, parser):
         parser.add_argument('json_files', nargs='+', type=str)
+        parser.add_argument('--bulk', action='store_true',
+                            help='Batch inserts and updates instead of saving row by row')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--stream', action='store_true',
+                            help='Parse files incrementally, implies --bulk')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes parsing files, more than 1 implies --bulk')
 
     def handle(self, *args, **options):
+        if options['workers'] > 1:
+            return self.handle_parallel(**options)
+        if options['bulk'] or options['stream']:
+            return self.handle_bulk(**options)
 
         failed = 0
         success = 0
@@ -44,6 +74,7 @@ class Command(BaseCommand):
                         _data['currency'] = currency
 
                     _data['price'] = price
+                    product = None
                     if 'id' in row:
                         try:
                             product = Product.objects.get(pk=row['id'])
@@ -51,13 +82,20 @@ class Command(BaseCommand):
                             _data['id'] = row['id']
                             product = None
 
+                    cells = Counter()
                     if not product:
                         product = Product(**_data)
                     else:
+                        cells[facets.cell(product)] -= 1
                         for k, v in _data.items():
                             setattr(product, k, v)
+                    cells[facets.cell(product)] += 1
                     try:
-                        product.save()
+                        # facet counts move with the row
+                        with transaction.atomic():
+                            # qty_reserved is kept by glist.stock, not by the feed
+                            product.save(update_fields=None if product._state.adding else list(_data))
+                            facets.adjust(cells)
                     except Exception as e:
                         msg = '%s' % e
                         if verbosity > 1:
@@ -66,6 +104,103 @@ class Command(BaseCommand):
                         failed += 1
                     else:
                         success += 1
+        self.report(success, failed, verbosity)
+
+    def handle_bulk(self, **options):
+        verbosity = options['verbosity']
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        loader = BulkLoader(batch_size=options['batch_size'])
+        progress = self.progress_reporter() if verbosity > 0 else None
+        for filename in options['json_files']:
+            with open(filename) as json_file:
+                if options['stream']:
+                    rows = iter_json_array(json_file)
+                else:
+                    rows = json.load(json_file)
+                try:
+                    loader.load(rows, progress=progress)
+                except ValueError as e:
+                    raise CommandError('%s: %s' % (filename, e))
+        self.report_loader(loader, verbosity)
+
+    def handle_parallel(self, **options):
+        """
+        Files are read and validated in a process pool, one task each;
+            being the only writer, this process keeps brands and currencies
+            de-duplicated and the database uncontended
+        Files are written in order, so that a later row for the same
+            product wins, and at most two per worker are in flight
+        Workers hand their batches over through a queue per file holding
+            QUEUED_BATCHES at most, so memory is bounded by the batch size
+            rather than by the files
+        """
+        verbosity = options['verbosity']
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        loader = BulkLoader(batch_size=options['batch_size'])
+        progress = self.progress_reporter() if verbosity > 0 else None
+        pending = deque()
+
+        def write_oldest():
+            filename, batches, parsing = pending.popleft()
+            while True:
+                try:
+                    item = batches.get(timeout=WORKER_POLL_INTERVAL)
+                except queue.Empty:
+                    if parsing.done():
+                        # the worker died without a word
+                        parsing.result()
+                        raise CommandError('%s: parsing stopped' % filename)
+                    continue
+                if item is None:
+                    return
+                if isinstance(item, ValueError):
+                    raise CommandError('%s: %s' % (filename, item))
+                if isinstance(item, Exception):
+                    raise item
+                batch, errors = item
+                loader.errors.extend(errors)
+                loader.load_parsed([unpack(values) for values in batch])
+                if progress:
+                    progress(loader)
+
+        with Manager() as manager, \
+                ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for filename in options['json_files']:
+                batches = manager.Queue(QUEUED_BATCHES)
+                pending.append((filename, batches, pool.submit(
+                    parse_file, batches, filename, options['stream'], options['batch_size'])))
+                if len(pending) >= 2 * options['workers']:
+                    write_oldest()
+            while pending:
+                write_oldest()
+        self.report_loader(loader, verbosity)
+
+    def report_loader(self, loader, verbosity):
+        for msg in loader.errors:
+            if verbosity > 1:
+                self.stderr.write(msg)
+            logger.error(msg)
+        self.report(loader.success, len(loader.errors), verbosity)
+
+    def progress_reporter(self):
+        """
+        Returns a BulkLoader progress callback writing the rows/second,
+            at most every PROGRESS_INTERVAL seconds
+        """
+        start = last = time.monotonic()
+
+        def progress(loader):
+            nonlocal last
+            now = time.monotonic()
+            if now - last >= PROGRESS_INTERVAL:
+                last = now
+                done = loader.success + len(loader.errors)
+                self.stdout.write('%d rows, %.0f rows/s' % (done, done / (now - start)))
+        return progress
+
+    def report(self, success, failed, verbosity):
         if verbosity > 0:
             self.stdout.write('Total products: %d' % (failed + success))
         if failed:
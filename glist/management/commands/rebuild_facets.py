@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from glist import facets
+from glist.versions import bump_version
+
+
+class Command(BaseCommand):
+    help = """
+    Recomputes the catalog facet counts from the products
+
+    `load_products` keeps them up to date, this is needed after products
+    are changed or deleted some other way, e.g. through the admin
+    """
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            facets.rebuild()
+        bump_version('product')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from glist.summary import reconcile
+
+
+class Command(BaseCommand):
+    help = """
+    Rebuilds the gift list summaries from their items and purchases
+
+    Needed after changes made outside the API, e.g. through the admin
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('gift_lists', nargs='*', type=int,
+                            help='Ids of the lists to rebuild, all of them by default')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = reconcile(options['gift_lists'] or None)
+        if options['verbosity'] > 0:
+            self.stdout.write('%d summaries rebuilt' % len(fixed))
+        if options['verbosity'] > 1:
+            for pk in fixed:
+                self.stdout.write('Gift list %d' % pk)
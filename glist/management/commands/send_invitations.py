@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from glist.invitations import send_invitations
+from glist.models import GiftList
+
+
+class Command(BaseCommand):
+    help = """
+    Mails the gift list announcement to the guests of the given lists
+
+    Guests already invited are skipped, so an interrupted run can just be
+    started again. Uses the configured EMAIL_BACKEND.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('gift_lists', nargs='*', type=int,
+                            help='Ids of the lists, all active ones by default')
+        parser.add_argument('--workers', type=int, help='Batches sent at the same time')
+        parser.add_argument('--batch-size', type=int, help='Messages sent per mail connection')
+        parser.add_argument('--rate', type=float, help='Messages per second at most')
+        parser.add_argument('--resend', action='store_true',
+                            help='Mail guests that were invited already too')
+
+    def handle(self, *args, **options):
+        gift_lists = GiftList.objects.order_by('pk')
+        if options['gift_lists']:
+            gift_lists = gift_lists.filter(pk__in=options['gift_lists'])
+        else:
+            gift_lists = gift_lists.filter(active=True)
+        failed = 0
+        for gift_list in gift_lists:
+            sent, errors = send_invitations(
+                gift_list, workers=options['workers'], batch_size=options['batch_size'],
+                rate=options['rate'], resend=options['resend'])
+            if options['verbosity'] > 0:
+                self.stdout.write('Gift list %d: %d invitations sent' % (gift_list.pk, sent))
+            for error in errors:
+                self.stderr.write('Gift list %d: %s' % (gift_list.pk, error))
+            failed += len(errors)
+        if failed:
+            raise CommandError('%d invitations failed, run again to retry them' % failed)
@@ -0,0 +1,174 @@
+"""
+Per-endpoint latency and SQL metrics, in Prometheus text format
+
+`glist.middleware.metrics_middleware` times each request and counts the
+SQL it runs, by URL name. Queries are counted by a wrapper every database
+connection gets when it is created (see `glist.signals`), which adds to
+the `Recorder` of the request in progress: a context variable, so that it
+also follows the request into the threads async views and streamed
+responses run their queries in. Figures are kept per process.
+"""
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+current = ContextVar('glist_metrics_recorder', default=None)
+
+
+class Recorder(object):
+    """
+    Time and SQL of one request
+    """
+    __slots__ = ('start', 'queries', 'sql_seconds')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+
+class Stream(object):
+    """
+    Iterates streamed content as part of the request of `recorder`,
+        calls `done` once exhausted or closed
+    """
+
+    def __init__(self, content, recorder: Recorder, done):
+        self.iterator = iter(content)
+        self.recorder = recorder
+        self.done = done
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = current.set(self.recorder)
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            self.close()
+            raise
+        finally:
+            current.reset(token)
+
+    def close(self):
+        # the response closes it, also when it was never iterated
+        if self.done is not None:
+            done, self.done = self.done, None
+            done()
+
+
+def record_sql(execute, sql, params, many, context):
+    """
+    `connection.execute_wrapper` counting the queries of the current request
+    """
+    recorder = current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.queries += 1
+        recorder.sql_seconds += time.perf_counter() - start
+
+
+def install(connection):
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+class Histogram(object):
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name: str, labels: str) -> list:
+        out, total = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            out.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, total))
+        out.append('%s_sum{%s} %s' % (name, labels, round(self.sum, 6)))
+        out.append('%s_count{%s} %d' % (name, labels, total))
+        return out
+
+
+class Endpoint(object):
+    __slots__ = ('latency', 'queries', 'sql', 'statuses')
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.sql = Histogram(LATENCY_BUCKETS)
+        self.statuses = {}
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = Lock()
+
+    def observe(self, view: str, method: str, status: int, recorder: Recorder):
+        elapsed = time.perf_counter() - recorder.start
+        if method not in METHODS:
+            method = 'other'
+        with self.lock:
+            endpoint = self.endpoints.get((view, method))
+            if endpoint is None:
+                endpoint = self.endpoints[view, method] = Endpoint()
+            endpoint.latency.observe(elapsed)
+            endpoint.queries.observe(recorder.queries)
+            endpoint.sql.observe(recorder.sql_seconds)
+            endpoint.statuses[status] = endpoint.statuses.get(status, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.endpoints.clear()
+
+    def render(self) -> str:
+        """
+        The metrics in Prometheus text exposition format
+        """
+        families = (
+            ('glist_request_duration_seconds', 'Request latency by URL name', 'latency'),
+            ('glist_request_sql_queries', 'SQL queries per request by URL name', 'queries'),
+            ('glist_request_sql_duration_seconds', 'SQL time per request by URL name', 'sql'),
+        )
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            out = []
+            for name, help_text, attr in families:
+                out += ['# HELP %s %s' % (name, help_text), '# TYPE %s histogram' % name]
+                for (view, method), endpoint in endpoints:
+                    labels = 'view="%s",method="%s"' % (view, method)
+                    out += getattr(endpoint, attr).lines(name, labels)
+            out += ['# HELP glist_requests_total Responses by URL name and status',
+                    '# TYPE glist_requests_total counter']
+            for (view, method), endpoint in endpoints:
+                for status, count in sorted(endpoint.statuses.items()):
+                    out.append('glist_requests_total{view="%s",method="%s",status="%d"} %d'
+                               % (view, method, status, count))
+        return '\n'.join(out) + '\n'
+
+
+registry = Registry()
+
+
+def view_name(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
@@ -0,0 +1,91 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.utils.decorators import sync_and_async_middleware
+
+from .api import read_out
+from .metrics import Recorder, Stream, current, registry, view_name
+from .profiling import RequestProfile, asked, current_profile, save, wanted
+
+# runs the profiled requests under ASGI
+profile_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profile')
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Records latency and SQL of every request in `glist.metrics.registry`
+    Streamed responses are recorded once their last chunk is out
+    """
+    def finish(request, response, recorder):
+        def done():
+            registry.observe(view_name(request), request.method, response.status_code, recorder)
+        if response.streaming:
+            response.streaming_content = Stream(response.streaming_content, recorder, done)
+        else:
+            done()
+        return response
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            recorder = Recorder()
+            token = current.set(recorder)
+            try:
+                response = await get_response(request)
+            finally:
+                current.reset(token)
+            return finish(request, response, recorder)
+    else:
+        def middleware(request):
+            recorder = Recorder()
+            token = current.set(recorder)
+            try:
+                response = get_response(request)
+            finally:
+                current.reset(token)
+            return finish(request, response, recorder)
+    return middleware
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """
+    Profiles the requests asking for it, see `glist.profiling`
+    Streamed responses are read out within the profile
+    Under ASGI the profiled request runs in `profile_executor`'s single
+        thread, so that profiled requests are taken one at a time: its
+        coroutines on an event loop of their own, profiled too, and its
+        synchronous code, database work of `glist.async_api` included,
+        back in that thread
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        def run(request):
+            profile = RequestProfile()
+
+            async def respond():
+                with profile.thread():
+                    return await get_response(request)
+            current_profile.set(profile)
+            with profile:
+                response = read_out(async_to_sync(respond)())
+            return profile, response
+
+        async def middleware(request):
+            if not asked(request) or not await sync_to_async(wanted)(request):
+                return await get_response(request)
+            profile, response = await asyncio.get_event_loop().run_in_executor(
+                profile_executor, contextvars.copy_context().run, run, request)
+            name = await sync_to_async(save)(profile, request, response, view_name(request))
+            response['X-Glist-Profile'] = name
+            return response
+    else:
+        def middleware(request):
+            if not asked(request) or not wanted(request):
+                return get_response(request)
+            with RequestProfile() as profile:
+                response = read_out(get_response(request))
+            response['X-Glist-Profile'] = save(profile, request, response, view_name(request))
+            return response
+    return middleware
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.1 on 2026-10-18 08:46
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def reserve_listed_stock(apps, schema_editor):
+    """
+    Units already in gift lists and not purchased yet hold a reservation
+    """
+    GiftListItem = apps.get_model('glist', 'GiftListItem')
+    Product = apps.get_model('glist', 'Product')
+    listed = GiftListItem.objects.filter(qty__gt=F('qty_purchased')).values('product'
+                                                                          ).annotate(units=Sum(F('qty') - F('qty_purchased')))
+    for row in listed:
+        Product.objects.filter(pk=row['product']).update(qty_reserved=row['units'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('glist', '0004_auto_20200921_2105'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='qty_reserved',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Units of the stock claimed by gift lists and not yet purchased', verbose_name='Reserved'),
+        ),
+        migrations.RunPython(reserve_listed_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.1.1 on 2026-10-18 09:11
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def summarise_lists(apps, schema_editor):
+    """
+    Same as `glist.summary.reconcile`, against the historical models
+    """
+    GiftList = apps.get_model('glist', 'GiftList')
+    GiftListSummary = apps.get_model('glist', 'GiftListSummary')
+    summaries = {pk: GiftListSummary(gift_list_id=pk) for pk in GiftList.objects.values_list('pk', flat=True)}
+    items = apps.get_model('glist', 'GiftListItem').objects.values('gift_list').annotate(
+        n=Count('pk'), units=Sum('qty'), purchased=Sum('qty_purchased'))
+    for row in items:
+        summary = summaries[row['gift_list']]
+        summary.items, summary.units, summary.units_purchased = row['n'], row['units'], row['purchased']
+    purchases = apps.get_model('glist', 'Purchase').objects.values('item__gift_list').annotate(raised=Sum('total'))
+    for row in purchases:
+        summaries[row['item__gift_list']].raised = Decimal(row['raised']).quantize(Decimal('0.01'))
+    GiftListSummary.objects.bulk_create(summaries.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('glist', '0005_product_qty_reserved'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GiftListSummary',
+            fields=[
+                ('gift_list', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='glist.giftlist')),
+                ('items', models.PositiveIntegerField(default=0, verbose_name='Items')),
+                ('units', models.PositiveIntegerField(default=0, verbose_name='Units wanted')),
+                ('units_purchased', models.PositiveIntegerField(default=0, verbose_name='Units purchased')),
+                ('raised', models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Raised')),
+            ],
+        ),
+        migrations.RunPython(summarise_lists, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 3.1.1 on 2026-10-18 09:13
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F
+import django.db.models.deletion
+import django.db.models.expressions
+
+
+def merge_duplicate_items(apps, schema_editor):
+    """
+    Folds items listing the same product twice into the oldest one
+    """
+    GiftListItem = apps.get_model('glist', 'GiftListItem')
+    Purchase = apps.get_model('glist', 'Purchase')
+    GiftListSummary = apps.get_model('glist', 'GiftListSummary')
+    duplicated = GiftListItem.objects.values('gift_list', 'product').annotate(n=Count('pk')).filter(n__gt=1)
+    for row in duplicated:
+        keep, *others = GiftListItem.objects.filter(gift_list=row['gift_list'], product=row['product']
+                                                    ).order_by('pk')
+        for item in others:
+            keep.qty += item.qty
+            keep.qty_purchased += item.qty_purchased
+        Purchase.objects.filter(item__in=others).update(item=keep)
+        GiftListItem.objects.filter(pk__in=[i.pk for i in others]).delete()
+        keep.save()
+        GiftListSummary.objects.filter(gift_list=row['gift_list']).update(items=F('items') - len(others))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('glist', '0006_giftlistsummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='giftlistitem',
+            index=models.Index(condition=models.Q(qty__gt=django.db.models.expressions.F('qty_purchased')), fields=['gift_list'], name='glist_item_remaining'),
+        ),
+        migrations.AddIndex(
+            model_name='guest',
+            index=models.Index(fields=['user', 'wedding'], name='glist_guest_user_wedding'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['item', '-date_paid'], name='glist_purchase_item_date'),
+        ),
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='giftlistitem',
+            constraint=models.UniqueConstraint(fields=('gift_list', 'product'), name='glist_item_product'),
+        ),
+        # the composite indexes above lead with these foreign keys
+        migrations.AlterField(
+            model_name='giftlistitem',
+            name='gift_list',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='glist.giftlist'),
+        ),
+        migrations.AlterField(
+            model_name='guest',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='invitations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='purchase',
+            name='item',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='glist.giftlistitem', verbose_name='Item'),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.1.1 on 2026-10-18 09:40
+
+from django.db import migrations
+
+FTS_TABLE = 'glist_product_fts'
+
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE {fts} USING fts5("
+    "name, brand, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    # products are indexed along with the name of their brand
+    "CREATE TRIGGER {fts}_insert AFTER INSERT ON glist_product BEGIN "
+    "INSERT INTO {fts} (rowid, name, brand) "
+    "SELECT new.id, new.name, name FROM glist_brand WHERE id = new.brand_id; END",
+    "CREATE TRIGGER {fts}_update AFTER UPDATE OF name, brand_id ON glist_product BEGIN "
+    "DELETE FROM {fts} WHERE rowid = old.id; "
+    "INSERT INTO {fts} (rowid, name, brand) "
+    "SELECT new.id, new.name, name FROM glist_brand WHERE id = new.brand_id; END",
+    "CREATE TRIGGER {fts}_delete AFTER DELETE ON glist_product BEGIN "
+    "DELETE FROM {fts} WHERE rowid = old.id; END",
+    "CREATE TRIGGER {fts}_brand AFTER UPDATE OF name ON glist_brand BEGIN "
+    "UPDATE {fts} SET brand = new.name "
+    "WHERE rowid IN (SELECT id FROM glist_product WHERE brand_id = new.id); END",
+    "INSERT INTO {fts} (rowid, name, brand) "
+    "SELECT p.id, p.name, b.name FROM glist_product p JOIN glist_brand b ON b.id = p.brand_id",
+]
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS {fts}_insert',
+    'DROP TRIGGER IF EXISTS {fts}_update',
+    'DROP TRIGGER IF EXISTS {fts}_delete',
+    'DROP TRIGGER IF EXISTS {fts}_brand',
+    'DROP TABLE IF EXISTS {fts}',
+]
+
+
+def fts_supported(schema_editor) -> bool:
+    """
+    Whether the database can hold the full-text index
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def create_index(apps, schema_editor):
+    # FTS5 is SQLite only, other databases search with plain filters
+    if fts_supported(schema_editor):
+        for sql in CREATE_SQL:
+            schema_editor.execute(sql.format(fts=FTS_TABLE))
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_SQL:
+            schema_editor.execute(sql.format(fts=FTS_TABLE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('glist', '0007_item_product_unique_and_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
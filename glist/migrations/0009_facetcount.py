@@ -0,0 +1,46 @@
+# Generated by Django 3.1.1 on 2026-10-18 09:19
+
+from django.db import migrations, models
+from django.db.models import Case, Count, Value, When
+import django.db.models.deletion
+
+PRICE_BANDS = (0, 25, 50, 100, 250, 500, 1000)
+
+
+def count_products(apps, schema_editor):
+    """
+    Same as `glist.facets.rebuild`, against the historical models
+    """
+    Product = apps.get_model('glist', 'Product')
+    FacetCount = apps.get_model('glist', 'FacetCount')
+    band = Case(*[When(price__gte=lower, then=Value(i)) for i, lower in reversed(list(enumerate(PRICE_BANDS)))],
+                default=Value(0), output_field=models.IntegerField())
+    cells = Product.objects.annotate(band=band).values('brand', 'currency', 'band').annotate(n=Count('pk')).order_by()
+    FacetCount.objects.bulk_create([
+        FacetCount(brand_id=c['brand'], currency_id=c['currency'], band=c['band'], products=c['n']) for c in cells
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('glist', '0008_product_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField(help_text='Index into glist.facets.PRICE_BANDS')),
+                ('products', models.PositiveIntegerField(default=0)),
+                ('brand', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='glist.brand')),
+                ('currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='glist.currency')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='facetcount',
+            constraint=models.UniqueConstraint(fields=('brand', 'currency', 'band'), name='glist_facet_cell'),
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.1 on 2026-10-18 09:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('glist', '0009_facetcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='guest',
+            name='invited_at',
+            field=models.DateTimeField(blank=True, help_text='When the announcement was mailed, see `glist.invitations`', null=True, verbose_name='Invited'),
+        ),
+    ]
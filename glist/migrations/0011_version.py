@@ -0,0 +1,33 @@
+# Generated by Django 3.1.1 on 2026-10-18 09:48
+
+import time
+
+from django.db import migrations, models
+
+
+def create_counters(apps, schema_editor):
+    """
+    Counters of the catalog, so that readers don't race to create them
+    """
+    Version = apps.get_model('glist', 'Version')
+    seed = int(time.time() * 1000)
+    Version.objects.bulk_create([Version(name=name, value=seed)
+                                 for name in ('brand', 'currency', 'product', 'stock')])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('glist', '0010_guest_invited_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Version',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(create_counters, migrations.RunPython.noop),
+    ]
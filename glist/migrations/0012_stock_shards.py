@@ -0,0 +1,31 @@
+# Generated by Django 3.1.1 on 2026-10-18 10:30
+
+from django.db import migrations
+
+SHARDS = 64
+
+
+def create_shards(apps, schema_editor):
+    """
+    Rows of the `stock` counter, see glist.versions.SHARDS; the `stock`
+        row keeps its seed, they start from 0
+    """
+    Version = apps.get_model('glist', 'Version')
+    Version.objects.bulk_create([Version(name='stock:%d' % n, value=0) for n in range(SHARDS)],
+                                ignore_conflicts=True)
+
+
+def delete_shards(apps, schema_editor):
+    Version = apps.get_model('glist', 'Version')
+    Version.objects.filter(name__in=['stock:%d' % n for n in range(SHARDS)]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('glist', '0011_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_shards, delete_shards),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 3.1.1 on 2026-10-18 11:20
+
+from importlib import import_module
+
+from django.db import migrations
+
+FTS_TABLE = 'glist_product_fts'
+# see glist.search.SCORE_SHIFT
+SCORE_SHIFT = 40
+
+
+def key(row: str) -> str:
+    """
+    SQL for the index rowid of a product: the spaces in its name, fewer
+        first as bm25 ranks shorter names higher, then its id
+    """
+    return ("((length({row}.name) - length(replace({row}.name, ' ', ''))) << {shift}) + {row}.id"
+            .format(row=row, shift=SCORE_SHIFT))
+
+
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE {fts} USING fts5("
+    "name, brand, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    # products are indexed along with the name of their brand
+    "CREATE TRIGGER {fts}_insert AFTER INSERT ON glist_product BEGIN "
+    "INSERT INTO {fts} (rowid, name, brand) "
+    "SELECT %s, new.name, name FROM glist_brand WHERE id = new.brand_id; END" % key('new'),
+    "CREATE TRIGGER {fts}_update AFTER UPDATE OF name, brand_id ON glist_product BEGIN "
+    "DELETE FROM {fts} WHERE rowid = %s; "
+    "INSERT INTO {fts} (rowid, name, brand) "
+    "SELECT %s, new.name, name FROM glist_brand WHERE id = new.brand_id; END"
+    % (key('old'), key('new')),
+    "CREATE TRIGGER {fts}_delete AFTER DELETE ON glist_product BEGIN "
+    "DELETE FROM {fts} WHERE rowid = %s; END" % key('old'),
+    "CREATE TRIGGER {fts}_brand AFTER UPDATE OF name ON glist_brand BEGIN "
+    "UPDATE {fts} SET brand = new.name "
+    "WHERE rowid IN (SELECT %s FROM glist_product p WHERE brand_id = new.id); END" % key('p'),
+    "INSERT INTO {fts} (rowid, name, brand) "
+    "SELECT %s, p.name, b.name FROM glist_product p JOIN glist_brand b ON b.id = p.brand_id"
+    % key('p'),
+]
+
+product_fts = import_module('glist.migrations.0008_product_fts')
+
+
+def rebuild(create_sql):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sql in product_fts.DROP_SQL:
+            schema_editor.execute(sql.format(fts=FTS_TABLE))
+        if product_fts.fts_supported(schema_editor):
+            for sql in create_sql:
+                schema_editor.execute(sql.format(fts=FTS_TABLE))
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('glist', '0012_stock_shards'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild(CREATE_SQL), rebuild(product_fts.CREATE_SQL)),
+    ]
@@ -27,10 +27,14 @@ class Product(models.Model):
     """
     Global repository of items to be added to gift lists
     Products with 0 stock can't be added to any Gift list
+    Units added to gift lists are reserved until purchased, see `glist.stock`
     """
     name = models.CharField(_('Name'), max_length=50)
     price = models.DecimalField(_('Price'), max_digits=8, decimal_places=2, help_text='Includes taxes')
     qty = models.PositiveSmallIntegerField(_('Quant in Stock'), default=0)
+    qty_reserved = models.PositiveSmallIntegerField(
+        _('Reserved'), default=0,
+        help_text="Units of the stock claimed by gift lists and not yet purchased")
     brand = models.ForeignKey(Brand, on_delete=models.CASCADE, verbose_name=_('Brand'))
     currency = models.ForeignKey(Currency, on_delete=models.CASCADE,
                                  verbose_name=_('Currency'), default="GBP")
@@ -38,6 +42,9 @@ class Product(models.Model):
     def brand_name(self):
         return self.brand.name
 
+    def available(self):
+        return self.qty - self.qty_reserved
+
 
 class GiftList(models.Model):
     wedding_date = models.DateField(_('Wedding Date'))
@@ -58,15 +65,26 @@ class Guest(models.Model):
     recipient = models.CharField(_('Guest(s) names'), max_length=80,
                                  help_text='The name or names typically following `Dear ...`')
     wedding = models.ForeignKey(GiftList, on_delete=models.CASCADE)
+    # indexed along with `wedding` below
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
-                             related_name='invitations', blank=True)
+                             related_name='invitations', blank=True, db_index=False)
+    invited_at = models.DateTimeField(_('Invited'), null=True, blank=True,
+                                      help_text='When the announcement was mailed, see `glist.invitations`')
+
+    class Meta:
+        indexes = [
+            # a user's invitation to a given list
+            models.Index(fields=['user', 'wedding'], name='glist_guest_user_wedding'),
+        ]
 
 
 class GiftListItem(models.Model):
     """
     Each item in a couple's Gist Line
     """
-    gift_list = models.ForeignKey(GiftList, on_delete=models.CASCADE, related_name='items')
+    # indexed by the unique constraint below
+    gift_list = models.ForeignKey(GiftList, on_delete=models.CASCADE, related_name='items',
+                                  db_index=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     qty = models.PositiveSmallIntegerField(_('Quant'), default=1,
                                            help_text="Most of the times only one existence of "
@@ -79,6 +97,17 @@ class GiftListItem(models.Model):
     date_added = models.DateTimeField(_('When added'), auto_now_add=True)
     added_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            # a product is in a list once, its `qty` counts the units
+            models.UniqueConstraint(fields=['gift_list', 'product'], name='glist_item_product'),
+        ]
+        indexes = [
+            # items still to purchase, the only ones guests see
+            models.Index(fields=['gift_list'], condition=models.Q(qty__gt=models.F('qty_purchased')),
+                         name='glist_item_remaining'),
+        ]
+
     def get_price(self):
         """
         If the price is not defined here, get the price from the
@@ -91,10 +120,56 @@ class GiftListItem(models.Model):
 
 
 class Purchase(models.Model):
-    item = models.ForeignKey(GiftListItem, on_delete=models.CASCADE, verbose_name=_('Item'))
+    # indexed along with `date_paid` below
+    item = models.ForeignKey(GiftListItem, on_delete=models.CASCADE, verbose_name=_('Item'),
+                             db_index=False)
     qty = models.PositiveSmallIntegerField(_('Quantity'), default=1,
                                            help_text="Most of the times only one existence of "
                                                      "any item will be purchased by a Guest")
     customer = models.ForeignKey(Guest, on_delete=models.CASCADE)
     date_paid = models.DateTimeField(auto_now_add=True)
     total = models.DecimalField(_('Price'), max_digits=8, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            # purchases of an item, latest first
+            models.Index(fields=['item', '-date_paid'], name='glist_purchase_item_date'),
+        ]
+
+
+class GiftListSummary(models.Model):
+    """
+    Running totals of a GiftList, kept up to date by `glist.summary`
+    """
+    gift_list = models.OneToOneField(GiftList, on_delete=models.CASCADE, primary_key=True,
+                                     related_name='summary')
+    items = models.PositiveIntegerField(_('Items'), default=0)
+    units = models.PositiveIntegerField(_('Units wanted'), default=0)
+    units_purchased = models.PositiveIntegerField(_('Units purchased'), default=0)
+    raised = models.DecimalField(_('Raised'), max_digits=10, decimal_places=2, default=0)
+
+
+class FacetCount(models.Model):
+    """
+    Number of products per brand, currency and price band, the cells the
+        catalog facet counts are added up from; kept by `glist.facets`
+    """
+    # indexed by the unique constraint below
+    brand = models.ForeignKey(Brand, on_delete=models.CASCADE, db_index=False)
+    currency = models.ForeignKey(Currency, on_delete=models.CASCADE)
+    band = models.PositiveSmallIntegerField(help_text='Index into glist.facets.PRICE_BANDS')
+    products = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['brand', 'currency', 'band'], name='glist_facet_cell'),
+        ]
+
+
+class Version(models.Model):
+    """
+    Counter telling whether cached representations of `name` are stale,
+        kept by `glist.versions`
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField()
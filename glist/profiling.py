@@ -0,0 +1,186 @@
+"""
+Profiles of single requests, asked for by staff or a signed header
+
+`glist.middleware.profiling_middleware` runs a request under cProfile
+(and pyinstrument's sampling profiler when it is installed) when it has
+a `_profile` query parameter and comes from a staff user, or carries an
+X-Glist-Profile header holding a `make_token()` token issued to the user
+making it. Profiles go to
+GLIST_PROFILE_DIR, keeping the last GLIST_PROFILE_KEEP of them, and are
+browsed from the staff `profiles` page.
+"""
+import cProfile
+from contextlib import contextmanager
+import contextvars
+from datetime import datetime
+import io
+import json
+import os
+import pstats
+import re
+import tempfile
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core import signing
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+HEADER = 'HTTP_X_GLIST_PROFILE'
+QUERY_FLAG = '_profile'
+TOKEN_SALT = 'glist.profiling'
+TOKEN_MAX_AGE = 3600  # seconds
+NAME_RE = re.compile(r'^\d{8}-\d{6}-\d{6}-[0-9a-f]{4}$')
+
+# the RequestProfile of the request being served, if it is profiled
+current_profile = contextvars.ContextVar('glist_profile', default=None)
+
+
+def profile_dir() -> str:
+    return getattr(settings, 'GLIST_PROFILE_DIR',
+                   os.path.join(tempfile.gettempdir(), 'glist-profiles'))
+
+
+def make_token(user) -> str:
+    """
+    Value for the X-Glist-Profile header, valid for TOKEN_MAX_AGE seconds
+        on the requests of `user` only
+    """
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(str(user.pk))
+
+
+def asked(request) -> bool:
+    """
+    Whether `request` asks to be profiled, cheap enough for every request
+    """
+    return HEADER in request.META or QUERY_FLAG in request.META.get('QUERY_STRING', '')
+
+
+def wanted(request) -> bool:
+    """
+    Whether to profile a request that `asked()`
+    """
+    token = request.META.get(HEADER)
+    if token is not None:
+        try:
+            user_pk = signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=TOKEN_MAX_AGE)
+        except signing.BadSignature:
+            return False
+        return request.user.is_authenticated and user_pk == str(request.user.pk)
+    return QUERY_FLAG in request.GET and request.user.is_staff
+
+
+class RequestProfile(object):
+    """
+    Profilers running on the current thread for the duration of the block,
+        and on the other threads the request runs in through `thread()`
+    """
+
+    def __init__(self):
+        self.cprofile = cProfile.Profile()
+        self.threads = []
+        self.sampler = SamplingProfiler() if SamplingProfiler is not None else None
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        if self.sampler is not None:
+            self.sampler.start()
+        self.cprofile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cprofile.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.elapsed = time.perf_counter() - self.start
+
+    @contextmanager
+    def thread(self):
+        """
+        Adds the block, run in a thread of its own, to the profile
+        """
+        cprofile = cProfile.Profile()
+        self.threads.append(cprofile)
+        cprofile.enable()
+        try:
+            yield
+        finally:
+            cprofile.disable()
+
+    def stats(self) -> pstats.Stats:
+        stats = pstats.Stats(self.cprofile)
+        for cprofile in self.threads:
+            stats.add(cprofile)
+        return stats
+
+
+def save(profile: RequestProfile, request, response, view: str) -> str:
+    """
+    Writes the profile and its metadata, drops the oldest beyond
+        GLIST_PROFILE_KEEP, returns its name
+    """
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    # sorts by time
+    name = '%s-%s' % (datetime.now().strftime('%Y%m%d-%H%M%S-%f'), uuid4().hex[:4])
+    path = os.path.join(directory, name)
+    profile.stats().dump_stats(path + '.prof')
+    if profile.sampler is not None:
+        with open(path + '.html', 'w') as f:
+            f.write(profile.sampler.output_html())
+    meta = {'name': name, 'method': request.method, 'path': request.get_full_path(),
+            'view': view, 'status': response.status_code, 'elapsed': profile.elapsed,
+            'user': request.user.get_username(), 'sampled': profile.sampler is not None}
+    with open(path + '.json', 'w') as f:
+        json.dump(meta, f)
+    for old in entries()[getattr(settings, 'GLIST_PROFILE_KEEP', 50):]:
+        for ext in ('.json', '.prof', '.html'):
+            try:
+                os.remove(os.path.join(directory, old + ext))
+            except FileNotFoundError:
+                pass
+    return name
+
+
+def entries() -> list:
+    """
+    Names of the saved profiles, newest first
+    """
+    try:
+        files = os.listdir(profile_dir())
+    except FileNotFoundError:
+        return []
+    return sorted((f[:-5] for f in files if f.endswith('.json') and NAME_RE.match(f[:-5])),
+                  reverse=True)
+
+
+def metadata(name: str) -> dict:
+    with open(os.path.join(profile_dir(), name + '.json')) as f:
+        return json.load(f)
+
+
+def file_path(name: str, ext: str) -> str:
+    """
+    Path of a saved profile's file, FileNotFoundError if there is none
+    """
+    if not NAME_RE.match(name):
+        raise FileNotFoundError(name)
+    path = os.path.join(profile_dir(), name + ext)
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    return path
+
+
+def summary(name: str, limit: int = 40) -> str:
+    """
+    The `limit` costliest calls of a saved profile, by cumulative time
+    """
+    out = io.StringIO()
+    stats = pstats.Stats(file_path(name, '.prof'), stream=out)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,301 @@
+"""
+PDF report of a GiftList: purchased items followed by the remaining ones
+
+Two renderers produce it: the original one, and a faster one (the default,
+see GLIST_FAST_REPORTS) which aggregates in the database, builds its
+styles once per process and only wraps text in Paragraphs when it would
+not fit its column.
+Rendered reports are kept in a size-bounded LRU cache, keyed by the
+gift list and the versions of everything they show
+"""
+from collections import OrderedDict
+from functools import lru_cache
+from io import BytesIO
+from threading import Lock
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models.aggregates import Sum
+from django.db.models.expressions import F
+from django.db.models.functions import TruncDate
+
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.lib.units import inch
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import (SimpleDocTemplate, Paragraph, Spacer, Table,
+                                TableStyle, PageBreak)
+
+from .models import GiftListItem, Purchase
+from .versions import get_versions, list_version_name
+
+
+class ReportCache(object):
+    """
+    LRU cache of rendered reports, bounded by their total size in bytes
+    Only the latest version of each gift list's report is kept
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()  # gift_list_id: (version, pdf)
+        self.lock = Lock()
+
+    def get(self, gift_list_id: int, version):
+        with self.lock:
+            entry = self.entries.get(gift_list_id)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(gift_list_id)
+            return entry[1]
+
+    def set(self, gift_list_id: int, version, pdf: bytes) -> bool:
+        """
+        Whether the report could be kept, only when it fits at all
+        """
+        if len(pdf) > self.max_bytes:
+            return False
+        with self.lock:
+            old = self.entries.pop(gift_list_id, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[gift_list_id] = (version, pdf)
+            self.size += len(pdf)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+        return True
+
+
+report_cache = ReportCache(getattr(settings, 'GLIST_REPORT_CACHE_BYTES', 64 * 1024 * 1024))
+
+PURCHASED_WIDTHS = (150, 100, 60, 30, 75, 55)
+REMAINING_WIDTHS = (300, 150, 30)
+CELL_PADDING = 12  # platypus.Table default left + right padding
+
+
+def purchased_table(gift_list_id: int) -> list:
+    """
+    Generates the list of purchased items
+    Return a list a list-of-lists of flowables
+    to be used as platypus.Table content
+    """
+    ss = getSampleStyleSheet()
+    s = ss['Normal']
+    table = [
+        [Paragraph('Name', s), Paragraph('Brand', s),
+         Paragraph('Price', s), Paragraph('Qty', s),
+         Paragraph('Guest', s), Paragraph('Date', s)
+         ],
+    ]
+    purchases = Purchase.objects.select_related('item__product__brand', 'customer'
+                                                ).filter(
+        item__gift_list_id=gift_list_id, item__gift_list__active=True
+    ).annotate(cnt=Sum('qty')).order_by('-date_paid', '-total')
+    for p in purchases:
+        table.append([
+            Paragraph(p.item.product.name, s),
+            Paragraph(p.item.product.brand.name, s),
+            Paragraph('%s' % p.item.get_price(), s),
+            Paragraph('%d' % p.cnt, s),
+            Paragraph('%s' % p.customer.recipient, s),
+            Paragraph(p.date_paid.strftime('%y-%m-%d'), s),
+        ])
+    return table
+
+
+def remaining_table(gift_list_id: int) -> list:
+    """
+    Generates the list of tems which were not [yet] purchased
+    Items which have multiple amounts are grouped and their
+    corresponding counts returned
+
+    Return a list a list-of-lists of flowables
+    to be used as platypus.Table content
+    """
+    ss = getSampleStyleSheet()
+    s = ss['Normal']
+    table = [
+        [Paragraph('Name', s), Paragraph('Brand', s), Paragraph('Qty', s)],
+    ]
+    remaining = GiftListItem.objects.select_related(
+        'product__brand').filter(gift_list_id=gift_list_id, gift_list__active=True
+                                 ).annotate(left=F('qty') - F('qty_purchased')
+                                            ).filter(left__gt=0).annotate(total=Sum('left'))
+    for r in remaining:
+        table.append([
+            Paragraph(r.product.name, s),
+            Paragraph(r.product.brand.name, s),
+            Paragraph('%d' % r.total, s),
+        ])
+    return table
+
+
+@lru_cache(maxsize=None)
+def report_styles():
+    """
+    Styles of the fast renderer, built once per process
+    Returns the body and heading paragraph styles and the table style
+    """
+    ss = getSampleStyleSheet()
+    list_style = TableStyle(
+        [('LINEBELOW', (0, 0), (-1, -1), 1, colors.grey),
+         ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+         ('ALIGN', (1, 0), (-1, -1), 'LEFT'),
+         ('FONT', (0, 0), (-1, -1), ss['Normal'].fontName, ss['Normal'].fontSize,
+          ss['Normal'].leading),
+         ])
+    return ss['Normal'], ss['Heading1'], list_style
+
+
+def cell(text: str, width: int, style):
+    """
+    Plain strings are much cheaper to lay out than Paragraphs,
+        these are only needed when the text has to wrap
+    """
+    if stringWidth(text, style.fontName, style.fontSize) <= width - CELL_PADDING:
+        return text
+    return Paragraph(escape(text), style)
+
+
+def purchased_rows(gift_list_id: int = None):
+    """
+    Purchases grouped by item, guest and day
+    Of every active list when `gift_list_id` is not given
+    """
+    purchases = Purchase.objects.filter(item__gift_list__active=True)
+    if gift_list_id is not None:
+        purchases = purchases.filter(item__gift_list_id=gift_list_id)
+    return purchases.annotate(day=TruncDate('date_paid')).values(
+        'item', 'customer', 'day', 'item__price', 'item__product__price',
+        'item__product__name', 'item__product__brand__name', 'customer__recipient',
+        'item__gift_list', 'item__product',
+    ).annotate(cnt=Sum('qty'), amount=Sum('total')).order_by('-day', '-amount')
+
+
+def remaining_rows(gift_list_id: int = None):
+    """
+    Units left to purchase, grouped by list and product
+    Of every active list when `gift_list_id` is not given
+    """
+    items = GiftListItem.objects.filter(gift_list__active=True, qty__gt=F('qty_purchased'))
+    if gift_list_id is not None:
+        items = items.filter(gift_list_id=gift_list_id)
+    return items.values('gift_list', 'product', 'product__name', 'product__brand__name'
+                        ).annotate(total=Sum(F('qty') - F('qty_purchased'))
+                                   ).order_by('product__name')
+
+
+def fast_purchased_table(gift_list_id: int) -> list:
+    s = report_styles()[0]
+    widths = PURCHASED_WIDTHS
+    table = [['Name', 'Brand', 'Price', 'Qty', 'Guest', 'Date']]
+    for p in purchased_rows(gift_list_id).iterator():
+        table.append([
+            cell(p['item__product__name'], widths[0], s),
+            cell(p['item__product__brand__name'], widths[1], s),
+            '%s' % (p['item__price'] or p['item__product__price']),
+            '%d' % p['cnt'],
+            cell(p['customer__recipient'], widths[4], s),
+            p['day'].strftime('%y-%m-%d'),
+        ])
+    return table
+
+
+def fast_remaining_table(gift_list_id: int) -> list:
+    s = report_styles()[0]
+    widths = REMAINING_WIDTHS
+    table = [['Name', 'Brand', 'Qty']]
+    for r in remaining_rows(gift_list_id).iterator():
+        table.append([
+            cell(r['product__name'], widths[0], s),
+            cell(r['product__brand__name'], widths[1], s),
+            '%d' % r['total'],
+        ])
+    return table
+
+
+def fast_story(gift_list_id: int, progress) -> list:
+    s, sH, list_style = report_styles()
+    story = [
+        Paragraph('Purchased Gifts', sH),
+        Spacer(1, 0.2 * inch),
+        Table(fast_purchased_table(gift_list_id), colWidths=PURCHASED_WIDTHS, style=list_style),
+    ]
+    progress(40)
+    story.extend([
+        PageBreak(),
+        Paragraph('Not Purchased Gifts', sH),
+        Spacer(1, 0.2 * inch),
+        Table(fast_remaining_table(gift_list_id), colWidths=REMAINING_WIDTHS, style=list_style),
+    ])
+    return story
+
+
+def render_report(gift_list_id: int, progress=None, fast: bool = None) -> bytes:
+    """
+    Return a PDF with list of purchased items followed by
+    that list of items which are remaining in the GiftList
+    `progress`, if given, is called with the percentage done along the way
+    `fast` picks the renderer, GLIST_FAST_REPORTS by default
+    """
+    progress = progress or (lambda percent: None)
+    if fast is None:
+        fast = getattr(settings, 'GLIST_FAST_REPORTS', True)
+    if fast:
+        story = fast_story(gift_list_id, progress)
+    else:
+        story = legacy_story(gift_list_id, progress)
+    progress(60)
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def legacy_story(gift_list_id: int, progress) -> list:
+    ss = getSampleStyleSheet()
+    sH = ss['Heading1']
+
+    list_style = TableStyle(
+        [('LINEBELOW', (0, 0), (-1, -1), 1, colors.grey),
+         ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+         ('ALIGN', (1, 0), (-1, -1), 'LEFT'),
+         ])
+
+    story1 = [
+        Paragraph('Purchased Gifts', sH),
+        Spacer(1, 0.2 * inch),
+        Table(purchased_table(gift_list_id), colWidths=PURCHASED_WIDTHS,
+              style=list_style)
+    ]
+    progress(40)
+    story2 = [
+        Paragraph('Not Purchased Gifts', sH),
+        Spacer(1, 0.2 * inch),
+        Table(remaining_table(gift_list_id), colWidths=REMAINING_WIDTHS,
+              style=list_style)
+    ]
+
+    story1.append(PageBreak())
+    story1.extend(story2)
+    return story1
+
+
+def report_version(gift_list_id: int) -> tuple:
+    return tuple(get_versions('product', 'brand', list_version_name(gift_list_id)))
+
+
+def get_report(gift_list_id: int) -> bytes:
+    """
+    The report of the GiftList, rendered only if it changed since last time
+    """
+    # Read first: a change while rendering leaves the result under the old version
+    version = report_version(gift_list_id)
+    pdf = report_cache.get(gift_list_id, version)
+    if pdf is None:
+        pdf = render_report(gift_list_id)
+        report_cache.set(gift_list_id, version, pdf)
+    return pdf
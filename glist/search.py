@@ -0,0 +1,78 @@
+"""
+Product search over the product and brand names
+
+On SQLite with FTS5 the `glist_product_fts` table, kept in sync by
+triggers (see migrations 0008 and 0013), answers ranked prefix queries
+from its index. Elsewhere it falls back to `icontains` filters ordered
+by name.
+Ranking every match of a common word by bm25 takes time in proportion to
+the catalog, so the index is keyed by a score stored along with the
+product id: the number of words of its name, as bm25 ranks shorter names
+first. Matches are read in that order, which the index gives for free,
+and only the first RANK_WINDOW of them are ranked by bm25.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Product
+
+FTS_TABLE = 'glist_product_fts'
+TERM_RE = re.compile(r'\w+')
+MAX_TERMS = 8
+# matches ranked by bm25 per query, see `search_ids`
+RANK_WINDOW = 1000
+# index rowids are the score shifted left by this, plus the product id
+SCORE_SHIFT = 40
+
+_has_index = {}
+
+
+def has_index() -> bool:
+    """
+    Whether migration 0008 could create the full-text index, once per database
+    """
+    name = connection.settings_dict['NAME']
+    if name not in _has_index:
+        _has_index[name] = FTS_TABLE in connection.introspection.table_names()
+    return _has_index[name]
+
+
+def terms(query: str) -> list:
+    return TERM_RE.findall(query.lower())[:MAX_TERMS]
+
+
+def search_ids(query: str, offset: int, limit: int) -> list:
+    """
+    Ids of the products matching every term of `query`, as prefixes,
+        best matches first
+    The first RANK_WINDOW matches by score are ranked by bm25, then the
+        rest follow in score order; every page is cut from that one order,
+        so pages never overlap
+    """
+    words = terms(query)
+    if not words:
+        return []
+    if has_index():
+        # quoted, so that terms are never read as FTS5 operators
+        match = ' '.join('"%s"*' % word for word in words)
+        keys = []
+        with connection.cursor() as cursor:
+            if offset < RANK_WINDOW:
+                cursor.execute('SELECT rowid FROM (SELECT rowid, rank FROM %s WHERE %s MATCH %%s '
+                               'ORDER BY rowid LIMIT %%s) ORDER BY rank, rowid LIMIT %%s OFFSET %%s'
+                               % (FTS_TABLE, FTS_TABLE),
+                               [match, RANK_WINDOW, min(limit, RANK_WINDOW - offset), offset])
+                keys += [row[0] for row in cursor.fetchall()]
+            if offset + limit > RANK_WINDOW:
+                start = max(offset, RANK_WINDOW)
+                cursor.execute('SELECT rowid FROM %s WHERE %s MATCH %%s '
+                               'ORDER BY rowid LIMIT %%s OFFSET %%s' % (FTS_TABLE, FTS_TABLE),
+                               [match, offset + limit - start, start])
+                keys += [row[0] for row in cursor.fetchall()]
+        return [key & ((1 << SCORE_SHIFT) - 1) for key in keys]
+    products = Product.objects.all()
+    for word in words:
+        products = products.filter(Q(name__icontains=word) | Q(brand__name__icontains=word))
+    return list(products.order_by('name', 'pk').values_list('pk', flat=True)[offset:offset + limit])
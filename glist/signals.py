@@ -0,0 +1,83 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import stock
+from .models import (Brand, Currency, GiftList, GiftListItem, GiftListSummary, Guest, Product,
+                     Purchase)
+from .metrics import install
+from .versions import bump_version, list_version_name
+
+# set while items are deleted in bulk by a caller that releases their
+# reservations and bumps the list version itself
+bulk_item_removal = ContextVar('glist_bulk_item_removal', default=False)
+
+
+@contextmanager
+def removing_items_in_bulk():
+    token = bulk_item_removal.set(True)
+    try:
+        yield
+    finally:
+        bulk_item_removal.reset(token)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def catalog_changed(sender, **kwargs):
+    bump_version(sender._meta.model_name)
+
+
+@receiver(post_save, sender=GiftList)
+@receiver(post_delete, sender=GiftList)
+def gift_list_changed(sender, instance, **kwargs):
+    bump_version(list_version_name(instance.pk))
+
+
+@receiver(post_save, sender=GiftList)
+def create_summary(sender, instance, created, raw=False, **kwargs):
+    # fixtures bring their own, or get one from `reconcile_summaries`
+    if created and not raw:
+        GiftListSummary.objects.create(gift_list=instance)
+
+
+@receiver(post_save, sender=Guest)
+@receiver(post_delete, sender=Guest)
+def guest_changed(sender, instance, **kwargs):
+    bump_version(list_version_name(instance.wedding_id))
+
+
+@receiver(post_save, sender=GiftListItem)
+@receiver(post_delete, sender=GiftListItem)
+def gift_list_item_changed(sender, instance, **kwargs):
+    if bulk_item_removal.get():
+        return
+    bump_version(list_version_name(instance.gift_list_id))
+
+
+@receiver(post_delete, sender=GiftListItem)
+def release_reservation(sender, instance, **kwargs):
+    # however the item goes, through the admin or along with its list
+    if bulk_item_removal.get():
+        return
+    units = instance.qty - instance.qty_purchased
+    if units > 0:
+        stock.release(instance.product_id, units)
+
+
+@receiver(post_save, sender=Purchase)
+@receiver(post_delete, sender=Purchase)
+def purchase_changed(sender, instance, **kwargs):
+    bump_version(list_version_name(instance.item.gift_list_id))
+
+
+@receiver(connection_created)
+def count_queries(sender, connection, **kwargs):
+    install(connection)
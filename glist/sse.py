@@ -0,0 +1,118 @@
+"""
+Server-Sent Events of gift list changes, served straight from ASGI
+
+A connection is an idle coroutine waiting on its `events` subscription,
+so a single worker holds thousands of them. Changes made through any
+process reach it, see `glist.events`. Django 3.1 can't stream from
+async code, hence a plain ASGI app in front of Django's; `wshop.asgi`
+routes EVENTS_PATH to it and everything else to Django.
+"""
+import asyncio
+from importlib import import_module
+import json
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.db.models import Q
+from django.http import HttpRequest
+from django.http.cookie import parse_cookie
+
+from .events import broker, list_channel
+from .models import GiftList
+from .versions import get_version, list_version_name
+
+EVENTS_PATH = re.compile(r'^/events/list/(?P<gift_list_id>\d+)/$')
+HEARTBEAT = 20  # seconds, keeps proxies from closing idle connections
+RETRY = 5000  # milliseconds before browsers reconnect
+
+
+def follower(cookie_header: str, gift_list_id: int):
+    """
+    The version of the list if the session in the cookies may follow it
+        (its couple, or once active its guests), else None
+    """
+    close_old_connections()
+    try:
+        request = HttpRequest()
+        session_key = parse_cookie(cookie_header).get(settings.SESSION_COOKIE_NAME)
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+        user = get_user(request)
+        if not user.is_authenticated:
+            return None
+        if not GiftList.objects.filter(Q(user=user) | Q(active=True, guest__user=user),
+                                       pk=gift_list_id).exists():
+            return None
+        return get_version(list_version_name(gift_list_id))
+    finally:
+        close_old_connections()
+
+
+def encode(event: dict) -> bytes:
+    data = json.dumps(event, cls=DjangoJSONEncoder)
+    return ('id: %d\ndata: %s\n\n' % (event['id'], data)).encode()
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def plain_response(send, status: int, body: bytes):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def events_app(scope, receive, send):
+    match = EVENTS_PATH.match(scope['path'])
+    if match is None:
+        return await plain_response(send, 404, b'Not found')
+    gift_list_id = int(match.group('gift_list_id'))
+    headers = dict(scope['headers'])
+    version = await sync_to_async(follower, thread_sensitive=True)(
+        headers.get(b'cookie', b'').decode('latin-1'), gift_list_id)
+    if version is None:
+        return await plain_response(send, 403, b'Forbidden')
+
+    channel = list_channel(gift_list_id)
+    queue = broker.subscribe(channel, version)
+    disconnect = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'body': b'retry: %d\n\n' % RETRY,
+                    'more_body': True})
+        while True:
+            get = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({get, disconnect}, timeout=HEARTBEAT,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                get.cancel()
+                break
+            if get in done:
+                body = encode(get.result())
+            else:
+                get.cancel()
+                body = b': keep-alive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        broker.unsubscribe(channel, queue)
+        disconnect.cancel()
+
+
+def router(django_app):
+    """
+    ASGI app sending list events to `events_app` and the rest to Django
+    """
+    async def app(scope, receive, send):
+        if scope['type'] == 'http' and EVENTS_PATH.match(scope['path']):
+            return await events_app(scope, receive, send)
+        return await django_app(scope, receive, send)
+    return app
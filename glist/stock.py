@@ -0,0 +1,76 @@
+"""
+Stock reservations
+
+Adding a product to a gift list reserves a unit of its stock, removing it
+releases the unit and purchasing it takes the unit out of the stock.
+Every change is a single conditional UPDATE, so concurrent gift lists can
+never claim more than what is in stock.
+Changes bump the `stock` version rather than the `product` one, so that
+only what shows stock levels is invalidated, on the shard of the product
+changed (see `glist.versions.SHARDS`): changes to different products don't
+queue on a single row.
+"""
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+
+from .models import Product
+from .versions import bump_version
+
+
+class OutOfStock(Exception):
+    pass
+
+
+def reserve(product_id: int, qty: int = 1):
+    reserved = Product.objects.filter(
+        pk=product_id, qty__gte=F('qty_reserved') + qty
+    ).update(qty_reserved=F('qty_reserved') + qty)
+    if not reserved:
+        raise OutOfStock(product_id)
+    bump_version('stock', product_id)
+
+
+def release(product_id: int, qty: int = 1):
+    Product.objects.filter(pk=product_id).update(
+        qty_reserved=Greatest(F('qty_reserved') - qty, Value(0)))
+    bump_version('stock', product_id)
+
+
+def adjust_reservations(deltas: dict):
+    """
+    Adds {product_id: units} to the reservations in one UPDATE, units being
+        positive to reserve and negative to release
+    Unlike `reserve` it does not check the stock: the caller must have
+        checked it with the product rows locked
+    """
+    deltas = {pk: units for pk, units in deltas.items() if units}
+    if not deltas:
+        return
+    whens = [When(pk=pk, then=F('qty_reserved') + units) for pk, units in deltas.items()]
+    Product.objects.filter(pk__in=deltas).update(
+        qty_reserved=Greatest(Case(*whens, default=F('qty_reserved')), Value(0)))
+    # one shard is enough to change the version
+    bump_version('stock', min(deltas))
+
+
+def commit(product_id: int, qty: int = 1):
+    """
+    Purchased units leave the stock along with their reservation
+    """
+    commit_many({product_id: qty})
+
+
+def commit_many(units: dict):
+    """
+    Same as `commit` for several products in one UPDATE, takes {product_id: qty}
+    """
+    if not units:
+        return
+
+    def minus(field):
+        whens = [When(pk=pk, then=F(field) - qty) for pk, qty in units.items()]
+        return Greatest(Case(*whens, default=F(field)), Value(0))
+
+    Product.objects.filter(pk__in=units).update(qty=minus('qty'),
+                                                 qty_reserved=minus('qty_reserved'))
+    bump_version('stock', min(units))
@@ -0,0 +1,88 @@
+"""
+Gift list summaries
+
+Every GiftList has a GiftListSummary row with its number of items, units
+wanted, units purchased and money raised, so showing progress reads one
+row instead of aggregating the whole list.
+The API adjusts it with F-expression UPDATEs in the same transaction as
+the change itself. Changes made elsewhere (admin, shell) are not tracked
+and are put right by the `reconcile_summaries` command.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Greatest
+
+from .models import GiftList, GiftListItem, GiftListSummary, Purchase
+from .versions import bump_version, list_version_name
+
+FIELDS = ('items', 'units', 'units_purchased', 'raised')
+CENTS = Decimal('0.01')
+
+
+def adjust(gift_list_id: int, **deltas):
+    """
+    Adds the given deltas, keyed by field name, to the summary of a list
+    A missing summary is rebuilt instead, so call it after the change
+    Totals are kept from going negative when the summary was out of date
+    """
+    updated = GiftListSummary.objects.filter(gift_list_id=gift_list_id).update(
+        **{name: Greatest(F(name) + value, Value(0)) for name, value in deltas.items()})
+    if not updated:
+        reconcile([gift_list_id])
+
+
+def adjust_bulk(gift_list_id: int, **deltas):
+    """
+    `adjust` after changes written with bulk operations, which send no
+        post_save: also bumps the version of the list, as the signals would
+    """
+    adjust(gift_list_id, **deltas)
+    bump_version(list_version_name(gift_list_id))
+
+
+def compute(gift_list_ids=None) -> dict:
+    """
+    Totals of the given lists, or of all of them, computed from their
+        items and purchases, as {gift_list_id: {field: value}}
+    """
+    lists = GiftList.objects.all()
+    items = GiftListItem.objects.all()
+    purchases = Purchase.objects.all()
+    if gift_list_ids is not None:
+        lists = lists.filter(pk__in=gift_list_ids)
+        items = items.filter(gift_list__in=gift_list_ids)
+        purchases = purchases.filter(item__gift_list__in=gift_list_ids)
+    totals = {pk: dict(items=0, units=0, units_purchased=0, raised=Decimal('0.00'))
+              for pk in lists.values_list('pk', flat=True).iterator()}
+    rows = items.values('gift_list').annotate(items=Count('pk'), units=Sum('qty'),
+                                               units_purchased=Sum('qty_purchased'))
+    for row in rows.iterator():
+        totals[row.pop('gift_list')].update(row)
+    for row in purchases.values('item__gift_list').annotate(raised=Sum('total')).iterator():
+        # SQLite sums decimals as floats
+        totals[row['item__gift_list']]['raised'] = Decimal(row['raised']).quantize(CENTS)
+    return totals
+
+
+def reconcile(gift_list_ids=None) -> list:
+    """
+    Rebuilds the summaries of the given lists, or of all of them
+    Returns the ids of the lists whose summary was missing or wrong
+    """
+    totals = compute(gift_list_ids)
+    existing = GiftListSummary.objects.in_bulk(list(totals))
+    missing, changed = [], []
+    for pk, values in totals.items():
+        summary = existing.get(pk)
+        if summary is None:
+            missing.append(GiftListSummary(gift_list_id=pk, **values))
+        elif any(getattr(summary, name) != values[name] for name in FIELDS):
+            for name in FIELDS:
+                setattr(summary, name, values[name])
+            changed.append(summary)
+    GiftListSummary.objects.bulk_create(missing, ignore_conflicts=True)
+    GiftListSummary.objects.bulk_update(changed, FIELDS)
+    for summary in changed:
+        bump_version(list_version_name(summary.gift_list_id))
+    return sorted([s.gift_list_id for s in missing + changed])
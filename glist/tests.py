@@ -1,16 +1,53 @@
+import asyncio
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+import os
+import queue
+from smtplib import SMTPException
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.management import call_command
-from django.test import TestCase, Client
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.core.management import CommandError, call_command
+from django.core.signals import got_request_exception
+from django.db import OperationalError, connection, transaction
+from django.db.models import F, Sum
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import urlencode
 
+from . import api, datagen, invitations, profiling, search, summary
+from .bench import SCENARIOS, regressions
+from .metrics import registry
 from .models import (Brand, GiftList, GiftListItem, Guest, Product,
                      Purchase)
 
 
+def stream_json(resp):
+    return json.loads(b''.join(resp.streaming_content))
+
+
+# retries of a write refused by a concurrent one in the threaded tests
+MAX_LOCKED_ATTEMPTS = 50
+
+
+def is_locked(error) -> bool:
+    # 'database is locked', or 'database table is locked: <table>' with the
+    # shared in-memory test database
+    return isinstance(error, OperationalError) and 'is locked' in str(error)
+
+
 class DataSetuoMixin(object):
 
     @classmethod
@@ -86,8 +123,7 @@ class TestGiftList(DataSetuoMixin, TestCase):
     def _test_api_url(self, name, count):
         resp = self.client.get(reverse(name))
         self.assertEqual(resp.status_code, 200)
-        # FIXME:
-        data = json.loads(resp.json())
+        data = stream_json(resp)
         self.assertEqual(len(data), count)
 
     def test_api_list_url(self):
@@ -96,6 +132,209 @@ class TestGiftList(DataSetuoMixin, TestCase):
         self._test_api_url('api-product', 20)
 
 
+class TestProductCatalog(TestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def _get(self, **params):
+        resp = self.client.get(reverse('api-product'), params)
+        self.assertEqual(resp.status_code, 200)
+        return [p['id'] for p in stream_json(resp)], resp
+
+    def test_keyset_pages(self):
+        ids, resp = self._get(limit=8)
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(ids), 8)
+        seen = ids
+        while resp.has_header('X-Next-Cursor'):
+            ids, resp = self._get(limit=8, after=resp['X-Next-Cursor'])
+            self.assertTrue(ids and ids[0] > seen[-1])
+            seen += ids
+        self.assertEqual(seen, list(Product.objects.order_by('pk'
+                                                            ).values_list('pk', flat=True)))
+
+    def test_filters(self):
+        ids, _ = self._get(brand=7)
+        self.assertEqual(ids, [13, 14, 15])
+        ids, _ = self._get(brand=7, max_price='100')
+        self.assertEqual(ids, [14])
+        ids, _ = self._get(min_price='449', currency='gbp')
+        self.assertEqual(ids, [7, 8, 15])
+        ids, _ = self._get(in_stock=0)
+        self.assertEqual(ids, [7, 10, 16, 20])
+
+    def test_bad_params(self):
+        for params in ({'limit': 0}, {'limit': 10000}, {'after': 'x'},
+                       {'min_price': 'cheap'}, {'after': 10 ** 20}, {'limit': 10 ** 20},
+                       {'brand': 10 ** 20}, {'brand': [1, -10 ** 20]}):
+            resp = self.client.get(reverse('api-product'), params)
+            self.assertEqual(resp.status_code, 400)
+
+
+class TestProductSearch(TestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def search(self, q, **params):
+        resp = self.client.get(reverse('api-product-search'), dict(params, q=q))
+        self.assertEqual(resp.status_code, 200)
+        return [p['id'] for p in stream_json(resp)], resp
+
+    def test_ranked_prefixes(self):
+        ids, _ = self.search('mixer')
+        self.assertEqual(sorted(ids), [5, 6, 7, 8])
+        ids, _ = self.search('stand mix')
+        self.assertEqual(sorted(ids), [6, 7, 8])
+        # brand names match as well
+        ids, _ = self.search('weber')
+        self.assertEqual(sorted(ids), [11, 12])
+        self.assertEqual(self.search('"lamp" OR *')[0], self.search('lamp OR')[0])
+        self.assertEqual(self.search(' ')[0], [])
+
+    def test_pages(self):
+        ids, resp = self.search('lamp', limit=3)
+        self.assertEqual((len(ids), resp['X-Next-Page']), (3, '2'))
+        more, resp = self.search('lamp', limit=3, page=2)
+        self.assertEqual(sorted(ids + more), [16, 17, 18, 19, 20])
+        self.assertFalse(resp.has_header('X-Next-Page'))
+        for page in (0, 10 ** 20, 2 ** 62):
+            resp = self.client.get(reverse('api-product-search'), {'q': 'lamp', 'page': page})
+            self.assertEqual(resp.status_code, 400)
+
+    def test_ranked_over_all_matches(self):
+        # the best match comes last, after plenty of weaker ones
+        Product.objects.bulk_create([Product(name='Lamp shade in oak, linen and brass %d' % n,
+                                             price=5, brand_id=1) for n in range(40)])
+        best = Product.objects.create(name='Lamp', price=5, brand_id=1)
+        ranked, _ = self.search('lamp', limit=100)
+        self.assertEqual(ranked[0], best.pk)
+        pages = []
+        for page in range(1, 10):
+            ids, resp = self.search('lamp', limit=6, page=page)
+            pages += ids
+            if not resp.has_header('X-Next-Page'):
+                break
+        self.assertEqual(pages, ranked)
+
+    def test_pages_past_window(self):
+        Product.objects.bulk_create([Product(name='Lamp shade in oak, linen and brass %d' % n,
+                                             price=5, brand_id=1) for n in range(20)])
+        best = Product.objects.create(name='Lamp', price=5, brand_id=1)
+        with mock.patch.object(search, 'RANK_WINDOW', 4):
+            ranked, _ = self.search('lamp', limit=100)
+            # the shortest name is read first, and so ranked, however late it came
+            self.assertEqual(ranked[0], best.pk)
+            self.assertEqual(len(ranked), 26)
+            pages = []
+            for page in range(1, 20):
+                ids, resp = self.search('lamp', limit=3, page=page)
+                pages += ids
+                if not resp.has_header('X-Next-Page'):
+                    break
+            self.assertEqual(pages, ranked)
+
+    def test_index_follows_changes(self):
+        Product.objects.filter(pk=1).update(name='Teapot with infuser')
+        Brand.objects.filter(pk=10).update(name='Nkuku Home')
+        Product.objects.bulk_create([Product(name='Infuser', price=5, brand_id=1)])
+        Product.objects.filter(pk=18).delete()
+        ids, _ = self.search('infuser')
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(self.search('home')[0], [])
+        Product.objects.create(name='Candle', price=5, brand_id=10)
+        self.assertEqual(len(self.search('nkuku home')[0]), 1)
+
+    def test_fallback(self):
+        with mock.patch('glist.search.has_index', return_value=False):
+            ids, resp = self.search('stand mix', limit=2)
+            self.assertEqual((ids, resp['X-Next-Page']), ([8, 7], '2'))
+            self.assertEqual(self.search('weber')[0], [12, 11])
+
+
+class TestFacets(TestCase):
+
+    def cells(self):
+        from .models import FacetCount
+        return sorted(FacetCount.objects.filter(products__gt=0).values_list(
+            'brand', 'currency', 'band', 'products'))
+
+    def assertIncremental(self):
+        from .facets import rebuild
+        cells = self.cells()
+        rebuild()
+        self.assertEqual(cells, self.cells())
+
+    def test_loaders_keep_counts(self):
+        call_command('load_products', 'glist/fixtures/products.json', verbosity=0)
+        self.assertIncremental()
+        feed = [{'id': 1, 'name': 'Tea pot', 'brand': 'New brand', 'price': '600.00EUR'},
+                {'id': 2, 'name': 'Casserole', 'brand': 'Le Creuset', 'price': '20.00'},
+                {'id': 99, 'name': 'Teaspoon', 'brand': 'New brand', 'price': '5.00GBP'}]
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            json.dump(feed, f)
+            f.flush()
+            call_command('load_products', f.name, bulk=True, verbosity=0)
+            self.assertIncremental()
+            feed[0]['price'] = '5.00GBP'
+            # a row failing to save leaves its cells alone
+            feed.append({'id': 2, 'name': 'Casserole', 'brand': 'Le Creuset', 'price': '900.00',
+                         'in_stock_quantity': -1})
+            f.seek(0)
+            f.truncate()
+            json.dump(feed, f)
+            f.flush()
+            with self.assertLogs('default', 'ERROR') as logs:
+                call_command('load_products', f.name, verbosity=0, stdout=StringIO(), stderr=StringIO())
+            self.assertIn('qty', logs.output[0])
+            self.assertIncremental()
+        self.assertEqual(sum(c[-1] for c in self.cells()), Product.objects.count())
+
+    def test_browse(self):
+        call_command('load_products', 'glist/fixtures/products.json', verbosity=0)
+        gardenstore = Brand.objects.get(name='GARDENSTORE').pk
+        resp = self.client.get(reverse('api-product-browse'), {'brand': gardenstore})
+        data = resp.json()
+        self.assertEqual([p['id'] for p in data['products']], [13, 14, 15])
+        # the brand facet is counted without the brand selection
+        self.assertEqual(sum(b['count'] for b in data['facets']['brand']), 20)
+        self.assertEqual(data['facets']['currency'], [{'currency': 'GBP', 'count': 3}])
+        self.assertEqual([(b['band'], b['min'], b['max'], b['count']) for b in data['facets']['band']],
+                         [(2, 50, 100, 1), (4, 250, 500, 1), (5, 500, 1000, 1)])
+        data = self.client.get(reverse('api-product-browse'),
+                               {'brand': gardenstore, 'band': [4, 5], 'limit': 1}).json()
+        self.assertEqual(([p['id'] for p in data['products']], data['next']), ([13], 13))
+        data = self.client.get(reverse('api-product-browse'),
+                               {'brand': gardenstore, 'band': [4, 5], 'after': 13}).json()
+        self.assertEqual(([p['id'] for p in data['products']], data['next']), ([15], None))
+        for params in ({'band': 9}, {'after': 10 ** 20}, {'brand': 10 ** 20}, {'band': 10 ** 20}):
+            resp = self.client.get(reverse('api-product-browse'), params)
+            self.assertEqual(resp.status_code, 400)
+
+
+class TestStreamJson(TestCase):
+
+    def test_encoding(self):
+        self.assertEqual(json.loads(''.join(api.stream_json([]))), [])
+        rows = [{'id': i, 'price': Decimal('1.50')} for i in range(250)]
+        chunks = list(api.stream_json(rows))
+        self.assertEqual(len(chunks), 3)
+        data = json.loads(''.join(chunks))
+        self.assertEqual(len(data), 250)
+        self.assertEqual(data[-1], {'id': 249, 'price': '1.50'})
+
+    def test_catalog_rows(self):
+        call_command('loaddata', 'brands', 'prods', verbosity=0)
+        resp = self.client.get(reverse('api-currency'))
+        self.assertTrue(resp.streaming)
+        self.assertEqual(resp['Content-Type'], 'application/json')
+        self.assertEqual(stream_json(resp), [{'code': 'GBP', 'name': '',
+                                              'gbp_conversion': None}])
+        product = stream_json(self.client.get(reverse('api-product')))[0]
+        self.assertEqual(product, {'id': 1, 'name': 'Tea pot', 'price': '47.00',
+                                   'qty': 50, 'qty_reserved': 0, 'available': 50,
+                                   'brand': 1, 'currency': 'GBP'})
+
+
 class TestLoading(TestCase):
 
     def test_load_products(self):
@@ -105,6 +344,115 @@ class TestLoading(TestCase):
         self.assertEqual(Product.objects.count(), 20)
         self.assertEqual(Brand.objects.count(), 12)
 
+    def test_load_products_bulk(self):
+        call_command('load_products', 'glist/fixtures/products.json',
+                     bulk=True, batch_size=7, verbosity=0)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(Brand.objects.count(), 12)
+        self.assertEqual(Product.objects.get(pk=4).brand.name, 'ROYAL DOULTON')
+        self.assertEqual(Product.objects.get(pk=5).price, Decimal('99.99'))
+
+    def test_load_products_stream(self):
+        call_command('load_products', 'glist/fixtures/products.json',
+                     stream=True, batch_size=3, verbosity=0)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(Brand.objects.count(), 12)
+
+    def test_load_products_workers(self):
+        call_command('load_products', 'glist/fixtures/products.json',
+                     'glist/fixtures/products.json', workers=2, verbosity=0)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(Brand.objects.count(), 12)
+
+    def test_load_products_workers_order(self):
+        # the last row for a product wins, whichever worker is done first
+        with tempfile.TemporaryDirectory() as directory:
+            files = []
+            for n in range(6):
+                path = os.path.join(directory, '%d.json' % n)
+                with open(path, 'w') as f:
+                    json.dump([{'id': 1, 'name': 'Version %d' % n, 'brand': 'Le Creuset',
+                                'price': '10.00GBP'}] * (1 + 50 * (n % 2)), f)
+                files.append(path)
+            call_command('load_products', *files, workers=3, batch_size=4, verbosity=0)
+        self.assertEqual(Product.objects.get(pk=1).name, 'Version 5')
+
+    def test_parse_file_bounded(self):
+        from .loading import parse_file
+        # a worker gets no further ahead than its queue lets it
+        batches = queue.Queue(maxsize=1)
+        worker = threading.Thread(target=parse_file, args=(batches, 'glist/fixtures/products.json'),
+                                  kwargs=dict(stream=True, batch_size=4))
+        worker.start()
+        first, errors = batches.get()
+        self.assertEqual((len(first), errors), (4, []))
+        # 5 batches and the end: it is held at the third until more are taken
+        time.sleep(0.1)
+        self.assertTrue(worker.is_alive())
+        rest = iter(batches.get, None)
+        self.assertEqual(sum(len(batch) for batch, errors in rest), 16)
+        worker.join()
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+            f.write('{"id": 1}')
+            f.flush()
+            with self.assertRaises(CommandError):
+                call_command('load_products', f.name, 'glist/fixtures/products.json',
+                             workers=2, stream=True, verbosity=0)
+
+    def test_iter_json_array(self):
+        from .loading import iter_json_array
+        rows = [{'id': i, 'name': 'Row [%d], {}' % i} for i in range(50)] + [12345, 'x']
+        text = json.dumps(rows, indent=2)
+        for read_size in (1, 7, 1000):
+            self.assertEqual(list(iter_json_array(StringIO(text), read_size)), rows)
+        self.assertEqual(list(iter_json_array(StringIO(' [ ] '))), [])
+        for bad in ('{}', '[1, 2', '[1 2]', '[{"a": }]', '[{"a": 1},]', '[1, ]', '[,]',
+                    '[1,]', '[1.]', '[1e]', '[1]x', '[] ]'):
+            for read_size in (2, 1000):
+                with self.assertRaises(ValueError, msg=bad):
+                    list(iter_json_array(StringIO(bad), read_size))
+        # numbers and escapes cut by the end of a read
+        text = json.dumps([1.5e+30, -12, 'caf\u00e9 \\ "x"', {'a': [1.25]}], ensure_ascii=True)
+        for read_size in range(1, 8):
+            self.assertEqual(list(iter_json_array(StringIO(text), read_size)), json.loads(text))
+        # numbers at the end of the buffer, with or without more to read
+        for text in ('[1e5]', '[12]', '[\n -0.0025,\n 123456789\n]', json.dumps(list(range(-50, 50)))):
+            for read_size in (1, 2, 3, 5, 64, 1000):
+                self.assertEqual(list(iter_json_array(StringIO(text), read_size)), json.loads(text),
+                                 (text, read_size))
+
+        class Reads(StringIO):
+            reads = 0
+
+            def read(self, *args):
+                self.reads += 1
+                return super().read(*args)
+
+        # a malformed element fails without reading the rest of the file
+        big = Reads('[{"id": 1}, {"id": 2 "name": "x"}, ' + ', '.join(['{"id": 3}'] * 10000) + ']')
+        with self.assertRaises(ValueError):
+            list(iter_json_array(big, 100))
+        self.assertLess(big.reads, 5)
+
+    def test_bulk_failures(self):
+        from .loading import BulkLoader
+        loader = BulkLoader(batch_size=10)
+        loader.load([
+            {'id': 1, 'name': 'Tea pot', 'brand': 'Le Creuset', 'price': '47.00GBP'},
+            {'id': 2, 'name': 'No price', 'brand': 'Le Creuset'},
+            {'id': 3, 'name': 'Kettle', 'brand': 'Le Creuset', 'price': '20.00EUR',
+             'in_stock_quantity': 3},
+            # duplicate id in the same batch only fails the bulk insert
+            {'id': 3, 'name': 'Kettle, red', 'brand': 'Le Creuset', 'price': '21.00EUR'},
+            {'id': 4, 'name': 'Negative stock', 'brand': 'Le Creuset', 'price': '1.00',
+             'in_stock_quantity': -1},
+        ])
+        self.assertEqual(loader.success, 3)
+        self.assertEqual(len(loader.errors), 2)
+        self.assertEqual(Product.objects.get(pk=3).name, 'Kettle, red')
+        self.assertEqual(Product.objects.get(pk=3).currency_id, 'EUR')
+        self.assertFalse(Product.objects.filter(pk__in=[2, 4]).exists())
+
 
 class TestCoupleActions(DataSetuoMixin, TestCase):
 
@@ -182,6 +530,18 @@ class TestGuestActions(DataSetuoMixin, TestCase):
                             '{"item_id": %s}' % item.pk)
         self.assertEqual(Purchase.objects.count(), 1)
 
+    def test_sold_out(self):
+        self.client.login(username='guest',
+                          password='f74923bcaa2b52ca965e42ab3e44e656')
+        item = GiftListItem.objects.get(gift_list=self.wedding)
+        url = reverse('api-purchase', kwargs=dict(gift_list_id=self.wedding.pk))
+        resp = self.client.generic('POST', url, '{"item_id": %s}' % item.pk)
+        self.assertEqual(resp.status_code, 200)
+        resp = self.client.generic('POST', url, '{"item_id": %s}' % item.pk)
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(Purchase.objects.count(), 1)
+        self.assertEqual(GiftListItem.objects.get(pk=item.pk).qty_purchased, 1)
+
     def test_unauthorised(self):
         item = GiftListItem.objects.get(gift_list=self.wedding)
         resp = self.client.generic(
@@ -189,3 +549,1201 @@ class TestGuestActions(DataSetuoMixin, TestCase):
                             kwargs=dict(gift_list_id=self.wedding.pk)),
             '{"item_id": %s}' % item.pk)
         self.assertEqual(resp.status_code, 401)
+
+
+class TestGiftListView(DataSetuoMixin, TestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        self.bride = get_user_model().objects.get(username='bride')
+        self.wedding = GiftList.objects.get(user=self.bride)
+        GiftListItem(gift_list=self.wedding, qty=2, qty_purchased=1,
+                     added_by=self.bride, product_id=11).save()
+        GiftListItem(gift_list=self.wedding, qty=1, price=Decimal('80.00'),
+                     added_by=self.bride, product_id=14).save()
+        self.url = reverse('api-gift-view', kwargs=dict(gift_list_id=self.wedding.pk))
+
+    def test_joined_rows(self):
+        self.client.force_login(self.bride)
+        # session, user, versions and a single query for the items
+        with self.assertNumQueries(4):
+            data = stream_json(self.client.get(self.url))
+        self.assertEqual(data[0]['name'], 'Original Kettle E-5710 Charcoal Barbecue - 57cm; Black')
+        self.assertEqual(data[0]['brand_name'], Product.objects.get(pk=11).brand.name)
+        self.assertEqual(data[0]['effective_price'], '199.99')
+        self.assertEqual(data[0]['remaining'], 1)
+        self.assertEqual(data[1]['effective_price'], '80.00')
+        self.assertEqual(data[1]['currency'], 'GBP')
+
+    def test_visibility(self):
+        self.client.login(username='guest', password='f74923bcaa2b52ca965e42ab3e44e656')
+        self.assertEqual(len(stream_json(self.client.get(self.url))), 2)
+        self.wedding.active = False
+        self.wedding.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+class TestConditionalGet(DataSetuoMixin, TestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def _revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_catalog_not_modified(self):
+        for name in ('api-product', 'api-brand', 'api-currency'):
+            resp = self.client.get(reverse(name))
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('no-cache', resp['Cache-Control'])
+            # the versions only
+            with self.assertNumQueries(1):
+                resp = self._revalidate(reverse(name), resp['ETag'])
+            self.assertEqual(resp.status_code, 304)
+
+    def test_catalog_change(self):
+        url = reverse('api-product')
+        etag = self.client.get(url)['ETag']
+        brand_etag = self.client.get(reverse('api-brand'))['ETag']
+        product = Product.objects.get(pk=1)
+        product.qty -= 1
+        product.save()
+        resp = self._revalidate(url, etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+        self.assertEqual(self._revalidate(reverse('api-brand'), brand_etag).status_code, 304)
+
+    def test_gift_list_change(self):
+        bride = get_user_model().objects.get(username='bride')
+        wedding = GiftList.objects.get(user=bride)
+        self.client.force_login(bride)
+        for url in (reverse('api-gift'),
+                    reverse('api-gift-view', kwargs=dict(gift_list_id=wedding.pk))):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self._revalidate(url, etag).status_code, 304)
+            self.client.generic('POST', reverse('api-gift'), '{"product_id": 12}')
+            self.assertEqual(self._revalidate(url, etag).status_code, 200)
+
+    def test_versions_follow_transaction(self):
+        url = reverse('api-product')
+        etag = self.client.get(url)['ETag']
+        # a change rolled back leaves the catalog as it was
+        with self.assertRaises(OperationalError), transaction.atomic():
+            Product.objects.get(pk=1).save()
+            raise OperationalError
+        self.assertEqual(self._revalidate(url, etag).status_code, 304)
+        # the counters live in the database, not in a process's cache
+        cache.clear()
+        self.assertEqual(self._revalidate(url, etag).status_code, 304)
+        Product.objects.get(pk=1).save()
+        self.assertEqual(self._revalidate(url, etag).status_code, 200)
+
+    def test_stock_version_sharded(self):
+        from . import stock
+        from .models import Version
+        from .versions import get_version
+        url = reverse('api-product')
+        versions = [get_version('stock')]
+        etags = [self.client.get(url)['ETag']]
+        # reservations of different products bump different rows
+        for product_id in (1, 2, 1):
+            stock.reserve(product_id)
+            versions.append(get_version('stock'))
+            etags.append(self.client.get(url)['ETag'])
+        self.assertEqual(sorted(versions), versions)
+        self.assertEqual(len(set(versions)), 4)
+        self.assertEqual(len(set(etags)), 4)
+        self.assertEqual(dict(Version.objects.filter(name__in=['stock:1', 'stock:2'])
+                              .values_list('name', 'value')), {'stock:1': 2, 'stock:2': 1})
+
+
+class TestConcurrentPurchases(TransactionTestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        DataSetuoMixin.setUpTestData()
+        bride = get_user_model().objects.get(username='bride')
+        self.wedding = GiftList.objects.get(user=bride)
+        self.item = GiftListItem.objects.create(gift_list=self.wedding, qty=25,
+                                                added_by=bride, product_id=12)
+
+    def post_concurrently(self, url, body, count):
+        """
+        POSTs `body` to `url` from `count` guest clients at once,
+            returning the statuses
+        """
+        guest = get_user_model().objects.get(username='guest')
+        clients = []
+        for i in range(count):
+            # exceptions are reported through a global signal, so they
+            # would be raised from whichever client is running: each
+            # thread keeps its own instead
+            client = Client(raise_request_exception=False)
+            client.force_login(guest)
+            clients.append(client)
+        errors = threading.local()
+
+        def store_error(**kwargs):
+            errors.last = sys.exc_info()[1]
+        got_request_exception.connect(store_error)
+        self.addCleanup(got_request_exception.disconnect, store_error)
+
+        def buy(client):
+            for _ in range(MAX_LOCKED_ATTEMPTS):
+                errors.last = None
+                status = client.generic('POST', url, body).status_code
+                if status != 500:
+                    return status
+                # SQLite refuses concurrent writers outright, try again
+                if not is_locked(errors.last):
+                    raise errors.last
+            self.fail('Database still locked after %d attempts' % MAX_LOCKED_ATTEMPTS)
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            return list(pool.map(buy, clients))
+
+    def test_no_overselling(self):
+        url = reverse('api-purchase', kwargs=dict(gift_list_id=self.wedding.pk))
+        statuses = self.post_concurrently(url, '{"item_id": %s}' % self.item.pk, 200)
+        self.assertEqual(statuses.count(200), 25)
+        self.assertEqual(statuses.count(404), 175)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.qty_purchased, 25)
+        self.assertEqual(Purchase.objects.filter(item=self.item).count(), 25)
+
+    def test_no_overselling_checkout(self):
+        url = reverse('api-checkout', kwargs=dict(gift_list_id=self.wedding.pk))
+        body = json.dumps({'items': [{'item_id': self.item.pk, 'qty': 2}]})
+        statuses = self.post_concurrently(url, body, 100)
+        self.assertEqual(statuses.count(200), 12)
+        self.assertEqual(statuses.count(409), 88)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.qty_purchased, 24)
+        self.assertEqual(Purchase.objects.filter(item=self.item).aggregate(Sum('qty'))['qty__sum'], 24)
+
+
+class TestConcurrentRemoval(TransactionTestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        DataSetuoMixin.setUpTestData()
+        self.bride = get_user_model().objects.get(username='bride')
+        self.wedding = GiftList.objects.get(user=self.bride)
+
+    def test_purchase_and_removal(self):
+        # the last unit not purchased goes either to the guest or away
+        guest = get_user_model().objects.get(username='guest')
+        errors = threading.local()
+
+        def store_error(**kwargs):
+            errors.last = sys.exc_info()[1]
+        got_request_exception.connect(store_error)
+        self.addCleanup(got_request_exception.disconnect, store_error)
+
+        clients = {}
+        for user in (guest, self.bride):
+            clients[user] = Client(raise_request_exception=False)
+            clients[user].force_login(user)
+
+        def send(user, method, url, data=''):
+            client = clients[user]
+            barrier.wait(timeout=10)
+            for _ in range(MAX_LOCKED_ATTEMPTS):
+                errors.last = None
+                status = client.generic(method, url, data).status_code
+                if status != 500:
+                    return status
+                if not is_locked(errors.last):
+                    raise errors.last
+            self.fail('Database still locked after %d attempts' % MAX_LOCKED_ATTEMPTS)
+
+        for _ in range(10):
+            GiftListItem.objects.all().delete()
+            item = GiftListItem.objects.create(gift_list=self.wedding, qty=2, qty_purchased=1,
+                                               added_by=self.bride, product_id=12)
+            Product.objects.filter(pk=12).update(qty_reserved=1)
+            barrier = threading.Barrier(2)
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                purchase = pool.submit(send, guest, 'POST',
+                                       reverse('api-purchase', kwargs=dict(gift_list_id=self.wedding.pk)),
+                                       '{"item_id": %d}' % item.pk)
+                removal = pool.submit(send, self.bride, 'DELETE',
+                                      reverse('api-gift-item', kwargs=dict(item_id=item.pk)))
+            item.refresh_from_db()
+            if purchase.result() == 200:
+                self.assertEqual(removal.result(), 409)
+                self.assertEqual((item.qty, item.qty_purchased), (2, 2))
+            else:
+                self.assertEqual((purchase.result(), removal.result()), (404, 200))
+                self.assertEqual((item.qty, item.qty_purchased), (1, 1))
+            self.assertEqual(Product.objects.get(pk=12).qty_reserved, 0)
+
+
+class TestStockReservations(DataSetuoMixin, TestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        self.bride = get_user_model().objects.get(username='bride')
+        self.wedding = GiftList.objects.get(user=self.bride)
+        self.client.force_login(self.bride)
+
+    def add(self, product_id):
+        return self.client.generic('POST', reverse('api-gift'),
+                                   '{"product_id": %d}' % product_id)
+
+    def test_reserve_and_release(self):
+        # a single Mini Stand Mixer in stock
+        self.assertEqual(self.add(11).status_code, 200)
+        self.assertEqual(Product.objects.get(pk=11).qty_reserved, 1)
+        resp = self.add(11)
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(GiftListItem.objects.get(product_id=11).qty, 1)
+        data = stream_json(self.client.get(reverse('api-product'), {'brand': 6}))
+        self.assertEqual([p['available'] for p in data], [0, 29])
+        item = GiftListItem.objects.get(product_id=11)
+        self.client.delete(reverse('api-gift-item', kwargs=dict(item_id=item.pk)))
+        self.assertEqual(Product.objects.get(pk=11).qty_reserved, 0)
+        self.assertEqual(self.add(11).status_code, 200)
+
+    def test_deletes_release(self):
+        # however items go, their units not purchased are released
+        self.add(12)
+        self.add(12)
+        self.add(13)
+        # one unit purchased, which took its reservation along
+        GiftListItem.objects.filter(product_id=12).update(qty_purchased=1)
+        Product.objects.filter(pk=12).update(qty_reserved=1)
+        GiftListItem.objects.get(product_id=12).delete()
+        self.assertEqual(Product.objects.get(pk=12).qty_reserved, 0)
+        self.wedding.delete()
+        self.assertEqual(Product.objects.get(pk=13).qty_reserved, 0)
+
+    def test_shared_between_lists(self):
+        other = get_user_model().objects.create_user('other', 'other@weddingshop.com', 'x')
+        GiftList.objects.create(wedding_date=date.today(), wedding_name='Other',
+                                spouse_x_name='X', spouse_y_name='Y', user=other)
+        self.assertEqual(self.add(11).status_code, 200)
+        self.client.force_login(other)
+        self.assertEqual(self.add(11).status_code, 409)
+
+    def test_purchase_commits(self):
+        self.add(12)
+        self.client.login(username='guest', password='f74923bcaa2b52ca965e42ab3e44e656')
+        item = GiftListItem.objects.get(product_id=12)
+        self.client.generic('POST', reverse('api-purchase', kwargs=dict(gift_list_id=self.wedding.pk)),
+                            '{"item_id": %d}' % item.pk)
+        product = Product.objects.get(pk=12)
+        self.assertEqual((product.qty, product.qty_reserved), (28, 0))
+
+
+class TestConcurrentReservations(TransactionTestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def test_no_overbooking(self):
+        from . import stock
+
+        def reserve(i):
+            for _ in range(MAX_LOCKED_ATTEMPTS):
+                try:
+                    stock.reserve(5)
+                    return True
+                except stock.OutOfStock:
+                    return False
+                except OperationalError as e:
+                    # SQLite refuses concurrent writers outright, try again
+                    if not is_locked(e):
+                        raise
+                finally:
+                    connection.close()
+            self.fail('Database still locked after %d attempts' % MAX_LOCKED_ATTEMPTS)
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(reserve, range(100)))
+        self.assertEqual(results.count(True), 9)
+        self.assertEqual(Product.objects.get(pk=5).qty_reserved, 9)
+
+
+class TestCheckout(DataSetuoMixin, TestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        bride = get_user_model().objects.get(username='bride')
+        self.wedding = GiftList.objects.get(user=bride)
+        self.kettle = GiftListItem.objects.create(gift_list=self.wedding, qty=1,
+                                                  added_by=bride, product_id=11)
+        self.grill = GiftListItem.objects.create(gift_list=self.wedding, qty=3,
+                                                 added_by=bride, product_id=12,
+                                                 price=Decimal('130.00'))
+        Product.objects.filter(pk__in=[11, 12]).update(qty_reserved=F('qty_reserved') + 1)
+        Product.objects.filter(pk=12).update(qty_reserved=F('qty_reserved') + 2)
+        self.url = reverse('api-checkout', kwargs=dict(gift_list_id=self.wedding.pk))
+        self.client.login(username='guest', password='f74923bcaa2b52ca965e42ab3e44e656')
+
+    def checkout(self, *lines):
+        return self.client.generic('POST', self.url, json.dumps({'items': lines}))
+
+    def test_checkout(self):
+        resp = self.checkout({'item_id': self.kettle.pk, 'qty': 1},
+                             {'item_id': self.grill.pk, 'qty': 2})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['total'], '459.99')
+        self.assertEqual(Purchase.objects.count(), 2)
+        self.assertEqual(GiftListItem.objects.get(pk=self.grill.pk).qty_purchased, 2)
+        grill = Product.objects.get(pk=12)
+        self.assertEqual((grill.qty, grill.qty_reserved), (27, 1))
+
+    def test_all_or_nothing(self):
+        resp = self.checkout({'item_id': self.grill.pk, 'qty': 1},
+                             {'item_id': self.kettle.pk, 'qty': 2})
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()['errors'], ['Item %d could not be purchased' % self.kettle.pk])
+        self.assertEqual(Purchase.objects.count(), 0)
+        self.assertEqual(GiftListItem.objects.get(pk=self.grill.pk).qty_purchased, 0)
+
+    def test_bad_request(self):
+        for lines in ([], [{'item_id': 'x'}], [{'item_id': self.kettle.pk, 'qty': 0}],
+                      [{'item_id': 10 ** 20}], [{'item_id': self.kettle.pk, 'qty': 10 ** 20}],
+                      [{'item_id': self.grill.pk, 'qty': 20000}] * 2):
+            self.assertEqual(self.checkout(*lines).status_code, 400)
+        self.assertEqual(Purchase.objects.count(), 0)
+
+
+class TestGiftBatch(DataSetuoMixin, TestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        self.bride = get_user_model().objects.get(username='bride')
+        self.wedding = GiftList.objects.get(user=self.bride)
+        self.client.force_login(self.bride)
+        self.client.generic('POST', reverse('api-gift'), '{"product_id": 1}')
+        self.client.generic('POST', reverse('api-gift'), '{"product_id": 2}')
+        self.tea_pot = GiftListItem.objects.get(product_id=1)
+
+    def batch(self, *ops):
+        return self.client.generic('POST', reverse('api-gift-batch'), json.dumps({'ops': ops}))
+
+    def test_batch(self):
+        resp = self.batch({'op': 'add', 'product_id': 1, 'qty': 2},
+                          {'op': 'add', 'product_id': 12},
+                          {'op': 'set', 'product_id': 9, 'qty': 4},
+                          {'op': 'remove', 'product_id': 2})
+        self.assertEqual(resp.status_code, 200)
+        rows = {r['product']: r['qty'] for r in stream_json(resp)}
+        self.assertEqual(rows, {1: 3, 12: 1, 9: 4})
+        self.assertEqual(Product.objects.get(pk=1).qty_reserved, 3)
+        self.assertEqual(Product.objects.get(pk=2).qty_reserved, 0)
+        self.assertEqual(Product.objects.get(pk=9).qty_reserved, 4)
+
+    def test_constant_queries(self):
+        self.batch(*[{'op': 'add', 'product_id': pk} for pk in (5, 6, 8, 9)])
+        with CaptureQueriesContext(connection) as few:
+            self.batch({'op': 'add', 'product_id': 4}, {'op': 'remove', 'item_id': self.tea_pot.pk})
+        ops = ([{'op': 'add', 'product_id': pk} for pk in (12, 13, 14, 15, 17, 18)]
+               + [{'op': 'remove', 'product_id': pk} for pk in (5, 6, 8, 9)])
+        with CaptureQueriesContext(connection) as many:
+            resp = self.batch({'op': 'set', 'product_id': 2, 'qty': 0}, *ops)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(sorted(r['product'] for r in stream_json(resp)), [4, 12, 13, 14, 15, 17, 18])
+        self.assertEqual(Product.objects.filter(pk__in=[2, 5, 6, 8, 9], qty_reserved__gt=0).count(), 0)
+
+    def test_remove_releases_once(self):
+        # another list holds a unit of the same product
+        Product.objects.filter(pk=2).update(qty_reserved=F('qty_reserved') + 1)
+        self.batch({'op': 'add', 'product_id': 2, 'qty': 2})
+        self.assertEqual(Product.objects.get(pk=2).qty_reserved, 4)
+        resp = self.batch({'op': 'remove', 'product_id': 2, 'qty': 3})
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(GiftListItem.objects.filter(product_id=2).exists())
+        self.assertEqual(Product.objects.get(pk=2).qty_reserved, 1)
+        # outside batches, deleted items release their units themselves
+        self.tea_pot.delete()
+        self.assertEqual(Product.objects.get(pk=1).qty_reserved, 0)
+
+    def test_all_or_nothing(self):
+        resp = self.batch({'op': 'add', 'product_id': 12},
+                          {'op': 'set', 'product_id': 11, 'qty': 2},
+                          {'op': 'remove', 'item_id': 999})
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.json()['errors'], ['Item 999 is not in the list',
+                                                 'Product 11 is out of stock'])
+        self.assertEqual(GiftListItem.objects.count(), 2)
+        self.assertEqual(Product.objects.get(pk=12).qty_reserved, 0)
+        resp = self.batch({'op': 'add', 'product_id': 12}, {'op': 'set', 'product_id': 11, 'qty': 2})
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(self.batch({'op': 'grow', 'product_id': 1}).status_code, 400)
+
+    def test_out_of_range(self):
+        for op in ({'op': 'add', 'product_id': 10 ** 20}, {'op': 'remove', 'item_id': 10 ** 20},
+                   {'op': 'add', 'product_id': 1, 'qty': 10 ** 20},
+                   {'op': 'set', 'product_id': 1, 'qty': 40000}):
+            self.assertEqual(self.batch(op).status_code, 400)
+        resp = self.batch({'op': 'add', 'product_id': 1, 'qty': 30000},
+                          {'op': 'add', 'product_id': 1, 'qty': 30000})
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()['errors'], ['Product 1 can have 32767 units at most'])
+        url = reverse('api-gift-item', kwargs=dict(item_id=self.tea_pot.pk))
+        self.assertEqual(self.client.put(url, '{"qty": 40000}').status_code, 400)
+        self.assertEqual(GiftListItem.objects.get(pk=self.tea_pot.pk).qty, 1)
+
+    def test_remove_too_many(self):
+        self.batch({'op': 'set', 'product_id': 1, 'qty': 3})
+        resp = self.batch({'op': 'remove', 'product_id': 1, 'qty': 5})
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()['errors'], ['Product 1 has only 3 units listed'])
+        self.assertEqual(GiftListItem.objects.get(pk=self.tea_pot.pk).qty, 3)
+
+    def test_put(self):
+        url = reverse('api-gift-item', kwargs=dict(item_id=self.tea_pot.pk))
+        resp = self.client.put(url, '{"qty": 5}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['qty'], 5)
+        self.assertEqual(Product.objects.get(pk=1).qty_reserved, 5)
+        GiftListItem.objects.filter(pk=self.tea_pot.pk).update(qty_purchased=2)
+        resp = self.client.put(url, '{"qty": 1}')
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()['errors'], ['Product 1 has 2 units purchased'])
+        self.assertEqual(self.client.put(url, '{"qty": -1}').status_code, 400)
+        missing = reverse('api-gift-item', kwargs=dict(item_id=999))
+        self.assertEqual(self.client.put(missing, '{"qty": 1}').status_code, 404)
+        self.assertEqual(self.client.delete(missing).status_code, 404)
+
+
+class TestGiftListSummary(DataSetuoMixin, TestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        self.wedding = GiftList.objects.get(user__username='bride')
+        self.url = reverse('api-gift-summary', kwargs=dict(gift_list_id=self.wedding.pk))
+
+    def summary(self):
+        from .summary import compute
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        expected = compute([self.wedding.pk])[self.wedding.pk]
+        self.assertEqual(data, dict(expected, raised=str(expected['raised'])))
+        return data
+
+    def test_counters(self):
+        self.client.login(username='bride', password='ec767bf6334a24af632a51bd6e7d2eb3')
+        for product_id in (11, 12, 12):
+            self.client.generic('POST', reverse('api-gift'), json.dumps({'product_id': product_id}))
+        self.assertEqual(self.summary(), {'items': 2, 'units': 3, 'units_purchased': 0,
+                                          'raised': '0.00'})
+        ops = [{'op': 'add', 'product_id': 13, 'qty': 2}, {'op': 'set', 'product_id': 11, 'qty': 0}]
+        self.client.generic('POST', reverse('api-gift-batch'), json.dumps({'ops': ops}))
+        self.assertEqual(self.summary()['items'], 2)
+        grill = GiftListItem.objects.get(gift_list=self.wedding, product_id=12)
+
+        self.client.login(username='guest', password='f74923bcaa2b52ca965e42ab3e44e656')
+        purchase_url = reverse('api-purchase', kwargs=dict(gift_list_id=self.wedding.pk))
+        self.client.generic('POST', purchase_url, json.dumps({'item_id': grill.pk}))
+        checkout_url = reverse('api-checkout', kwargs=dict(gift_list_id=self.wedding.pk))
+        self.client.generic('POST', checkout_url, json.dumps({'items': [{'item_id': grill.pk}]}))
+        self.assertEqual(self.summary()['units_purchased'], 2)
+
+        self.client.login(username='bride', password='ec767bf6334a24af632a51bd6e7d2eb3')
+        # every unit of it purchased, it can't be removed any more
+        resp = self.client.delete(reverse('api-gift-item', kwargs=dict(item_id=grill.pk)))
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(self.summary()['units'], 4)
+
+    def test_reconcile(self):
+        from .models import GiftListSummary
+        GiftListItem.objects.create(gift_list=self.wedding, qty=2, product_id=12,
+                                    added_by=self.wedding.user)
+        GiftListSummary.objects.all().delete()
+        out = StringIO()
+        call_command('reconcile_summaries', stdout=out)
+        self.assertEqual(out.getvalue().strip(), '1 summaries rebuilt')
+        self.assertEqual(GiftListSummary.objects.get().units, 2)
+        call_command('reconcile_summaries', stdout=out)
+        self.assertTrue(out.getvalue().endswith('0 summaries rebuilt\n'))
+
+
+class TestQueryCounts(DataSetuoMixin, TestCase):
+    """
+    Exact number of queries of every API endpoint, on a list with several
+        items and purchases, so that N+1 queries fail here
+    Includes the session and user lookups of the authenticated ones, and
+        the version counters read or bumped
+    """
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        self.bride = get_user_model().objects.get(username='bride')
+        self.guest = get_user_model().objects.get(username='guest')
+        self.wedding = GiftList.objects.get(user=self.bride)
+        customer = Guest.objects.get()
+        self.items = [GiftListItem.objects.create(gift_list=self.wedding, product_id=pk, qty=3,
+                                                  qty_purchased=1, added_by=self.bride)
+                      for pk in (1, 2, 12, 15, 18)]
+        Product.objects.filter(pk__in=[1, 2, 12, 15, 18]).update(qty_reserved=2)
+        for item in self.items:
+            Purchase.objects.create(item=item, customer=customer, total=Decimal('10.00'))
+
+    def request(self, method, name, body=None, **kwargs):
+        resp = self.client.generic(method, reverse(name, kwargs=kwargs),
+                                   json.dumps(body) if body else '')
+        if resp.streaming:
+            b''.join(resp.streaming_content)
+        return resp
+
+    def test_endpoints(self):
+        item = self.items[0].pk
+        gift_list_id = self.wedding.pk
+        cases = [
+            (2, self.bride, 'GET', 'api-currency', None, {}),
+            (2, self.bride, 'GET', 'api-brand', None, {}),
+            (2, self.bride, 'GET', 'api-product', None, {}),
+            (6, self.bride, 'GET', 'api-gift', None, {}),
+            (4, self.bride, 'GET', 'api-gift-view', None, dict(gift_list_id=gift_list_id)),
+            (5, self.guest, 'GET', 'api-gift-summary', None, dict(gift_list_id=gift_list_id)),
+            (4, self.guest, 'GET', 'api-purchase', None, dict(gift_list_id=gift_list_id)),
+            # new item, then one more unit of a listed one
+            (14, self.bride, 'POST', 'api-gift', {'product_id': 6}, {}),
+            (12, self.bride, 'POST', 'api-gift', {'product_id': 1}, {}),
+            (11, self.bride, 'DELETE', 'api-gift-item', None, dict(item_id=item)),
+            (13, self.bride, 'PUT', 'api-gift-item', {'qty': 4}, dict(item_id=item)),
+            (14, self.bride, 'POST', 'api-gift-batch',
+             {'ops': [{'op': 'add', 'product_id': pk} for pk in (1, 2, 5, 9, 13)]}, {}),
+            (12, self.guest, 'POST', 'api-purchase', {'item_id': item},
+             dict(gift_list_id=gift_list_id)),
+            (12, self.guest, 'POST', 'api-checkout',
+             {'items': [{'item_id': i.pk} for i in self.items]}, dict(gift_list_id=gift_list_id)),
+        ]
+        for count, user, method, name, body, kwargs in cases:
+            with self.subTest(method=method, name=name, body=body):
+                self.client.force_login(user)
+                with CaptureQueriesContext(connection) as queries:
+                    resp = self.request(method, name, body, **kwargs)
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(len(queries), count, '\n'.join(q['sql'] for q in queries))
+
+
+class TestMetrics(DataSetuoMixin, TestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        registry.clear()
+        self.wedding = GiftList.objects.get()
+        GiftListItem.objects.create(gift_list=self.wedding, qty=2, product_id=12,
+                                    added_by=self.wedding.user)
+        self.client.force_login(self.wedding.user)
+
+    def test_counts_streamed_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(reverse('api-gift-view', args=[self.wedding.pk]))
+            self.assertEqual(len(json.loads(b''.join(resp.streaming_content))), 1)
+            resp.close()
+        endpoint = registry.endpoints['api-gift-view', 'GET']
+        self.assertEqual(endpoint.queries.sum, len(queries))
+        self.assertEqual(endpoint.statuses, {200: 1})
+        self.assertGreater(endpoint.sql.sum, 0)
+
+    def test_prometheus_endpoint(self):
+        self.client.get(reverse('api-gift-summary', args=[self.wedding.pk]))
+        self.client.get(reverse('api-gift-summary', args=[0]))
+        self.client.logout()
+        # local requests are no exception, behind a proxy they all are
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with override_settings(GLIST_METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get(reverse('metrics'),
+                                             HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            resp = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(resp['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = resp.content.decode().splitlines()
+        self.assertIn('glist_request_duration_seconds_count{view="api-gift-summary",method="GET"} 2',
+                      lines)
+        self.assertIn('glist_requests_total{view="api-gift-summary",method="GET",status="404"} 1',
+                      lines)
+        self.assertIn('# TYPE glist_request_sql_queries histogram', lines)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'checks SQLite query plans')
+class TestQueryPlans(TestCase):
+    """
+    The hot lookups are answered from an index, not by scanning a table
+    """
+
+    def assertPlan(self, queryset, *indexes):
+        plan = queryset.explain()
+        self.assertNotRegex(plan, r'SCAN (TABLE )?glist_', plan)
+        for index in indexes:
+            self.assertIn(index, plan)
+
+    def test_hot_lookups(self):
+        from .reports import purchased_rows, remaining_rows
+        self.assertPlan(GiftListItem.objects.filter(gift_list=1, product=2))
+        self.assertPlan(GiftListItem.objects.filter(gift_list=1, qty__gt=F('qty_purchased')),
+                        'glist_item_remaining')
+        self.assertPlan(GiftListItem.objects.filter(pk=1, qty__gt=F('qty_purchased')),
+                        'PRIMARY KEY')
+        self.assertPlan(Guest.objects.filter(user=1, wedding=2), 'glist_guest_user_wedding')
+        self.assertPlan(Purchase.objects.filter(customer=1))
+        self.assertPlan(Purchase.objects.filter(item__gift_list=1).order_by('-date_paid'),
+                        'glist_purchase_item_date')
+        self.assertPlan(purchased_rows(1), 'glist_purchase_item_date')
+        self.assertPlan(remaining_rows(1))
+
+
+class TestListEvents(TransactionTestCase):
+    """
+    The events app reaches the database from another thread
+    """
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        DataSetuoMixin.setUpTestData()
+        self.bride = get_user_model().objects.get(username='bride')
+        self.wedding = GiftList.objects.get(user=self.bride)
+        self.item = GiftListItem.objects.create(gift_list=self.wedding, qty=2,
+                                                added_by=self.bride, product_id=12)
+        self.path = reverse('list-events', args=[self.wedding.pk])
+
+    def stream(self, user, change=None):
+        """
+        Runs the events app until it sent its first event, making `change`
+            once it is subscribed; returns the response status and body
+        """
+        from asgiref.sync import async_to_sync, sync_to_async
+        from .events import broker, list_channel
+        from .sse import events_app
+        self.client.force_login(user)
+        cookie = '%s=%s' % (settings.SESSION_COOKIE_NAME,
+                            self.client.cookies[settings.SESSION_COOKIE_NAME].value)
+        scope = {'type': 'http', 'path': self.path, 'headers': [(b'cookie', cookie.encode())]}
+        sent = []
+
+        async def run():
+            disconnected = asyncio.Event()
+            requested = False
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {'type': 'http.request', 'body': b''}
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if b'data: ' in message.get('body', b''):
+                    disconnected.set()
+
+            task = asyncio.ensure_future(events_app(scope, receive, send))
+            while not task.done() and not broker.subscribers(list_channel(self.wedding.pk)):
+                await asyncio.sleep(0.01)
+            if change and not task.done():
+                await sync_to_async(change)()
+            await asyncio.wait_for(task, 5)
+
+        async_to_sync(run)()
+        self.assertEqual(broker.subscribers(list_channel(self.wedding.pk)), 0)
+        return sent[0]['status'], b''.join(m.get('body', b'') for m in sent[1:])
+
+    def test_purchase_event(self):
+        @transaction.atomic
+        def purchase():
+            # along with the version, as purchase_add does
+            GiftListItem.objects.filter(pk=self.item.pk).update(qty_purchased=F('qty_purchased') + 1)
+            Purchase.objects.create(item=self.item, customer=Guest.objects.get(),
+                                    total=Decimal('139.99'))
+        from . import events
+        from .versions import get_version, list_version_name
+        with mock.patch.object(events, 'POLL_INTERVAL', 0.05):
+            status, body = self.stream(get_user_model().objects.get(username='guest'), purchase)
+        self.assertEqual(status, 200)
+        # seen from the database, whichever process made the purchase
+        event = json.loads(body.split(b'data: ')[1])
+        channel = list_version_name(self.wedding.pk)
+        self.assertEqual((event['type'], event['channel'], event['id']),
+                         ('changed', channel, get_version(channel)))
+        # with the rows that changed, to patch in place
+        row, = [r for r in event['items'] if r['id'] == self.item.pk]
+        self.assertEqual((row['qty_purchased'], row['remaining']), (1, 1))
+
+    def test_changed_rows(self):
+        from .events import Broker, Subscription, list_channel
+        from .versions import bump_version, get_version
+        broker, channel = Broker(), list_channel(self.wedding.pk)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def subscribe(version):
+            queue = Subscription(version)
+            # without the polling thread, published to by hand
+            broker.channels[channel].add(queue)
+            return queue
+
+        def publish():
+            broker.publish({channel: get_version(channel)})
+            loop.run_until_complete(asyncio.sleep(0))
+
+        version = get_version(channel)
+        following = loop.run_until_complete(subscribe(version))
+        publish()
+        self.assertTrue(following.empty())
+        GiftListItem.objects.filter(pk=self.item.pk).update(qty_purchased=1)
+        bump_version(channel)
+        lamp = GiftListItem.objects.create(gift_list=self.wedding, qty=1,
+                                           added_by=self.bride, product_id=16)
+        late = loop.run_until_complete(subscribe(version - 1))
+        publish()
+        event = following.get_nowait()
+        self.assertFalse(event['full'])
+        self.assertEqual(sorted((r['id'], r['qty_purchased']) for r in event['items']),
+                         [(self.item.pk, 1), (lamp.pk, 0)])
+        # not at the version diffed from, it gets every row
+        event = late.get_nowait()
+        self.assertTrue(event['full'])
+        self.assertEqual(len(event['items']), 2)
+        removed = self.item.pk
+        self.item.delete()
+        publish()
+        event = following.get_nowait()
+        self.assertEqual((event['items'], event['removed']), ([], [removed]))
+        self.assertEqual(late.get_nowait(), event)
+
+    def test_strangers(self):
+        stranger = get_user_model().objects.create_user('stranger')
+        self.assertEqual(self.stream(stranger)[0], 403)
+        # without ASGI browsers are told not to reconnect
+        self.assertEqual(self.client.get(self.path).status_code, 204)
+
+
+class TestAsyncApi(TransactionTestCase):
+    """
+    The async views query from the thread pool
+    """
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        DataSetuoMixin.setUpTestData()
+        self.wedding = GiftList.objects.get()
+        GiftListItem.objects.create(gift_list=self.wedding, qty=2, product_id=12,
+                                    added_by=self.wedding.user)
+
+    def test_same_as_sync(self):
+        from asgiref.sync import async_to_sync
+        from django.test import AsyncClient
+        client = AsyncClient()
+        client.force_login(self.wedding.user)
+        self.client.force_login(self.wedding.user)
+        for name, kwargs, params in (('currency', {}, {}), ('product', {}, {'limit': 5}),
+                                     ('product-search', {}, {'q': 'lamp'}),
+                                     ('gift-view', {'gift_list_id': self.wedding.pk}, {}),
+                                     ('gift-summary', {'gift_list_id': self.wedding.pk}, {})):
+            with self.subTest(name=name):
+                expected = self.client.get(reverse('api-' + name, kwargs=kwargs), params)
+                # AsyncClient ignores `data` on GET in Django 3.1
+                url = reverse('api-async-' + name, kwargs=kwargs) + '?' + urlencode(params)
+                resp = async_to_sync(client.get)(url)
+                self.assertEqual(resp.status_code, 200)
+                self.assertFalse(resp.streaming)
+                content = b''.join(expected.streaming_content) if expected.streaming else expected.content
+                self.assertEqual(resp.content, content)
+                self.assertEqual(resp['ETag'], expected['ETag'])
+        client.force_login(get_user_model().objects.get(username='guest'))
+        resp = async_to_sync(client.get)(reverse('api-async-purchase', args=[self.wedding.pk]))
+        self.assertEqual(resp.json(), [])
+        # the queries from the thread pool are counted too
+        self.assertGreater(registry.endpoints['api-async-purchase', 'GET'].queries.sum, 0)
+
+    def test_profiled_one_at_a_time(self):
+        from django.test import AsyncClient
+        staff = get_user_model().objects.create_user('staff', is_staff=True)
+        client = AsyncClient()
+        client.force_login(staff)
+        url = reverse('api-async-product') + '?_profile=1'
+
+        async def requests():
+            return await asyncio.gather(*[client.get(url) for _ in range(3)],
+                                        client.get(reverse('api-async-currency')))
+
+        with tempfile.TemporaryDirectory() as tmp, override_settings(GLIST_PROFILE_DIR=tmp):
+            *profiled, plain = asyncio.run(requests())
+            self.assertEqual(sorted(r['X-Glist-Profile'] for r in profiled), profiling.entries()[::-1])
+            self.assertEqual(len({r.content for r in profiled}), 1)
+            self.assertFalse(plain.has_header('X-Glist-Profile'))
+            # the view and its queries ran within the profile, from the
+            # async API or a synchronous view alike
+            self.assertIn('(product_list)', profiling.summary(profiled[0]['X-Glist-Profile'], 400))
+            self.assertIn('(execute_sql)', profiling.summary(profiled[0]['X-Glist-Profile'], 400))
+            resp = asyncio.run(client.get(reverse('api-product') + '?_profile=1'))
+            self.assertIn('(product_list)', profiling.summary(resp['X-Glist-Profile'], 400))
+            self.assertIn('(execute_sql)', profiling.summary(resp['X-Glist-Profile'], 400))
+
+
+class TestReportCache(DataSetuoMixin, TestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        self.bride = get_user_model().objects.get(username='bride')
+        self.wedding = GiftList.objects.get(user=self.bride)
+        self.item = GiftListItem.objects.create(gift_list=self.wedding, qty=2,
+                                                added_by=self.bride, product_id=12)
+        self.client.force_login(self.bride)
+
+    def test_repeat_download(self):
+        resp = self.client.get(reverse('report'))
+        self.assertEqual(resp['Content-Type'], 'application/pdf')
+        # session, user, gift list and versions only
+        with self.assertNumQueries(4):
+            again = self.client.get(reverse('report'))
+        self.assertEqual(again.content, resp.content)
+
+    def test_invalidation(self):
+        self.client.get(reverse('report'))
+        Purchase.objects.create(item=self.item, customer=Guest.objects.get(),
+                                total=Decimal('139.99'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('report'))
+        self.assertGreater(len(queries), 3)
+
+    def test_lru_eviction(self):
+        from .reports import ReportCache
+        cache = ReportCache(max_bytes=10)
+        cache.set(1, 'v1', b'1234')
+        cache.set(2, 'v1', b'1234')
+        self.assertEqual(cache.get(1, 'v1'), b'1234')
+        cache.set(3, 'v1', b'1234')
+        self.assertIsNone(cache.get(2, 'v1'))
+        self.assertIsNone(cache.get(1, 'v2'))
+        cache.set(1, 'v2', b'12')
+        self.assertEqual((cache.get(1, 'v2'), cache.size), (b'12', 6))
+        cache.set(4, 'v1', b'12345678901')
+        self.assertIsNone(cache.get(4, 'v1'))
+
+    def test_fast_renderer(self):
+        from .reports import purchased_rows, remaining_rows, render_report
+        guest = Guest.objects.get()
+        for _ in range(2):
+            Purchase.objects.create(item=self.item, customer=guest, total=Decimal('139.99'))
+        GiftListItem.objects.filter(pk=self.item.pk).update(qty=3, qty_purchased=2)
+        rows = list(purchased_rows(self.wedding.pk))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['cnt'], rows[0]['amount']), (2, Decimal('279.98')))
+        self.assertEqual([r['total'] for r in remaining_rows(self.wedding.pk)], [1])
+        for fast in (True, False):
+            self.assertTrue(render_report(self.wedding.pk, fast=fast).startswith(b'%PDF'))
+
+
+class TestBenchmark(TestCase):
+
+    def test_generated_data(self):
+        counts = datagen.generate(3)
+        self.assertEqual(counts['products'], 3 * datagen.RATIOS['products'])
+        self.assertEqual(Guest.objects.count(), 3 * datagen.RATIOS['guests'])
+        self.assertEqual(GiftListItem.objects.count(), 3 * datagen.RATIOS['items'])
+        self.assertEqual(Purchase.objects.count(), counts['purchases'])
+        # summaries, stock reservations and purchases all agree
+        self.assertEqual(summary.reconcile(), [])
+        for product in Product.objects.annotate(
+                wanted=Sum(F('giftlistitem__qty') - F('giftlistitem__qty_purchased'))):
+            self.assertEqual(product.qty_reserved, product.wanted or 0)
+            self.assertGreaterEqual(product.qty, product.qty_reserved)
+        self.assertFalse(Purchase.objects.exclude(customer__wedding=F('item__gift_list')).exists())
+        names = list(Product.objects.order_by('pk').values_list('name', flat=True))
+        Product.objects.all().delete()
+        datagen.generate(3)
+        self.assertEqual(list(Product.objects.order_by('pk').values_list('name', flat=True))[:5],
+                         names[:5])
+
+    def test_single_list(self):
+        # fewer products per list than items in one
+        counts = datagen.generate(1)
+        self.assertEqual(counts['products'], datagen.RATIOS['items'])
+        self.assertEqual(GiftListItem.objects.count(), datagen.RATIOS['items'])
+        self.assertEqual(summary.reconcile(), [])
+
+    def test_regressions(self):
+        baseline = {'a_ms': 10, 'b_rows_per_s': 100, 'c_queries': 3, 'd_us': -5, 'e_ms': 1}
+        self.assertEqual(regressions(baseline, {'a_ms': 12, 'b_rows_per_s': 80, 'c_queries': 3,
+                                                'd_us': 50, 'f_ms': 99}, 0.25), [])
+        self.assertEqual(regressions(baseline, {'a_ms': 13, 'b_rows_per_s': 70, 'c_queries': 4,
+                                                'e_ms': 0.5}, 0.25),
+                         ['a_ms: 13.00, baseline 10.00', 'b_rows_per_s: 70.00, baseline 100.00',
+                          'c_queries: 4.00, baseline 3.00'])
+
+    def test_baseline_comparison(self):
+        out = StringIO()
+        with tempfile.NamedTemporaryFile(suffix='.json') as f:
+            with mock.patch.dict(SCENARIOS, {'fake': lambda size: {'x_ms': 10}}, clear=True):
+                call_command('benchmark', save_baseline=f.name, size=5, stdout=out)
+                call_command('benchmark', compare=f.name, size=5, stdout=out)
+                self.assertIn('No regressions', out.getvalue())
+                with self.assertRaisesMessage(CommandError, 'taken with --size 5'):
+                    call_command('benchmark', compare=f.name, size=6, stdout=out)
+            with mock.patch.dict(SCENARIOS, {'fake': lambda size: {'x_ms': 20}}, clear=True):
+                with self.assertRaisesMessage(CommandError, 'fake.x_ms: 20.00, baseline 10.00'):
+                    call_command('benchmark', compare=f.name, size=5, stdout=out)
+
+
+class TestBenchmarkScenarios(TransactionTestCase):
+    """
+    Scenarios build a database of their own, out of any transaction
+    """
+
+    def test_endpoint_queries(self):
+        # after scenarios that ran more queries than the query log keeps
+        with CaptureQueriesContext(connection):
+            for _ in range(connection.queries_limit):
+                Product.objects.exists()
+        results = SCENARIOS['endpoints'](1, repeat=1)
+        for name in ('couple', 'api_gift_add_remove', 'api_checkout'):
+            self.assertGreater(results['%s_queries' % name], 0)
+
+
+class TestProfiling(DataSetuoMixin, TestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings = override_settings(GLIST_PROFILE_DIR=tmp.name, GLIST_PROFILE_KEEP=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.wedding = GiftList.objects.get()
+        GiftListItem.objects.create(gift_list=self.wedding, qty=2, product_id=12,
+                                    added_by=self.wedding.user)
+        self.url = reverse('api-gift-view', args=[self.wedding.pk])
+        self.staff = get_user_model().objects.create_user('staff', is_staff=True)
+
+    def test_only_when_asked(self):
+        self.client.force_login(self.wedding.user)
+        self.client.get(self.url)
+        self.client.get(self.url, {'_profile': 1})
+        self.client.get(self.url, HTTP_X_GLIST_PROFILE='profile:forged')
+        self.assertEqual(profiling.entries(), [])
+        # tokens only work for the user they were issued to
+        self.client.get(self.url, HTTP_X_GLIST_PROFILE=profiling.make_token(self.staff))
+        self.assertEqual(profiling.entries(), [])
+        resp = self.client.get(self.url, HTTP_X_GLIST_PROFILE=profiling.make_token(self.wedding.user))
+        self.assertEqual(profiling.entries(), [resp['X-Glist-Profile']])
+        # read out within the profile
+        self.assertFalse(resp.streaming)
+        self.assertEqual(len(resp.json()), 1)
+
+    def test_staff_flag_and_browsing(self):
+        self.client.force_login(self.staff)
+        names = [self.client.get(reverse('api-product'), {'_profile': 1})['X-Glist-Profile']
+                 for _ in range(3)]
+        # a ring of GLIST_PROFILE_KEEP
+        self.assertEqual(profiling.entries(), names[:0:-1])
+        meta = profiling.metadata(names[-1])
+        self.assertEqual((meta['view'], meta['status'], meta['user']), ('api-product', 200, 'staff'))
+
+        resp = self.client.get(reverse('profiles'))
+        self.assertContains(resp, names[-1])
+        self.assertNotContains(resp, names[0])
+        self.assertContains(self.client.get(reverse('profile', args=[names[-1]])), 'cumulative')
+        resp = self.client.get(reverse('profile', args=[names[-1]]), {'download': 'prof'})
+        self.assertEqual(resp['Content-Disposition'], 'attachment; filename="%s.prof"' % names[-1])
+        resp.close()
+        self.assertEqual(self.client.get(reverse('profile', args=[names[0]])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('profile', args=['..'])).status_code, 404)
+
+        self.client.force_login(self.wedding.user)
+        self.assertEqual(self.client.get(reverse('profiles')).status_code, 302)
+
+
+class TestExports(DataSetuoMixin, TestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        self.bride = get_user_model().objects.get(username='bride')
+        self.wedding = GiftList.objects.get(user=self.bride)
+        item = GiftListItem.objects.create(gift_list=self.wedding, qty=3, qty_purchased=1,
+                                           added_by=self.bride, product_id=12)
+        Purchase.objects.create(item=item, customer=Guest.objects.get(), total=Decimal('139.99'))
+
+    def csv(self, resp):
+        return b''.join(resp.streaming_content).decode().splitlines()
+
+    def test_couple_export(self):
+        self.client.force_login(self.bride)
+        purchased = self.csv(self.client.get(reverse('export', args=['purchased'])))
+        self.assertEqual(len(purchased), 2)
+        self.assertTrue(purchased[1].startswith('%d,12,' % self.wedding.pk))
+        self.assertIn(',139.99,M Guest,', purchased[1])
+        remaining = self.csv(self.client.get(reverse('export', args=['remaining'])))
+        self.assertEqual(remaining[1].split(',')[-1], '2')
+        resp = self.client.get(reverse('export', args=['other']))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_export_all(self):
+        self.client.force_login(self.bride)
+        resp = self.client.get(reverse('export-all', args=['purchased']))
+        self.assertEqual(resp.status_code, 302)
+        staff = get_user_model().objects.create_user('staff', is_staff=True, is_superuser=True)
+        self.client.force_login(staff)
+        resp = self.client.get(reverse('export-all', args=['remaining']))
+        self.assertEqual(len(self.csv(resp)), 2)
+        resp = self.client.post(reverse('admin:glist_giftlist_changelist'),
+                                {'action': 'export_purchased', '_selected_action': [self.wedding.pk]})
+        self.assertEqual(resp['Content-Type'], 'text/csv')
+        self.assertEqual(len(self.csv(resp)), 2)
+
+
+class TestReportJobs(TransactionTestCase):
+
+    fixtures = ['brands', 'prods']
+
+    def setUp(self) -> None:
+        DataSetuoMixin.setUpTestData()
+        self.bride = get_user_model().objects.get(username='bride')
+        self.wedding = GiftList.objects.get(user=self.bride)
+        GiftListItem.objects.create(gift_list=self.wedding, qty=2,
+                                    added_by=self.bride, product_id=12)
+        self.client.force_login(self.bride)
+
+    def test_async_report(self):
+        from .jobs import get_job
+        resp = self.client.get(reverse('report'), {'async': 1})
+        self.assertEqual(resp.status_code, 202)
+        job_id = resp.json()['job']
+        # identical requests share the job
+        self.assertEqual(self.client.get(reverse('report'), {'async': 1}).json()['job'], job_id)
+        self.assertTrue(get_job(job_id).finished.wait(10))
+        url = reverse('report-job', kwargs=dict(job_id=job_id))
+        status = self.client.get(url).json()
+        self.assertEqual((status['status'], status['progress']), ('done', 100))
+        resp = self.client.get(status['download'])
+        self.assertEqual(resp['Content-Type'], 'application/pdf')
+        self.assertTrue(resp.content.startswith(b'%PDF'))
+
+    def test_download_after_eviction(self):
+        from .jobs import get_job
+        from .reports import report_cache
+        job_id = self.client.get(reverse('report'), {'async': 1}).json()['job']
+        job = get_job(job_id)
+        self.assertTrue(job.finished.wait(10))
+        # evicted: the job holds no copy, the report is rendered again
+        url = reverse('report-job', kwargs=dict(job_id=job_id)) + '?download=1'
+        with mock.patch.object(report_cache, 'get', return_value=None):
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 202)
+        self.assertTrue(get_job(resp.json()['job']).finished.wait(10))
+        self.assertTrue(self.client.get(url).content.startswith(b'%PDF'))
+
+    def test_job_from_another_process(self):
+        from .jobs import get_job, jobs
+        job_id = self.client.get(reverse('report'), {'async': 1}).json()['job']
+        self.assertTrue(get_job(job_id).finished.wait(10))
+        # as if polled on a worker that never saw the job
+        jobs.clear()
+        url = reverse('report-job', kwargs=dict(job_id=job_id))
+        status = self.client.get(url).json()
+        self.assertEqual(status['job'], job_id)
+        self.assertTrue(get_job(job_id).finished.wait(10))
+        self.assertTrue(self.client.get(url + '?download=1').content.startswith(b'%PDF'))
+        for bad in ('%d' % self.wedding.pk, 'x-1-2', '999-1-2-3'):
+            self.assertEqual(self.client.get(reverse('report-job', kwargs=dict(job_id=bad))).status_code,
+                             404)
+
+    def test_job_owner(self):
+        from .jobs import submit_report
+        job = submit_report(self.wedding.pk)
+        job.finished.wait(10)
+        self.client.force_login(get_user_model().objects.get(username='guest'))
+        resp = self.client.get(reverse('report-job', kwargs=dict(job_id=job.id)))
+        self.assertEqual(resp.status_code, 404)
+
+
+class TestInvitations(DataSetuoMixin, TestCase):
+
+    def setUp(self) -> None:
+        self.wedding = GiftList.objects.get()
+        Guest.objects.bulk_create([
+            Guest(email='guest%d@example.com' % i, recipient='Guest %d' % i, wedding=self.wedding,
+                  user=self.wedding.user) for i in range(9)])
+
+    def test_batches_and_resume(self):
+        calls = []
+        send_messages = locmem.EmailBackend.send_messages
+
+        def flaky(backend, messages):
+            calls.append(messages[0].to[0])
+            if messages[0].to[0] in ('guest2@example.com', 'guest7@example.com'):
+                raise SMTPException('Try again later')
+            return send_messages(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', flaky):
+            sent, errors = invitations.send_invitations(self.wedding, workers=2, batch_size=3)
+        # one message at a time, the others of a batch go out regardless
+        self.assertEqual(len(calls), 10)
+        self.assertEqual(sorted(errors), ['guest2@example.com: Try again later',
+                                          'guest7@example.com: Try again later'])
+        self.assertEqual(sent, len(mail.outbox))
+        self.assertEqual(sent, 8)
+        # only the guests mailed are stamped
+        self.assertEqual(sorted(Guest.objects.filter(invited_at__isnull=True
+                                                     ).values_list('email', flat=True)),
+                         ['guest2@example.com', 'guest7@example.com'])
+
+        # picks up the failed messages only
+        sent_again, errors = invitations.send_invitations(self.wedding, batch_size=3)
+        self.assertEqual((sent_again, errors), (2, []))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox),
+                         sorted(Guest.objects.values_list('email', flat=True)))
+        self.assertEqual(invitations.send_invitations(self.wedding), (0, []))
+
+        message = next(m for m in mail.outbox if m.to == ['guest@weddinshop.com'])
+        self.assertEqual(message.subject, "Ms Dude & Mr Dude's wedding gift list")
+        self.assertTrue(message.body.startswith('Dear M Guest,'))
+        self.assertIn('http://localhost:8000/guest/%d/' % self.wedding.pk, message.body)
+
+    def test_file_backend_and_rate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with override_settings(EMAIL_BACKEND='django.core.mail.backends.filebased.EmailBackend',
+                                   EMAIL_FILE_PATH=tmp):
+                start = time.monotonic()
+                sent, errors = invitations.send_invitations(self.wedding, batch_size=5, rate=50)
+                # the second batch waits for the first 5 messages' 0.1s
+                self.assertGreaterEqual(time.monotonic() - start, 0.09)
+            self.assertEqual((sent, errors), (10, []))
+            # one file per connection, unless the second one gets the name
+            # of the first (a timestamp in seconds and the backend's id)
+            written = ''
+            for name in os.listdir(tmp):
+                with open(os.path.join(tmp, name)) as f:
+                    written += f.read()
+            self.assertEqual(written.count('\n' + '-' * 79 + '\n'), 10)
+
+    def test_command_and_admin_action(self):
+        out = StringIO()
+        call_command('send_invitations', stdout=out)
+        self.assertEqual(out.getvalue(), 'Gift list %d: 10 invitations sent\n' % self.wedding.pk)
+        call_command('send_invitations', str(self.wedding.pk), resend=True, stdout=out)
+        self.assertEqual(len(mail.outbox), 20)
+
+        Guest.objects.update(invited_at=None)
+        staff = get_user_model().objects.create_superuser('staff', 'staff@example.com', 'staff')
+        self.client.force_login(staff)
+        with mock.patch.object(invitations.executor, 'submit', lambda run: run()):
+            resp = self.client.post(reverse('admin:glist_giftlist_changelist'), {
+                'action': 'send_invitations', '_selected_action': [self.wedding.pk]}, follow=True)
+        self.assertContains(resp, 'in the background')
+        resp = self.client.get(reverse('admin:glist_guest_changelist'),
+                               {'invited_at__isempty': 1, 'wedding__in': self.wedding.pk})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(mail.outbox), 30)
+        self.assertFalse(Guest.objects.filter(invited_at__isnull=True).exists())
@@ -1,20 +1,46 @@
 from django.urls import include, path
 from django.views.generic.base import TemplateView
 
-from . import api, views
+from . import api, async_api, views
 
 
 urlpatterns = [
     path('', TemplateView.as_view(template_name='glist/index.html'), name='index'),
     path('couple/', views.couple, name='couple'),
     path('report/', views.report, name='report'),
+    path('report/job/<str:job_id>/', views.report_job, name='report-job'),
+    path('export/<str:kind>/', views.export, name='export'),
+    path('export/all/<str:kind>/', views.export_all, name='export-all'),
     path('guest/<int:gift_list_id>/', views.guest, name='guest'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('profiles/', views.profiles, name='profiles'),
+    path('profiles/<str:name>/', views.profile, name='profile'),
+    # served by glist.sse under ASGI
+    path('events/list/<int:gift_list_id>/', views.list_events, name='list-events'),
     path('api/', include([
         path('currency/', api.currency_list, name='api-currency'),
         path('brand/', api.brand_list, name='api-brand'),
         path('product/', api.product_list, name='api-product'),
+        path('product/search/', api.product_search, name='api-product-search'),
+        path('product/browse/', api.product_browse, name='api-product-browse'),
         path('list/', api.gift, name='api-gift'),  # list + add
-        path('list/<int:item_id>/', api.gift_item, name='api-gift-item'),  # delete
+        path('list/batch/', api.gift_batch, name='api-gift-batch'),
+        path('list/<int:item_id>/', api.gift_item, name='api-gift-item'),  # delete + update
+        path('list/<int:gift_list_id>/items/', api.gift_list_view, name='api-gift-view'),
+        path('list/<int:gift_list_id>/summary/', api.gift_list_summary, name='api-gift-summary'),
         path('list/<int:gift_list_id>/purchase/', api.purchase, name='api-purchase'),  # list + add
+        path('list/<int:gift_list_id>/checkout/', api.checkout, name='api-checkout'),
+    ])),
+    # the read-only endpoints again, as async views for ASGI deployments
+    path('api/async/', include([
+        path('currency/', async_api.currency_list, name='api-async-currency'),
+        path('brand/', async_api.brand_list, name='api-async-brand'),
+        path('product/', async_api.product_list, name='api-async-product'),
+        path('product/search/', async_api.product_search, name='api-async-product-search'),
+        path('list/<int:gift_list_id>/items/', async_api.gift_list_view, name='api-async-gift-view'),
+        path('list/<int:gift_list_id>/summary/', async_api.gift_list_summary,
+             name='api-async-gift-summary'),
+        path('list/<int:gift_list_id>/purchase/', async_api.purchase_list,
+             name='api-async-purchase'),
     ]))
     ]
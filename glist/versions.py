@@ -0,0 +1,68 @@
+"""
+Version counters used to tell whether cached representations are stale
+
+Counters are rows of the Version table, bumped in the same transaction as
+the change they stand for: every process and worker sees them, and a
+reader never gets the new version with the old data. Writers of the same
+counter queue on its row until they commit, so counters bumped by many
+unrelated writers at once are spread over SHARDS rows, picked by a key of
+the change: their version is the sum of those rows.
+"""
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Version
+
+# counter name: rows it is spread over
+SHARDS = {
+    'stock': 64,
+}
+
+
+def _seed():
+    # Not starting from 0, a recreated database never hands out a version seen before
+    return int(time.time() * 1000)
+
+
+def _create(name: str) -> int:
+    try:
+        with transaction.atomic():
+            return Version.objects.create(name=name, value=_seed()).value
+    except IntegrityError:
+        # created concurrently
+        return Version.objects.get(name=name).value
+
+
+def get_versions(*names) -> list:
+    """
+    The versions of `names`, in one query
+    """
+    shards = {'%s:%d' % (name, n): name for name in names if name in SHARDS
+              for n in range(SHARDS[name])}
+    rows = Version.objects.filter(name__in=names + tuple(shards)).values_list('name', 'value')
+    values = {}
+    for name, value in rows:
+        # shards add up to their counter, along with its own row
+        name = shards.get(name, name)
+        values[name] = values.get(name, 0) + value
+    return [values[name] if name in values else _create(name) for name in names]
+
+
+def get_version(name: str) -> int:
+    return get_versions(name)[0]
+
+
+def bump_version(name: str, key: int = None):
+    """
+    `key` picks the row of a counter in SHARDS, its own row without one
+    """
+    if key is not None and name in SHARDS:
+        name = '%s:%d' % (name, key % SHARDS[name])
+    if not Version.objects.filter(name=name).update(value=F('value') + 1):
+        _create(name)
+
+
+def list_version_name(gift_list_id: int) -> str:
+    return 'giftlist:%d' % gift_list_id
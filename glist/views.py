@@ -1,20 +1,18 @@
-from io import BytesIO
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.db.models.aggregates import Sum
-from django.db.models.expressions import F
-from django.http import HttpResponse, HttpResponseForbidden
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, JsonResponse
 from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
 from django.views.decorators.csrf import ensure_csrf_cookie
 
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import (SimpleDocTemplate, Paragraph, Spacer, Table,
-                                TableStyle, PageBreak)
-
-from .models import GiftList, GiftListItem, Guest, Purchase
+from .exports import csv_response
+from .jobs import get_job, job_gift_list, submit_report
+from .metrics import CONTENT_TYPE, registry
+from . import profiling
+from .models import GiftList, Guest
+from .reports import get_report
 
 
 @login_required
@@ -57,63 +55,6 @@ def guest(request, gift_list_id: int):
     return render(request, 'glist/guest.html', locals())
 
 
-def purchased_table(gift_list_id: int) -> list:
-    """
-    Generates the list of purchased items
-    Return a list a list-of-lists of flowables
-    to be used as platypus.Table content
-    """
-    ss = getSampleStyleSheet()
-    s = ss['Normal']
-    table = [
-        [Paragraph('Name', s), Paragraph('Brand', s),
-         Paragraph('Price', s), Paragraph('Qty', s),
-         Paragraph('Guest', s), Paragraph('Date', s)
-         ],
-    ]
-    purchases = Purchase.objects.select_related('item__product__brand', 'customer'
-                                                ).filter(
-        item__gift_list_id=gift_list_id, item__gift_list__active=True
-    ).annotate(cnt=Sum('qty')).order_by('-date_paid', '-total')
-    for p in purchases:
-        table.append([
-            Paragraph(p.item.product.name, s),
-            Paragraph(p.item.product.brand.name, s),
-            Paragraph('%s' % p.item.get_price(), s),
-            Paragraph('%d' % p.cnt, s),
-            Paragraph('%s' % p.customer.recipient, s),
-            Paragraph(p.date_paid.strftime('%y-%m-%d'), s),
-        ])
-    return table
-
-
-def remaining_table(gift_list_id: int) -> list:
-    """
-    Generates the list of tems which were not [yet] purchased
-    Items which have multiple amounts are grouped and their
-    corresponding counts returned
-
-    Return a list a list-of-lists of flowables
-    to be used as platypus.Table content
-    """
-    ss = getSampleStyleSheet()
-    s = ss['Normal']
-    table = [
-        [Paragraph('Name', s), Paragraph('Brand', s), Paragraph('Qty', s)],
-    ]
-    remaining = GiftListItem.objects.select_related(
-        'product__brand').filter(gift_list_id=gift_list_id, gift_list__active=True
-                                 ).annotate(left=F('qty') - F('qty_purchased')
-                                            ).filter(left__gt=0).annotate(total=Sum('left'))
-    for r in remaining:
-        table.append([
-            Paragraph(r.product.name, s),
-            Paragraph(r.product.brand.name, s),
-            Paragraph('%d' % r.total, s),
-        ])
-    return table
-
-
 @login_required
 @ensure_csrf_cookie
 def report(request):
@@ -121,38 +62,120 @@ def report(request):
     Return a PDF in the response body with list of
     purchased items followed by that list of items
     which are remaining in the GiftList
+    Unless the list changed, repeat downloads come from the report cache
+    With `?async=1` the PDF is rendered in the background instead, and
+    the job to poll at `report_job` is returned
     """
     wedding = get_object_or_404(GiftList, user=request.user, active=True)
-    gift_list_id = wedding.pk
-
-    ss = getSampleStyleSheet()
-    sH = ss['Heading1']
-
-    list_style = TableStyle(
-        [('LINEBELOW', (0, 0), (-1, -1), 1, colors.grey),
-         ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-         ('ALIGN', (1, 0), (-1, -1), 'LEFT'),
-         ])
-
-    story1 = [
-        Paragraph('Purchased Gifts', sH),
-        Spacer(1, 0.2 * inch),
-        Table(purchased_table(gift_list_id), colWidths=(150, 100, 60, 30, 75, 55),
-              style=list_style)
-    ]
-    story2 = [
-        Paragraph('Not Purchased Gifts', sH),
-        Spacer(1, 0.2 * inch),
-        Table(remaining_table(gift_list_id), colWidths=(300, 150, 30),
-              style=list_style)
-    ]
-
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    story1.append(PageBreak())
-    story1.extend(story2)
-    doc.build(story1)
-
-    response = HttpResponse(buffer.getvalue(), content_type='application/pdf')
+
+    if request.GET.get('async'):
+        job = submit_report(wedding.pk)
+        return report_job_status(job, status=202)
+    return pdf_response(get_report(wedding.pk))
+
+
+def pdf_response(pdf: bytes) -> HttpResponse:
+    response = HttpResponse(pdf, content_type='application/pdf')
     response['Content-Disposition'] = 'attachment; filename=report.pdf'
     return response
+
+
+def report_job_status(job, status=200) -> JsonResponse:
+    output = job.as_dict()
+    if job.status == 'done':
+        output['download'] = reverse('report-job', kwargs=dict(job_id=job.id)) + '?download=1'
+    return JsonResponse(output, status=status)
+
+
+@login_required
+def report_job(request, job_id: str):
+    """
+    Progress of a background report, or with `?download=1` the finished PDF
+    """
+    gift_list_id = job_gift_list(job_id)
+    if gift_list_id is None or not GiftList.objects.filter(pk=gift_list_id, user=request.user).exists():
+        raise Http404()
+    job = get_job(job_id)
+    if job is None:
+        # submitted to another process, or dropped from this one's registry
+        job = submit_report(gift_list_id)
+    if request.GET.get('download') and job.status == 'done':
+        pdf = job.pdf()
+        if pdf is not None:
+            return pdf_response(pdf)
+        # evicted from the report cache since
+        return report_job_status(submit_report(job.gift_list_id), status=202)
+    return report_job_status(job)
+
+
+def list_events(request, gift_list_id: int):
+    """
+    Gift list events are served by `glist.sse` under ASGI, this answers
+        when running under WSGI: 204 tells browsers not to reconnect
+    """
+    return HttpResponse(status=204)
+
+
+EXPORTS = ('purchased', 'remaining')
+
+
+@login_required
+def export(request, kind: str):
+    """
+    CSV of the purchased or remaining items of the couple's GiftList
+    """
+    if kind not in EXPORTS:
+        raise Http404()
+    wedding = get_object_or_404(GiftList, user=request.user, active=True)
+    return csv_response(kind, wedding.pk)
+
+
+@staff_member_required
+def export_all(request, kind: str):
+    """
+    CSV of the purchased or remaining items of every active GiftList
+    """
+    if kind not in EXPORTS:
+        raise Http404()
+    return csv_response(kind)
+
+
+def metrics(request):
+    """
+    Request metrics in Prometheus text format, for staff, or scrapers
+        sending `Authorization: Bearer <GLIST_METRICS_TOKEN>`
+    """
+    token = getattr(settings, 'GLIST_METRICS_TOKEN', None)
+    bearer = request.META.get('HTTP_AUTHORIZATION', '')
+    if not (request.user.is_staff or token and constant_time_compare(bearer, 'Bearer ' + token)):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
+
+
+@staff_member_required
+def profiles(request):
+    """
+    The saved request profiles, and a token to ask for more
+    """
+    entries = [profiling.metadata(name) for name in profiling.entries()]
+    token = profiling.make_token(request.user)
+    return render(request, 'glist/profiles.html', {
+        'entries': entries, 'token': token, 'title': 'Request profiles'})
+
+
+@staff_member_required
+def profile(request, name: str):
+    """
+    Costliest calls of a saved profile, or with `download` its .prof
+        (or `download=html` its sampling profile)
+    """
+    ext = '.html' if request.GET.get('download') == 'html' else '.prof'
+    try:
+        if 'download' in request.GET:
+            return FileResponse(open(profiling.file_path(name, ext), 'rb'), as_attachment=True,
+                                filename=name + ext)
+        summary = profiling.summary(name)
+    except FileNotFoundError:
+        raise Http404()
+    return render(request, 'glist/profile.html', {
+        'meta': profiling.metadata(name), 'summary': summary, 'title': name})
@@ -1,7 +1,8 @@
 """
-ASGI config for weshop project.
+ASGI config for wshop project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Gift list events are served by `glist.sse`, the rest by Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
@@ -11,6 +12,10 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'weshop.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wshop.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from glist.sse import router  # noqa: E402, needs the apps loaded
+
+application = router(django_application)